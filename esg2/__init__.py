@@ -12,6 +12,19 @@ def create_app(test_config=None):
         DATABASE=os.path.join(app.instance_path, 'esg2.sqlite'),
         UPLOAD_FOLDER=os.path.join(app.instance_path, 'csv'),
         SEND_FILE_MAX_AGE_DEFAULT=0,
+        SQLITE_JOURNAL_MODE='WAL',
+        SQLITE_SYNCHRONOUS='NORMAL',
+        SQLITE_BUSY_TIMEOUT=5000,
+        SQLITE_CACHE_SIZE=-16000,
+        SQLITE_CACHED_STATEMENTS=256,
+        SQLITE_REUSE_CONNECTION=True,
+        SCOREBOARD_STREAM_KEEPALIVE=15,
+        SUMMARY_PAGE_SIZE=48,
+        SUMMARY_CHART_POINTS=250,
+        HOURLY_CHART_LOD_UNITS=500,
+        HOURLY_CHART_PIXELS=1600,
+        COMPRESS_MIN_SIZE=1024,
+        COMPRESS_LEVEL=6,
     )
 
     if test_config is None:
@@ -42,6 +55,9 @@ def create_app(test_config=None):
     from . import db
     db.init_app(app)
 
+    from . import responses
+    responses.init_app(app)
+
     from . import auth
     app.register_blueprint(auth.bp)
 
@@ -57,6 +73,9 @@ def create_app(test_config=None):
     from . import scoreboard
     app.register_blueprint(scoreboard.bp)
 
+    from . import api
+    app.register_blueprint(api.bp)
+
     @app.route('/')
     def index():
         return render_template('index.html')
@@ -4,15 +4,18 @@ import decimal
 import pandas as pd
 
 from flask import (
-    Blueprint, flash, g, redirect, render_template, request, send_from_directory, session, url_for, current_app
+    Blueprint, flash, g, jsonify, redirect, render_template, request, send_from_directory, session, url_for, current_app
 )
 
-from esg2.db import get_db
+from esg2 import bid_store, scoreboard
+from esg2.db import get_db, lock_waits
 from esg2.auth import admin_login_required
+from esg2.cache import chart_cache, file_cache
+from esg2.events import hour_events
 from esg2.utilities import (
-    make_pretty_header, get_game_setting, get_portfolio_names_list, 
-    first_incomplete_summary_row, round_hour_names, form_entry_to_tuple)
-from . import engine
+    make_pretty_header, get_game_setting, get_portfolio_names_list, get_portfolio_id_by_name,
+    get_game_progress, get_schedule, round_hour_names, form_entry_to_tuple)
+from . import engine, persistence
 
 bp = Blueprint('admin', __name__, url_prefix='')
 
@@ -65,7 +68,12 @@ def config_upload():
             return redirect(request.url)
         if file and allowed_file(file.filename):
             filename = request.form['filename'] + '.csv'
-            file.save(os.path.join(current_app.instance_path, 'csv', 'config', filename))
+            path = os.path.join(current_app.instance_path, 'csv', 'config', filename)
+            file.save(path)
+            # The new file may have the same mtime and size as the old one
+            file_cache.invalidate(path)
+            chart_cache.invalidate()
+            persistence.clear_chart_artifacts(get_db())
             flash('File uploaded successfully')
             return redirect(url_for('admin.config_upload'))
     return render_template('admin/config_upload.html')
@@ -74,6 +82,16 @@ def config_upload():
 def uploaded_config_file(filename):
     return send_from_directory(os.path.join(current_app.instance_path, 'csv', 'config'), filename)
 
+@bp.route('/admin/cache-stats')
+@admin_login_required
+def cache_stats():
+    return jsonify(dict(file_cache.stats(), charts=chart_cache.stats()))
+
+@bp.route('/admin/db-stats')
+@admin_login_required
+def db_stats():
+    return jsonify(lock_waits.stats())
+
 @bp.route('/admin/delete-user', methods=['POST'])
 @admin_login_required
 def delete_user():
@@ -133,8 +151,7 @@ def set_starting_money():
 def set_portfolio():
     portfolio = request.form['portfolio']
 
-    portfolios_df = pd.read_csv(os.path.join(current_app.instance_path, 'csv', 'config', 'portfolios.csv'))
-    portfolio_id = int(portfolios_df.loc[portfolios_df['portfolio_name'] == portfolio, 'portfolio_id'].iloc[0])
+    portfolio_id = get_portfolio_id_by_name(portfolio)
 
     db = get_db()
     players = db.execute(
@@ -176,17 +193,13 @@ def start_game():
     players_df.to_csv(os.path.join(current_app.instance_path, 'csv', 'players.csv'), index=False)
 
     # Create summary, hourly, bids sheets
-    schedule_df = pd.read_csv(os.path.join(current_app.instance_path, 'csv', 'config', 'schedule.csv'))
-    schedule_df = schedule_df.sort_values(by=['round', 'hour'], ascending=[True, True])
-    portfolios_df = pd.read_csv(os.path.join(current_app.instance_path, 'csv', 'config', 'portfolios.csv'))
-    engine.create_summary_sheet(schedule_df, players_df)
-    engine.create_hourly_sheets(schedule_df, portfolios_df)
-    engine.create_bids_sheet(schedule_df, portfolios_df)
-
-    # Create bids table
-    bids_df = pd.read_csv(os.path.join(current_app.instance_path, 'csv', 'bids.csv'))
-    bids_df.to_sql('bids', db, index=False, if_exists='replace')
-    db.commit()
+    schedule_df = persistence.read_schedule(current_app.instance_path)
+    portfolios_df = persistence.read_portfolios(current_app.instance_path)
+    bids_df = persistence.create_game_sheets(current_app.instance_path, db, schedule_df, portfolios_df, players_df)
+
+    # Create bids tables
+    bid_store.create_bid_tables(db, bids_df, schedule_df)
+    chart_cache.invalidate()
 
     flash("Game initialized!")
     return redirect(url_for('admin.config'))
@@ -194,36 +207,29 @@ def start_game():
 @bp.route('/admin/dashboard', methods=['GET', 'POST'])
 @admin_login_required
 def admin_dashboard():
-    schedule_df = pd.read_csv(os.path.join(current_app.instance_path, 'csv', 'config', 'schedule.csv'))
+    schedule = get_schedule()
 
     if request.method == 'POST':
-        portfolios_df = pd.read_csv(os.path.join(current_app.instance_path, 'csv', 'config', 'portfolios.csv'))
-        players_df = pd.read_csv(os.path.join(current_app.instance_path, 'csv', 'players.csv'))
-        summary_df = pd.read_csv(os.path.join(current_app.instance_path, 'csv', 'summary.csv'))
-
-        schedule_df = schedule_df.sort_values(by=['round', 'hour'], ascending=[True, True])
-        players_df = players_df.sort_values(by=['portfolio_id'], ascending=[True])
-
-        pending_bids_df = get_pending_bids().sort_values(['unit_id'], ascending=True)
-
         r_h = request.form['hour-select']
         r, h = r_h.split('/')
-
-        commit_bids(pending_bids_df, r, h)
-
         r = int(r)
         h = int(h)
-        bids_df = pd.read_csv(os.path.join(current_app.instance_path, 'csv', 'bids.csv'))
-
-        if get_game_setting('adjustment') == 'per portfolio' or get_game_setting('adjustment') == 'per unit':
-            adjustment = True
-        else:
-            adjustment = False
 
-        engine.run_hour(r, h, bids_df, schedule_df, portfolios_df, adjustment)
-        engine.update_summary(r, h, summary_df, players_df)
+        # only this hour's bids are loaded; later hours' balances are chained from the ledger
+        state = persistence.new_hour_state(current_app.instance_path, get_db(), r, h)
+        state.set_bid_entries(commit_bids(r, h))
+        engine.clear_hour(state, r, h)
+        engine.update_balances(state, r, h)
+        # If later hours have already been run, their balances depend on this hour's
+        updated_hours = engine.propagate_balances(state, r, h)
+        persistence.save_market_state(state, current_app.instance_path, get_db())
+        chart_cache.invalidate()
+        scoreboard.render_chart_artifacts(r, h)
+        hour_events.publish(scoreboard.hour_completed_event(r, h, updated_hours))
 
         flash(f"Ran hour {r}/{h}.")
+        if updated_hours:
+            flash(f"Updated balances for {len(updated_hours)} later hour(s).")
         return redirect(url_for('admin.admin_dashboard'))
 
     db = get_db()
@@ -232,11 +238,13 @@ def admin_dashboard():
     ).fetchone() is None:
         return render_template('/admin/dashboard.html', initialized=False)
 
-    summary_df = pd.read_csv(os.path.join(current_app.instance_path, 'csv', 'summary.csv'))
-    bids_df = get_pending_bids().sort_values(['unit_id'], ascending=True)
+    adjustment = get_game_setting('adjustment')
+    if adjustment == 'disabled':
+        bids_df = get_pending_bids(kinds=['base'])
+    else:
+        bids_df = get_pending_bids()
     bids_df = bids_df.where(bids_df.notnull(), None)
     unit_names_df = bids_df[['portfolio_name', 'unit_name', 'unit_id']]
-    adjustment = get_game_setting('adjustment')
     if adjustment == 'disabled':
         base_bids_df = bids_df.filter(regex=("bid_base_.*"))
         name_bids_df = pd.concat([unit_names_df, base_bids_df], axis=1, sort=False)
@@ -246,12 +254,12 @@ def admin_dashboard():
         name_bids_df = pd.concat([unit_names_df, all_bids_df], axis=1, sort=False)
         pretty_headers = [make_pretty_header(s) for s in all_bids_df.columns]
 
-    next_r_h = first_incomplete_summary_row(summary_df)
+    next_r_h = get_game_progress()['next_pending']
 
     kwargs = {
         'initialized':True,
         'bids':name_bids_df,
-        'hours':round_hour_names(schedule_df),
+        'hours':round_hour_names(schedule.schedule_df),
         'next_r_h':next_r_h,
         'pretty_headers':pretty_headers
     }
@@ -261,43 +269,29 @@ def admin_dashboard():
 @admin_login_required
 def edit_bids():
     if request.method == 'POST':
-        bids_df = get_pending_bids().sort_values(['unit_id'], ascending=True)
-        bids_df = bids_df.where(bids_df.notnull(), None)
+        schedule = get_schedule()
+        bids = []
 
         for (key, bid) in request.form.items():
             try:
                 unit_id, column_header, bid = form_entry_to_tuple(key, bid)
+                kind, r, h = bid_store.parse_bid_header(column_header)
                 # Check if bid is a valid decimal; any invalid/empty values will become None
                 try:
                     bid = round(decimal.Decimal(bid), 2)
-                    bid = min(bid, decimal.Decimal(decimal.Decimal(get_game_setting('max bid'))))
-                    bid = max(bid, decimal.Decimal(decimal.Decimal(get_game_setting('min bid'))))
-                    # Cast to String because sqlite doesn't like Decimals
-                    bid = "{:.2f}".format(bid)
+                    bid = min(bid, decimal.Decimal(str(get_game_setting('max bid'))))
+                    bid = max(bid, decimal.Decimal(str(get_game_setting('min bid'))))
                 except:
                     bid = None
-                if bid is not None:
+                if bid is not None and (r, h) in schedule:
                     # Overwrite bid only if form cell is not None 
-                    bids_df.loc[bids_df['unit_id'] == int(unit_id), column_header] = bid
+                    bids.append((int(unit_id), r, h, kind, bid))
             except:
                 print("Bad bid POST: ", key, bid)
 
-        # replace instances of nan with None
-        bids_df = bids_df.where(bids_df.notnull(), None)
-        # Update database: drop rows from `bids` in bids_df, append bids_df
-        # Note: this leaves the `bids` table out of order — this gets fixed in the to_csv
-        # stage of admin hour-running
-        db = get_db()
-        # Create temporary table for comparison purposes
-        bids_df.to_sql('temporary_bids', db, if_exists='replace', index=False)
-        # Drop any rows in `bids` that match a unit_id in `temporary_bids`
-        db.execute(
-            'DELETE FROM bids WHERE unit_id IN (SELECT unit_id FROM temporary_bids)'
-        )
-        db.commit()
-        # Append bids_df
-        bids_df.to_sql('bids', db, if_exists='append', index=False)
-            
+        # Update database: write the bids that changed
+        changed = bid_store.upsert_bids(get_db(), bids)
+        flash(f"Updated {changed} bid(s).")
         return redirect(url_for('admin.edit_bids'))
 
     # GET
@@ -308,11 +302,14 @@ def edit_bids():
     ).fetchone() is None:
         return render_template('/admin/edit_bids.html', initialized=False)
     else: 
-        bids_df = get_pending_bids().sort_values(['unit_id'], ascending=True)
+        adjustment = get_game_setting('adjustment')
+        if adjustment == 'disabled':
+            bids_df = get_pending_bids(kinds=['base'])
+        else:
+            bids_df = get_pending_bids()
         # replace instances of nan with None
         bids_df = bids_df.where(bids_df.notnull(), None)
         unit_names_df = bids_df[['unit_name', 'unit_id']]
-        adjustment = get_game_setting('adjustment')
         if adjustment == 'disabled':
             base_bids_df = bids_df.filter(regex=("bid_base_.*"))
             name_bids_df = pd.concat([unit_names_df, base_bids_df], axis=1, sort=False)
@@ -330,21 +327,15 @@ def edit_bids():
     return render_template('/admin/edit_bids.html', **kwargs)
     
 
-def get_pending_bids():
-    """Returns a Pandas DataFrame that represents the bids table (not the committed bids.csv)"""
-    db = get_db()
-    bids_df = pd.read_sql_query('SELECT * FROM bids', db)
-    return bids_df
-
-def commit_bids(pending_bids_df, r, h):
-    """Writes bids from the dataframe pending_bids_df corresponding to the particular round/hour
-    to the bids.csv file"""
-    pending_bids_df = pending_bids_df.reset_index(drop=True)
-    selected_bids_columns = pending_bids_df.filter(regex=(".*_" + r + "_" + h))
-    selected_bids_columns = selected_bids_columns.fillna(get_game_setting('max bid')) # HACK: Figure out better nan-bid handling
-    selected_column_headers = selected_bids_columns.columns
-    bids_csv_df = pd.read_csv(os.path.join(current_app.instance_path, 'csv', 'bids.csv'))
-    for column in selected_column_headers:
-        bids_csv_df[column] = selected_bids_columns[column]
-    bids_csv_df.to_csv(os.path.join(current_app.instance_path, 'csv', 'bids.csv'), index=False)
-
+def get_pending_bids(r=None, h=None, kinds=None):
+    """Returns a Pandas DataFrame that represents the bids grid (not the committed bids), sorted by unit_id; 
+    optionally only round r hour h and/or some bid kinds (see bid_store.bid_grid)"""
+    return bid_store.bid_grid(get_db(), r=r, h=h, kinds=kinds)
+
+def commit_bids(r, h):
+    """Commits the pending bids of round r hour h (empty bids become max bid) and returns them in long format 
+    (unit_id,round,hour,kind,value)"""
+    committed_bids_df = bid_store.read_bids(get_db(), r=r, h=h)
+    committed_bids_df['value'] = committed_bids_df['value'].fillna(get_game_setting('max bid')) # HACK: Figure out better nan-bid handling
+    persistence.save_committed_bids(get_db(), committed_bids_df)
+    return committed_bids_df
@@ -0,0 +1,114 @@
+# API
+# Versioned, read-only JSON data API for the game's results: the data behind the scoreboard charts and summary
+# table as compact columnar arrays (one list per field), for clients that render it themselves (e.g. external
+# dashboards). Empty values (hours that haven't been run) are null. Every response carries the data version
+# (see persistence.save_progress), so clients can tell when to refetch.
+# Everything should be publicly sharable
+
+import numpy as np
+
+from flask import Blueprint, abort, current_app, jsonify
+
+from esg2 import persistence
+from esg2.db import get_db
+from esg2.engine import SUMMARY_FIELDS
+from esg2.scoreboard import adjustment_segments, get_supply_demand_intercept, supply_steps
+from esg2.utilities import get_game_setting, get_schedule
+
+API_VERSION = 1
+
+bp = Blueprint('api', __name__, url_prefix=f'/api/v{API_VERSION}')
+
+@bp.errorhandler(FileNotFoundError)
+def game_not_initialized(e):
+    return jsonify(error="The game has not been initialized."), 404
+
+def json_column(values):
+    """Returns values (an array or Series) as a JSON-serializable list, with NaN as None"""
+    values = np.asarray(values)
+    if values.dtype.kind == 'f':
+        return np.where(np.isnan(values), None, values).tolist()
+    return values.tolist()
+
+def api_response(**data):
+    return jsonify(api_version=API_VERSION,
+                   data_version=persistence.read_data_version(current_app.instance_path), **data)
+
+@bp.route('/hours/<int:r>/<int:h>/supply')
+def hour_supply(r, h):
+    """The supply curve of round r hour h (one step per unit, in curve order), its adjustment segments (if
+    adjustment is enabled), the demand curve and their intercept"""
+    schedule = get_schedule()
+    if (r, h) not in schedule:
+        abort(404)
+    hourly_df = persistence.read_hourly_sheet(current_app.instance_path, get_db(), r, h)
+    (steps_df, x_lefts, x_rights) = supply_steps(hourly_df)
+    bids = steps_df['bid_base'].to_numpy(dtype=float)
+    capacities = steps_df['unit_capacity'].to_numpy(dtype=float)
+    (intercept_mwh, intercept_price) = get_supply_demand_intercept(bids, capacities, schedule, r, h)
+    hour = schedule[r, h]
+
+    steps = {
+        'unit_id': json_column(steps_df['unit_id']),
+        'unit_name': json_column(steps_df['unit_name']),
+        'portfolio_id': json_column(steps_df['portfolio_id']),
+        'portfolio_name': json_column(steps_df['portfolio_name']),
+        'unit_location': json_column(steps_df['unit_location']),
+        'x_left': json_column(x_lefts),
+        'x_right': json_column(x_rights),
+        'bid': json_column(bids),
+        'mwh_produced': json_column(steps_df['mwh_produced'].to_numpy(dtype=float))
+    }
+
+    adjustment = None
+    if get_game_setting('adjustment') in ('per unit', 'per portfolio'):
+        adjustment = {}
+        unit_ids = steps_df['unit_id'].to_numpy()
+        for adj_dir in ('up', 'down'):
+            (rows, lefts, rights, is_adjusted) = adjustment_segments(steps_df, x_lefts, x_rights, adj_dir)
+            adjustment[adj_dir] = {
+                'unit_id': json_column(unit_ids[rows]),
+                'x_left': json_column(lefts),
+                'x_right': json_column(rights),
+                'bid': json_column(steps_df['bid_' + adj_dir].to_numpy(dtype=float)[rows]),
+                'adjusted': json_column(is_adjusted),
+                'mwh_adjusted': json_column(steps_df['mwh_adjusted_' + adj_dir].to_numpy(dtype=float)[rows])
+            }
+
+    return api_response(
+        round=r, hour=h,
+        demand={'net_base_demand': float(hour.net_base_demand), 'slope': float(hour.slope),
+                'auction_type': hour.auction_type},
+        intercept={'mwh': json_column([intercept_mwh])[0], 'price': json_column([intercept_price])[0]},
+        steps=steps,
+        adjustment=adjustment
+    )
+
+@bp.route('/summary/<metric>')
+def summary(metric):
+    """One summary field (revenue, cost, profit or balance) of every portfolio: one row of values per scheduled
+    hour, one column per portfolio"""
+    if metric not in SUMMARY_FIELDS:
+        abort(404)
+    state = persistence.new_market_state(current_app.instance_path, get_db())
+    return api_response(
+        metric=metric,
+        round=[int(r) for (r, h) in state.round_hours], 
+        hour=[int(h) for (r, h) in state.round_hours],
+        portfolio_id=json_column(state.portfolio_ids),
+        values=[json_column(row) for row in state.summary[metric]]
+    )
+
+@bp.route('/balances')
+def balances():
+    """The balance series of every portfolio (as plotted in the standings chart): its starting money followed by
+    its balance after each scheduled hour"""
+    state = persistence.new_market_state(current_app.instance_path, get_db())
+    portfolio_names = dict(zip(state.players_df['portfolio_id'], state.players_df['portfolio']))
+    return api_response(
+        hours=['0'] + [f'{r}/{h}' for (r, h) in state.round_hours],
+        portfolio_id=json_column(state.portfolio_ids),
+        portfolio_name=[portfolio_names[i] for i in state.portfolio_ids],
+        balance=[json_column(np.concatenate(([starting_money], series)))
+                 for (starting_money, series) in zip(state.starting_money, state.summary['balance'].T)]
+    )
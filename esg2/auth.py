@@ -16,7 +16,7 @@ from wtforms import (
 )
 
 from esg2.db import get_db
-from esg2.utilities import get_portfolio_names_list
+from esg2.utilities import get_portfolio_names_list, get_portfolio_id_by_name
 
 bp = Blueprint('auth', __name__, url_prefix='')
 
@@ -78,14 +78,13 @@ class RegistrationForm(Form):
 def register():
     form = RegistrationForm(request.form)
     # dynamically set portfolio dropdown selection options based off of unique values in portfolios.csv
-    portfolios_df = pd.read_csv(os.path.join(current_app.instance_path, 'csv', 'config', 'portfolios.csv'))
     form.portfolio.choices = [(portfolio, portfolio) for portfolio in get_portfolio_names_list()]
     
     if request.method == 'POST' and form.validate():
         username = form.username.data
         password = form.password.data
         portfolio = form.portfolio.data
-        portfolio_id = int(portfolios_df.loc[portfolios_df['portfolio_name'] == portfolio, 'portfolio_id'].iloc[0])
+        portfolio_id = get_portfolio_id_by_name(portfolio)
         starting_money = form.starting_money.data
         db = get_db()
         error = None
@@ -0,0 +1,142 @@
+# BID STORE:
+# The pending bids (the bids players have placed, before an hour is run) live in SQLite in long format:
+# -   bid_units : unit_id,portfolio_id,portfolio_name,unit_name
+# -   bids      : unit_id,round,hour,kind,value
+# One row per unit, hour and bid kind (base/up/down), keyed by (unit_id, round, hour, kind) and indexed by
+# (round, hour), so the table's width no longer grows with the schedule and reads fetch only the hours and
+# kinds they need. The bid grids in the templates are built with bid_grid, which pivots the rows back into
+# one bid_{kind}_{r}_{h} column per hour and kind.
+
+import pandas as pd
+
+from esg2.db import write_transaction
+from esg2.engine import BID_KINDS, bid_header
+
+BIDS_SCHEMA = '''
+DROP TABLE IF EXISTS bids;
+DROP TABLE IF EXISTS bid_units;
+
+CREATE TABLE bid_units (
+  unit_id INTEGER PRIMARY KEY,
+  portfolio_id INTEGER NOT NULL,
+  portfolio_name TEXT NOT NULL,
+  unit_name TEXT NOT NULL
+);
+
+CREATE TABLE bids (
+  unit_id INTEGER NOT NULL,
+  round INTEGER NOT NULL,
+  hour INTEGER NOT NULL,
+  kind TEXT NOT NULL,
+  value REAL,
+  PRIMARY KEY (unit_id, round, hour, kind),
+  FOREIGN KEY (unit_id) REFERENCES bid_units (unit_id)
+);
+
+CREATE INDEX bids_round_hour ON bids (round, hour, kind);
+'''
+
+UNIT_HEADERS = ['portfolio_id', 'portfolio_name', 'unit_id', 'unit_name']
+
+def bid_rows(bids_df, round_hours):
+    """Yields the (unit_id, round, hour, kind, value) rows of a wide bids sheet for the hours in round_hours"""
+    unit_ids = bids_df['unit_id'].astype(int).tolist()
+    for (r, h) in round_hours:
+        for kind in BID_KINDS:
+            header = bid_header(kind, r, h)
+            if header not in bids_df.columns:
+                continue
+            for (unit_id, value) in zip(unit_ids, bids_df[header].tolist()):
+                yield (unit_id, int(r), int(h), kind, None if pd.isnull(value) else float(value))
+
+def create_bid_tables(db, bids_df, schedule_df):
+    """(Re)creates the bid tables for a new game from its wide bids sheet (see engine.create_bids_sheet)"""
+    db.executescript(BIDS_SCHEMA)
+    units = bids_df[UNIT_HEADERS].itertuples(index=False, name=None)
+    db.executemany(
+        'INSERT INTO bid_units (portfolio_id, portfolio_name, unit_id, unit_name) VALUES (?, ?, ?, ?)',
+        [(int(i), name, int(unit_id), unit_name) for (i, name, unit_id, unit_name) in units]
+    )
+    round_hours = schedule_df[['round', 'hour']].itertuples(index=False, name=None)
+    db.executemany(
+        'INSERT INTO bids (unit_id, round, hour, kind, value) VALUES (?, ?, ?, ?, ?)',
+        bid_rows(bids_df, round_hours)
+    )
+    db.commit()
+
+def read_bids(db, portfolio_id=None, r=None, h=None, kinds=None):
+    """Returns the bid rows (unit_id, round, hour, kind, value), optionally only those of one portfolio, one
+    round/hour and/or some bid kinds"""
+    conditions = []
+    params = []
+    if portfolio_id is not None:
+        conditions.append('unit_id IN (SELECT unit_id FROM bid_units WHERE portfolio_id = ?)')
+        params.append(int(portfolio_id))
+    if r is not None and h is not None:
+        conditions.append('round = ? AND hour = ?')
+        params.extend([int(r), int(h)])
+    if kinds is not None:
+        conditions.append('kind IN (' + ', '.join('?' * len(kinds)) + ')')
+        params.extend(kinds)
+    query = 'SELECT unit_id, round, hour, kind, value FROM bids'
+    if conditions:
+        query += ' WHERE ' + ' AND '.join(conditions)
+    return pd.read_sql_query(query, db, params=params)
+
+def read_bid_units(db, portfolio_id=None):
+    query = 'SELECT portfolio_id, portfolio_name, unit_id, unit_name FROM bid_units'
+    params = []
+    if portfolio_id is not None:
+        query += ' WHERE portfolio_id = ?'
+        params.append(int(portfolio_id))
+    return pd.read_sql_query(query + ' ORDER BY unit_id', db, params=params)
+
+def bid_grid(db, portfolio_id=None, r=None, h=None, kinds=None):
+    """Returns the bids as a wide grid, one row per unit (sorted by unit id) with the columns
+    portfolio_id,portfolio_name,unit_id,unit_name followed by bid_{kind}_{r}_{h} for each hour (in round/hour
+    order) and kind. The filters are the same as read_bids."""
+    units_df = read_bid_units(db, portfolio_id)
+    bids_df = read_bids(db, portfolio_id, r, h, kinds)
+    if kinds is None:
+        kinds = BID_KINDS
+
+    round_hours = bids_df[['round', 'hour']].drop_duplicates().sort_values(by=['round', 'hour'])
+    headers = [bid_header(kind, r, h) for (r, h) in round_hours.itertuples(index=False, name=None) for kind in kinds]
+
+    bids_df['header'] = 'bid_' + bids_df['kind'] + '_' + bids_df['round'].astype(str) + '_' + bids_df['hour'].astype(str)
+    grid_df = bids_df.pivot(index='unit_id', columns='header', values='value').reindex(
+        index=units_df['unit_id'], columns=headers)
+    return pd.concat([units_df, grid_df.reset_index(drop=True)], axis=1)
+
+def parse_bid_header(header):
+    """Takes in a string of the form "bid_{kind}_{r}_{h}" and returns (kind, r, h); raises ValueError if the 
+    header isn't a bid header"""
+    (prefix, kind, r, h) = header.split('_')
+    if prefix != 'bid' or kind not in BID_KINDS:
+        raise ValueError("Not a bid header: " + header)
+    return kind, int(r), int(h)
+
+# Inserts or updates one bid, but only for a unit that exists (and, with the portfolio filter, that belongs to
+# the portfolio); the update is skipped when the value is unchanged, so it isn't counted as a change.
+UPSERT_BID = '''
+INSERT INTO bids (unit_id, round, hour, kind, value)
+SELECT unit_id, ?, ?, ?, ? FROM bid_units WHERE unit_id = ? {portfolio_filter}
+ON CONFLICT (unit_id, round, hour, kind) DO UPDATE SET value = excluded.value
+WHERE bids.value IS NOT excluded.value
+'''
+
+def upsert_bids(db, bids, portfolio_id=None):
+    """Writes bids, an iterable of (unit_id, r, h, kind, value), cell by cell in a single transaction. Bids of 
+    units that don't exist (or aren't in portfolio_id, if given) are ignored, as are bids that are already 
+    stored. Returns the number of bids that changed."""
+    if portfolio_id is None:
+        query = UPSERT_BID.format(portfolio_filter='')
+        rows = [(int(r), int(h), kind, float(value), int(unit_id)) for (unit_id, r, h, kind, value) in bids]
+    else:
+        query = UPSERT_BID.format(portfolio_filter='AND portfolio_id = ?')
+        rows = [(int(r), int(h), kind, float(value), int(unit_id), int(portfolio_id))
+                for (unit_id, r, h, kind, value) in bids]
+    with write_transaction(db):
+        changes_before = db.total_changes
+        db.executemany(query, rows)
+        return db.total_changes - changes_before
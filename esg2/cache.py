@@ -0,0 +1,88 @@
+# CACHE:
+# Process-level cache for values parsed from the game's files (game settings, portfolios, players). A value
+# is parsed once and reused until its file changes on disk, so hot paths (bid forms, charts, engine runs)
+# no longer re-read the same csv files on every call.
+# Rendered values that depend on the game's results (the scoreboard charts) are kept in a bounded LRU cache
+# instead, keyed by the version of the results and config they're built from and cleared when an hour is run.
+
+import os
+import threading
+from collections import OrderedDict
+
+class FileCache:
+    """Caches the result of loader(path) per (path, loader). An entry is reloaded only when the file's mtime or
+    size changes, or when it is invalidated explicitly (e.g. after an upload that could leave both unchanged).
+    Hits and misses are counted so the cache can be checked in production."""
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, path, loader):
+        stat = os.stat(path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        key = (path, loader)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == signature:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        value = loader(path)
+        with self._lock:
+            self._entries[key] = (signature, value)
+        return value
+
+    def invalidate(self, path=None):
+        """Drops every entry loaded from path (or every entry, if path is None)"""
+        with self._lock:
+            for key in list(self._entries):
+                if path is None or key[0] == path:
+                    del self._entries[key]
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._entries)}
+
+file_cache = FileCache()
+
+class LRUCache:
+    """Caches the result of builder() per key, keeping at most max_entries and evicting the least recently used
+    one. Keys should include everything the value depends on (e.g. a data version), so that a stale entry is 
+    never hit; invalidate() just frees them early."""
+
+    def __init__(self, max_entries=128):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, builder):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+        value = builder()
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._entries), 
+                    'max_entries': self.max_entries}
+
+# Scoreboard chart JSON, keyed by (chart kind, round, hour, theme, results ETag) (see responses.results_etag)
+chart_cache = LRUCache(max_entries=128)
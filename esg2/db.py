@@ -1,18 +1,62 @@
+import os
 import sqlite3
+import threading
+import time
+from contextlib import contextmanager
 
 import click
 from flask import current_app, g
 from flask.cli import with_appcontext
 from werkzeug.security import generate_password_hash
 
+from esg2 import engine, persistence
+
+
+# CONNECTIONS:
+# Each worker thread keeps one connection per database file and reuses it across requests, so connection setup
+# and the pragmas below run once per thread rather than once per request, and sqlite3's per-connection statement
+# cache keeps the hot queries (e.g. the user lookup in auth.load_logged_in_user and the bid upsert) prepared.
+# The connection settings come from the app config (see create_app):
+# -   SQLITE_JOURNAL_MODE      : journal mode; WAL lets readers (e.g. the scoreboard) proceed while bids are written
+# -   SQLITE_SYNCHRONOUS       : synchronous pragma (NORMAL is safe with WAL)
+# -   SQLITE_BUSY_TIMEOUT      : milliseconds to wait for a lock before raising "database is locked"
+# -   SQLITE_CACHE_SIZE        : page cache size pragma (negative values are KiB)
+# -   SQLITE_CACHED_STATEMENTS : size of each connection's prepared statement cache
+# -   SQLITE_REUSE_CONNECTION  : set to False to open and close a connection per request
+
+_local = threading.local()
+
+def connect(config):
+    db = sqlite3.connect(
+        config['DATABASE'],
+        detect_types=sqlite3.PARSE_DECLTYPES,
+        cached_statements=config.get('SQLITE_CACHED_STATEMENTS', 128)
+    )
+    db.row_factory = sqlite3.Row
+    db.execute('PRAGMA journal_mode = ' + config.get('SQLITE_JOURNAL_MODE', 'WAL'))
+    db.execute('PRAGMA synchronous = ' + config.get('SQLITE_SYNCHRONOUS', 'NORMAL'))
+    db.execute('PRAGMA busy_timeout = ' + str(int(config.get('SQLITE_BUSY_TIMEOUT', 5000))))
+    db.execute('PRAGMA cache_size = ' + str(int(config.get('SQLITE_CACHE_SIZE', -16000))))
+    return db
+
+def thread_connection(config):
+    """Returns this thread's connection to config['DATABASE'], opening it on first use (or after a fork)"""
+    connections = getattr(_local, 'connections', None)
+    if connections is None or _local.pid != os.getpid():
+        # connections can't be shared with a forked child (e.g. gunicorn workers of a preloaded app)
+        connections = _local.connections = {}
+        _local.pid = os.getpid()
+    db = connections.get(config['DATABASE'])
+    if db is None:
+        db = connections[config['DATABASE']] = connect(config)
+    return db
 
 def get_db():
     if 'db' not in g:
-        g.db = sqlite3.connect(
-            current_app.config['DATABASE'],
-            detect_types=sqlite3.PARSE_DECLTYPES
-        )
-        g.db.row_factory = sqlite3.Row
+        if current_app.config.get('SQLITE_REUSE_CONNECTION', True):
+            g.db = thread_connection(current_app.config)
+        else:
+            g.db = connect(current_app.config)
 
     return g.db
 
@@ -21,7 +65,55 @@ def close_db(e=None):
     db = g.pop('db', None)
 
     if db is not None:
-        db.close()
+        if current_app.config.get('SQLITE_REUSE_CONNECTION', True):
+            # Keep the connection for the thread's next request, minus anything left uncommitted
+            if db.in_transaction:
+                db.rollback()
+        else:
+            db.close()
+
+
+# LOCK WAITS:
+# Write transactions that go through write_transaction take the write lock up front (BEGIN IMMEDIATE), so the
+# time spent acquiring it is the time spent waiting on other writers. The waits are recorded per process and
+# reported by /admin/db-stats, to help size the number of workers.
+
+class LockWaitStats:
+    """Count, total and maximum of the lock waits recorded in this process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.transactions = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def record(self, wait):
+        with self._lock:
+            self.transactions += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+
+    def stats(self):
+        with self._lock:
+            mean_wait = self.total_wait / self.transactions if self.transactions else 0.0
+            return {'pid': os.getpid(), 'transactions': self.transactions, 'total_wait_s': round(self.total_wait, 6),
+                    'mean_wait_s': round(mean_wait, 6), 'max_wait_s': round(self.max_wait, 6)}
+
+lock_waits = LockWaitStats()
+
+@contextmanager
+def write_transaction(db):
+    """Runs the block in a write transaction that is committed on success and rolled back on error. 
+    The time spent waiting for the write lock is recorded in lock_waits."""
+    start = time.perf_counter()
+    db.execute('BEGIN IMMEDIATE')
+    lock_waits.record(time.perf_counter() - start)
+    try:
+        yield db
+    except BaseException:
+        db.rollback()
+        raise
+    db.commit()
 
 
 def init_db():
@@ -29,6 +121,7 @@ def init_db():
 
     with current_app.open_resource('schema.sql') as f:
         db.executescript(f.read().decode('utf8'))
+    persistence.create_game_tables(db)
 
 
 @click.command('add-admin')
@@ -72,6 +165,34 @@ def set_password_command(username, password):
         click.echo(f"Reset password for account \"{username}\"")
 
 
+@click.command('replay-game')
+@click.option('--all-hours', is_flag=True,
+              help='Clear every scheduled hour, not just the hours that have already been run.')
+@click.option('--processes', type=int, default=None,
+              help='Number of worker processes used to clear hours (default: one per CPU).')
+@with_appcontext
+def replay_game_command(all_hours, processes):
+    # Recompute the results of the game from the committed bids in one batched pass
+    start = time.perf_counter()
+    try:
+        state = persistence.load_market_state(current_app.instance_path, get_db())
+    except FileNotFoundError:
+        click.echo("The game has not been initialized.")
+        return
+
+    if all_hours:
+        round_hours = state.round_hours
+    else:
+        round_hours = engine.completed_hours(state)
+
+    engine.clear_hours(state, round_hours, processes=processes)
+    engine.update_all_balances(state)
+    persistence.save_market_state(state, current_app.instance_path, get_db())
+    # the rendered charts are of the old results; they are rendered on request until hours are run again
+    persistence.clear_chart_artifacts(get_db())
+    click.echo(f"Replayed {len(round_hours)} hours in {time.perf_counter() - start:.2f}s.")
+
+
 @click.command('init-db')
 @with_appcontext
 def init_db_command():
@@ -84,4 +205,5 @@ def init_app(app):
     app.teardown_appcontext(close_db)
     app.cli.add_command(add_admin_command)
     app.cli.add_command(set_password_command)
+    app.cli.add_command(replay_game_command)
     app.cli.add_command(init_db_command)
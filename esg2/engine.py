@@ -1,14 +1,19 @@
 # hello world!
 
-import os
+# ENGINE:
+# The game engine. Everything in this module operates in memory: the game is represented by a MarketState
+# (schedule, portfolios, players, committed bids, hourly results and balances) and pure functions such as
+# clear_hour(state, r, h) and update_balances(state, r, h) operate on it. Nothing here touches Flask or the
+# filesystem; reading and writing the csv files is the job of esg2.persistence.
+
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from itertools import accumulate
+from typing import NamedTuple
 
 import numpy as np
 import pandas as pd
 
-from flask import current_app
-
-from esg2.utilities import get_game_setting, get_initialized_portfolio_ids_list
-
 # SUMMARY SPREADSHEET:
 # Captures a macroscopic summary of performance over hours.
 # -   round,hour,n_to_s_capacity,s_to_n_capacity,
@@ -16,31 +21,29 @@ from esg2.utilities import get_game_setting, get_initialized_portfolio_ids_list
 #     [player_{player_id}_revenue,player_{player_id}_cost,player_{player_id}_profit],
 #     [player_{player_id}_balance] 
 
+SUMMARY_FIELDS = ['revenue', 'cost', 'profit', 'balance']
+# the fields the balance chain and the progress cursor depend on
+PROGRESS_FIELDS = ['profit', 'balance']
+
+def summary_header(portfolio_id, field):
+    """Returns the summary column header player_{portfolio_id}_{field}"""
+    return 'player_' + str(portfolio_id) + '_' + field
+
 def create_summary_sheet(schedule_df, players_df):
+    """Returns an empty summary sheet (one row per scheduled hour) for the players in players_df"""
     player_ids = players_df['portfolio_id'].tolist()
 
-    # lambda functions for the header-generating list comprehension
-    header_revenue  = lambda i: 'player_' + str(i) + '_revenue'
-    header_cost     = lambda i: 'player_' + str(i) + '_cost'
-    header_profit   = lambda i: 'player_' + str(i) + '_profit'
-    header_balance  = lambda i: 'player_' + str(i) + '_balance'
-
     # Generates headers [player_{player_id}_revenue,player_{player_id}_cost,player_{player_id}_profit],
     # [player_{player_id}_balance] for each {player_id} in the players.csv file.
-    summary_player_headers = ([f(i) for i in player_ids for f in (header_revenue, header_cost, header_profit)] 
-                                + [header_balance(i) for i in player_ids])
+    summary_player_headers = ([summary_header(i, field) for i in player_ids for field in SUMMARY_FIELDS[:3]] 
+                                + [summary_header(i, 'balance') for i in player_ids])
 
-    # Note that this is a local variable. As summary_df will constantly be written and read from summary.csv, it is
-    # important to load from the true summary.csv file whenever the data is needed, instead of a potentially out-of-
-    # date summary_df variable. Whenever possible, functions should interact indirectly through writing to summary.csv
-    # and then reading summary.csv, instead of chaining functions directly.
     summary_df = pd.concat([schedule_df, pd.DataFrame(columns=(summary_player_headers))], axis=1)
-
-    # summary.csv is saved in the /csv/ directory.
-    summary_df.to_csv(os.path.join(current_app.instance_path, 'csv', 'summary.csv'), index=False)
+    return summary_df
 
 # HOURLY SPREADSHEETS:
-# A set of spreadsheets (one per hour) recording bids, production, and revenue/cost for each unit. 
+# A set of spreadsheets (one per hour) recording bids, production, and revenue/cost for each unit. Settled 
+# sheets are stored in the `hourly_results` table (see esg2.persistence).
 # -   round_{round}_hour_{hour} : portfolio_id,portfolio_name,unit_id,unit_name,unit_location,
 #     unit_capacity,
 #     cost_per_mwh,cost_daily_om,carbon_per_mwh, 
@@ -48,70 +51,278 @@ def create_summary_sheet(schedule_df, players_df):
 #     activated,mwh_produced_initially,mwh_produced_base,mwh_adjusted_down,mwh_adjusted_up,mwh_produced,
 #     carbon_produced,base_revenue,adjust_down_revenue,adjust_up_revenue,revenue,cost_var,cost_om,cost_carbon,profit
 
-def create_hourly_sheets(schedule_df, portfolios_df):
-    # a list of (round, hour) pairs, for the purpose of naming each sheet
-    round_hour_tuples = list(schedule_df[['round', 'hour']].itertuples(index=False, name=None))
+HOURLY_ADDITIONAL_HEADERS = ['bid_base','bid_up','bid_down','base_price','activated','mwh_produced_initially',
+                             'mwh_produced_base','mwh_adjusted_down','mwh_adjusted_up','mwh_produced',
+                             'carbon_produced','base_revenue','adjust_down_revenue','adjust_up_revenue',
+                             'revenue','cost_var','cost_om','cost_carbon','profit']
 
-    # get the portfolios that are active during this game
-    portfolios_df = portfolios_df[portfolios_df['portfolio_id'].isin(get_initialized_portfolio_ids_list())]
-
-    hourly_additional_headers = ['bid_base','bid_up','bid_down','base_price','activated','mwh_produced_initially',
-                                 'mwh_produced_base','mwh_adjusted_down','mwh_adjusted_up','mwh_produced',
-                                 'carbon_produced','base_revenue','adjust_down_revenue','adjust_up_revenue',
-                                 'revenue','cost_var','cost_om','cost_carbon','profit']
-
-    for (r, h) in round_hour_tuples:
-        hourly_df = pd.concat([portfolios_df, pd.DataFrame(columns=(hourly_additional_headers))], axis=1)
-        # round_r_hour_h.csv is saved in the /csv/hourly/ directory.
-        hourly_df.to_csv(os.path.join(current_app.instance_path, 'csv', 'hourly', 'round_' + str(r) + '_hour_' + str(h) + '.csv'), index=False)
+def create_hourly_sheet(portfolios_df):
+    """Returns an empty hourly sheet for the units in portfolios_df (the portfolios active during this game)"""
+    hourly_df = portfolios_df.reset_index(drop=True)
+    hourly_df = pd.concat([hourly_df, pd.DataFrame(columns=(HOURLY_ADDITIONAL_HEADERS), index=hourly_df.index, 
+                                                   dtype=float)], axis=1)
+    return hourly_df
 
 # CURRENT BID SPREADSHEET:
 # Records bids for all hours as submitted by players. Constantly updating according to player form 
-# inputs. Not visible to players, only administrators. When an hour is run, the bids in this 
-# spreadsheet are recorded in the corresponding round_#_hour_#.csv file.
+# inputs. Not visible to players, only administrators. The bids themselves are stored one row per unit, 
+# hour and kind in the `bids` table (see esg2.bid_store), and this wide sheet is pivoted from it on demand 
+# (bid_store.bid_grid). When an hour is run, its bids are copied to the `committed_bids` table (see 
+# esg2.persistence) and cleared from there.
 # -   bids : portfolio_id,portfolio_name,unit_id,unit_name, 
 #     [bid_base_{round}_{hour},bid_up_{round}_{hour},bid_down_{round}_{hour}] 
 #     : The square brackets indicate that these columns are to be repeated dynamically based on the 
 #     number of rounds and hours. Note that this structure enables unit-specific adjustment bids; 
 #     whether or not players can specify those values is at the discretion of the bid form creator. 
 
-def create_bids_sheet(schedule_df, portfolios_df):
+BID_KINDS = ['base', 'up', 'down']
+
+def bid_header(kind, r, h):
+    """Returns the bids column header bid_{kind}_{r}_{h}"""
+    return 'bid_' + kind + '_' + str(r) + '_' + str(h)
+
+def create_bids_sheet(schedule_df, portfolios_df, max_bid):
+    """Returns a bids sheet for the units in portfolios_df (the portfolios active during this game) with every 
+    bid set to max_bid"""
     # a list of (round, hour) pairs, for the purpose of naming the repeated columns
     round_hour_tuples = list(schedule_df[['round', 'hour']].itertuples(index=False, name=None))
 
     # the part of portfolios_df that is used to construct bids_df
     portfolios_headers = ['portfolio_id','portfolio_name','unit_id','unit_name']
 
-    # get the portfolios that are active during this game
-    portfolios_df = portfolios_df[portfolios_df['portfolio_id'].isin(get_initialized_portfolio_ids_list())]
-
-    # lambda functions for the header-generating list comprehension
-    # each of these functions is equivalent to lambda (r, h): ... , but tuple unpacking was removed
-    header_base = lambda r_h: 'bid_base_' + str(r_h[0]) + '_' + str(r_h[1])
-    header_up   = lambda r_h: 'bid_up_'   + str(r_h[0]) + '_' + str(r_h[1])
-    header_down = lambda r_h: 'bid_down_' + str(r_h[0]) + '_' + str(r_h[1])
-
-    bids_r_h_headers = ([f(r_h) for r_h in round_hour_tuples for f in (header_base, header_up, header_down)])
+    bids_r_h_headers = ([bid_header(kind, r, h) for (r, h) in round_hour_tuples for kind in BID_KINDS])
 
     bids_df = pd.concat([portfolios_df[portfolios_headers], pd.DataFrame(columns=bids_r_h_headers)], axis=1)
 
     for header in bids_r_h_headers:
-        bids_df[header] = get_game_setting('max bid')
+        bids_df[header] = max_bid
         # No bid: default to max bid
 
-    # bids.csv is saved in the /csv/ directory.
-    bids_df.to_csv(os.path.join(current_app.instance_path, 'csv', 'bids.csv'),index=False)
-
-
-def determine_active_units(r, h, bids_df, schedule_df, hourly_df, portfolios_df, adjustment):
-    # Read bids from bids_df into hourly_df
-    hourly_df['bid_base'] = bids_df[('bid_base_' + str(r) + '_' + str(h))]
-    hourly_df['bid_up']   = bids_df[('bid_up_'   + str(r) + '_' + str(h))]
-    hourly_df['bid_down'] = bids_df[('bid_down_' + str(r) + '_' + str(h))]
+    return bids_df
+
+# GAME STATE:
+# The typed, in-memory representation of a game. Bids and summary values are stored as 2D arrays with one
+# row per scheduled hour (in schedule order); bid columns follow the unit order of portfolios_df and summary
+# columns follow the portfolio order of players_df.
+
+@dataclass(frozen=True)
+class GameSettings:
+    """The settings from game_settings.csv, parsed into typed values"""
+    interest_rate: float = 0.05
+    min_bid: float = 0.00
+    max_bid: float = 500.00
+    adjustment: str = 'disabled'
+    carbon: str = 'disabled'
+    carbon_tax_rate: float = 0.00
+
+    @classmethod
+    def from_df(cls, game_settings_df):
+        """Builds GameSettings from a (setting, value) dataframe; missing settings keep their defaults"""
+        values = dict(zip(game_settings_df['setting'], game_settings_df['value']))
+        kwargs = {}
+        for field, setting, cast in [('interest_rate', 'interest rate', float), ('min_bid', 'min bid', float),
+                                     ('max_bid', 'max bid', float), ('adjustment', 'adjustment', str),
+                                     ('carbon', 'carbon', str), ('carbon_tax_rate', 'carbon tax rate', float)]:
+            if setting in values:
+                kwargs[field] = cast(values[setting])
+        return cls(**kwargs)
+
+    @property
+    def adjustment_enabled(self):
+        return self.adjustment == 'per portfolio' or self.adjustment == 'per unit'
+
+    @property
+    def effective_carbon_tax_rate(self):
+        """The dollars charged per ton of carbon, or 0 if carbon costs are disabled"""
+        if self.carbon == 'enabled':
+            return self.carbon_tax_rate
+        else:
+            return 0.00
+
+class ScheduleHour(NamedTuple):
+    """One row of schedule.csv, parsed into typed values"""
+    round: int
+    hour: int
+    n_to_s_capacity: float
+    s_to_n_capacity: float
+    north_base_demand: float
+    south_base_demand: float
+    net_base_demand: float
+    slope: float
+    auction_type: str
+
+class Schedule:
+    """The game schedule indexed by (round, hour), so the parameters of an hour are a dictionary read
+    (schedule[r, h]) rather than a boolean-mask scan of schedule_df per field"""
+
+    def __init__(self, schedule_df):
+        self.schedule_df = schedule_df.sort_values(by=['round', 'hour'], ascending=[True, True]).reset_index(drop=True)
+        columns = [self.schedule_df[field].to_numpy() for field in ScheduleHour._fields]
+        self.hours = {}
+        for values in zip(*columns):
+            hour = ScheduleHour(int(values[0]), int(values[1]), *(float(v) for v in values[2:8]), str(values[8]))
+            self.hours[(hour.round, hour.hour)] = hour
+        self.round_hours = list(self.hours)
+
+    @classmethod
+    def from_csv(cls, path):
+        return cls(pd.read_csv(path))
+
+    def __getitem__(self, r_h):
+        (r, h) = r_h
+        return self.hours[(int(r), int(h))]
+
+    def __contains__(self, r_h):
+        (r, h) = r_h
+        return (int(r), int(h)) in self.hours
+
+    def __len__(self):
+        return len(self.round_hours)
+
+class MarketState:
+    """In-memory state of a game: schedule, active portfolios, players, committed bids, hourly results and 
+    balances. Build one with esg2.persistence.load_market_state (or directly from dataframes; the schedule may
+    also be given as a Schedule), operate on it with clear_hour/update_balances, and persist it with 
+    esg2.persistence. Bids are held for the hours in bid_hours (default: every scheduled hour), so a state for 
+    running a single hour doesn't allocate every hour's bids."""
+
+    def __init__(self, schedule_df, portfolios_df, players_df, settings, bids_df=None, summary_df=None, 
+                 bid_hours=None):
+        self.settings = settings
+        self.schedule = schedule_df if isinstance(schedule_df, Schedule) else Schedule(schedule_df)
+        self.schedule_df = self.schedule.schedule_df
+        self.players_df = players_df.sort_values(by=['portfolio_id'], ascending=[True]).reset_index(drop=True)
+        # get the portfolios that are active during this game
+        self.portfolios_df = portfolios_df[portfolios_df['portfolio_id'].isin(self.players_df['portfolio_id'])
+                                           ].reset_index(drop=True)
+
+        self.round_hours = self.schedule.round_hours
+        self.hour_index = {r_h: i for (i, r_h) in enumerate(self.round_hours)}
+        if bid_hours is None:
+            self.bid_hours = self.round_hours
+        else:
+            self.bid_hours = [r_h for r_h in self.round_hours if r_h in bid_hours]
+        self.bid_index = {r_h: i for (i, r_h) in enumerate(self.bid_hours)}
+        self.unit_ids = self.portfolios_df['unit_id'].to_numpy(dtype=int)
+        self.portfolio_ids = self.players_df['portfolio_id'].to_numpy(dtype=int)
+        self.starting_money = self.players_df['starting_money'].to_numpy(dtype=float)
+
+        n_hours = len(self.round_hours)
+        n_units = len(self.unit_ids)
+        n_players = len(self.portfolio_ids)
+
+        # Committed bids: bids[kind][hour, unit], one row per hour in bid_hours
+        self.bids = {kind: np.full((len(self.bid_hours), n_units), settings.max_bid, dtype=float) 
+                     for kind in BID_KINDS}
+        if bids_df is not None:
+            self.set_bids(bids_df)
+
+        # Summary values: summary[field][hour, player]; NaN until the hour has been run
+        self.summary = {field: np.full((n_hours, n_players), np.nan, dtype=float) for field in SUMMARY_FIELDS}
+        if summary_df is not None:
+            self.set_summary(summary_df)
+        self.mark_summary_saved()
+
+        # Hourly sheets of the hours cleared in memory, keyed by (round, hour)
+        self.hourly = {}
+
+    def set_bids(self, bids_df, round_hours=None):
+        """Reads the bid_{kind}_{r}_{h} columns of a wide bids sheet into the bid arrays. Only the hours in 
+        round_hours (default: every hour in bid_hours) are read; missing or empty bids default to max bid."""
+        if round_hours is None:
+            round_hours = self.bid_hours
+        bids_df = bids_df.set_index('unit_id').reindex(self.unit_ids)
+        rows = [self.bid_index[r_h] for r_h in round_hours]
+        for kind in BID_KINDS:
+            headers = [bid_header(kind, r, h) for (r, h) in round_hours]
+            values = bids_df.reindex(columns=headers).to_numpy(dtype=float).T
+            self.bids[kind][rows] = np.where(np.isnan(values), self.settings.max_bid, values)
+
+    def set_bid_entries(self, entries_df):
+        """Reads long-format bids (unit_id,round,hour,kind,value) into the bid arrays; empty bids default to max 
+        bid. Bids of hours not in bid_hours or units not in the game are ignored."""
+        rows = [self.bid_index.get((r, h)) for (r, h) in zip(entries_df['round'].tolist(), entries_df['hour'].tolist())]
+        unit_index = {i: j for (j, i) in enumerate(self.unit_ids.tolist())}
+        columns = [unit_index.get(i) for i in entries_df['unit_id'].tolist()]
+        values = entries_df['value'].to_numpy(dtype=float)
+        values = np.where(np.isnan(values), self.settings.max_bid, values)
+        for (kind, row, column, value) in zip(entries_df['kind'].tolist(), rows, columns, values):
+            if row is not None and column is not None and kind in self.bids:
+                self.bids[kind][row, column] = value
+
+    def set_summary(self, summary_df):
+        """Reads the player_{id}_{field} columns of a wide summary sheet into the summary arrays"""
+        summary_df = summary_df.set_index(['round', 'hour']).reindex(self.round_hours)
+        for field in SUMMARY_FIELDS:
+            headers = [summary_header(i, field) for i in self.portfolio_ids]
+            self.summary[field][:] = summary_df.reindex(columns=headers).to_numpy(dtype=float)
+
+    def set_summary_entries(self, entries_df):
+        """Reads long-format summary entries (round,hour,portfolio_id and a column per summary field) into the 
+        summary arrays; fields without a column are left as they are. Entries of unscheduled hours or players not 
+        in the game are ignored."""
+        rows = [self.hour_index.get((r, h)) for (r, h) in zip(entries_df['round'].tolist(), entries_df['hour'].tolist())]
+        player_index = {i: j for (j, i) in enumerate(self.portfolio_ids.tolist())}
+        columns = [player_index.get(i) for i in entries_df['portfolio_id'].tolist()]
+        keep = np.array([row is not None and column is not None for (row, column) in zip(rows, columns)], dtype=bool)
+        rows = np.array([row for (row, k) in zip(rows, keep) if k], dtype=int)
+        columns = np.array([column for (column, k) in zip(columns, keep) if k], dtype=int)
+        for field in SUMMARY_FIELDS:
+            if field in entries_df.columns:
+                self.summary[field][rows, columns] = entries_df[field].to_numpy(dtype=float)[keep]
+
+    def summary_entries(self, round_hours):
+        """Returns the long-format summary entries (round,hour,portfolio_id and a column per summary field) of 
+        every player for the hours in round_hours"""
+        rows = [self.hour_index[r_h] for r_h in round_hours]
+        n_players = len(self.portfolio_ids)
+        entries = {'round': np.repeat([r for (r, h) in round_hours], n_players).astype(int),
+                   'hour': np.repeat([h for (r, h) in round_hours], n_players).astype(int),
+                   'portfolio_id': np.tile(self.portfolio_ids, len(rows))}
+        for field in SUMMARY_FIELDS:
+            entries[field] = self.summary[field][rows].reshape(-1)
+        return pd.DataFrame(entries)
+
+    def mark_summary_saved(self):
+        """Records the current summary values as persisted (see unsaved_summary_hours)"""
+        self.saved_summary = {field: values.copy() for (field, values) in self.summary.items()}
+
+    def unsaved_summary_hours(self):
+        """Returns the (round, hour) of every hour whose summary values changed since mark_summary_saved"""
+        changed = np.zeros(len(self.round_hours), dtype=bool)
+        for field in SUMMARY_FIELDS:
+            (current, saved) = (self.summary[field], self.saved_summary[field])
+            same = (current == saved) | (np.isnan(current) & np.isnan(saved))
+            changed |= ~same.all(axis=1)
+        return [self.round_hours[i] for i in np.flatnonzero(changed)]
+
+    def summary_df(self):
+        """Returns the wide summary sheet (schedule columns followed by the player columns)"""
+        # [player_{id}_revenue,player_{id}_cost,player_{id}_profit] for each id, then [player_{id}_balance]
+        columns = {}
+        for (j, i) in enumerate(self.portfolio_ids):
+            for field in SUMMARY_FIELDS[:3]:
+                columns[summary_header(i, field)] = self.summary[field][:, j]
+        for (j, i) in enumerate(self.portfolio_ids):
+            columns[summary_header(i, 'balance')] = self.summary['balance'][:, j]
+        player_df = pd.DataFrame(columns, index=self.schedule_df.index)
+        return pd.concat([self.schedule_df, player_df], axis=1)
+
+    def new_hourly_sheet(self, r, h):
+        """Returns an unsettled hourly sheet for round r hour h with the committed bids filled in"""
+        i = self.bid_index[(r, h)]
+        hourly_df = create_hourly_sheet(self.portfolios_df)
+        for kind in BID_KINDS:
+            hourly_df['bid_' + kind] = self.bids[kind][i]
+        return hourly_df
+
+def determine_active_units(r, h, schedule, hourly_df, adjustment):
+    # hourly_df already has the hour's bids in its bid_base, bid_up, bid_down columns
 
     # Update hourly sheet with preliminary activations at price up unitl demand is fulfilled
     # This means that we're going to be 'working-in-place' on the hourly dataframe while running this function.
-    hourly_df = run_initial_activation(r, h, schedule_df, hourly_df)
+    hourly_df = run_initial_activation(r, h, schedule, hourly_df)
+    hour = schedule[r, h]
 
     # Not all of the plants are going to be checked for adjustment down/up; initializing with 0's avoids later issues
     hourly_df['mwh_adjusted_down'] = 0
@@ -123,18 +334,15 @@ def determine_active_units(r, h, bids_df, schedule_df, hourly_df, portfolios_df,
 
     # Compute fraction of base demand actually purchased by market
     net_init_prod = north_production + south_production
-    demand_base = schedule_df.loc[(schedule_df['round'] == r) & (schedule_df['hour'] == h)]['net_base_demand'].values.item()
-    scaling_factor = net_init_prod / demand_base
+    scaling_factor = net_init_prod / hour.net_base_demand
 
     # Compare to zone specific demand
-    north_demand = schedule_df.loc[(schedule_df['round'] == r) & (schedule_df['hour'] == h)]['north_base_demand'].values.item()
-    south_demand = schedule_df.loc[(schedule_df['round'] == r) & (schedule_df['hour'] == h)]['south_base_demand'].values.item()
-    north_demand = north_demand * scaling_factor
-    south_demand = south_demand * scaling_factor
+    north_demand = hour.north_base_demand * scaling_factor
+    south_demand = hour.south_base_demand * scaling_factor
 
     # Get interzone transmission capacities
-    n_to_s_capacity = schedule_df.loc[(schedule_df['round'] == r) & (schedule_df['hour'] == h)]['n_to_s_capacity'].values.item()
-    s_to_n_capacity = schedule_df.loc[(schedule_df['round'] == r) & (schedule_df['hour'] == h)]['s_to_n_capacity'].values.item()
+    n_to_s_capacity = hour.n_to_s_capacity
+    s_to_n_capacity = hour.s_to_n_capacity
 
     print("North prod: {} / North demand: {}".format(north_production, north_demand))
     print("South prod: {} / South demand: {}".format(south_production, south_demand))
@@ -147,277 +355,233 @@ def determine_active_units(r, h, bids_df, schedule_df, hourly_df, portfolios_df,
     elif (north_production - north_demand >= n_to_s_capacity):
         print("North overproducing.")
         # north has a surplus, south has a deficit
-        # DEACTIVATE north plants
-        # filter for activated plants in the north
-        active_north_df = hourly_df.loc[(hourly_df['unit_location'] == "North") & (hourly_df['activated'] == 1)]
-        # sort by down adjustment bid (ascending), then initial bid (descending), then unit id (descending)
-        active_north_df = active_north_df.sort_values(by=['bid_down', 'bid_base', 'unit_id'], ascending=[True, False, False])
-
         excess = north_production - north_demand - n_to_s_capacity # n_to_s_capacity MWh can go to the south
-        print("North excess: {}".format(excess))
-
-        for _, unit in active_north_df.iterrows(): # HACK : iterrows is an antipattern
-            unit_production = unit['mwh_produced_initially']
-            # Ramp down until excess is resolved or the unit isn't producing any more
-            mwh_reduced = min(abs(unit_production), excess)
-            # Edit hourly_df to reflect update
-            hourly_df.loc[(hourly_df['unit_id'] == unit['unit_id']),'mwh_adjusted_down'] = mwh_reduced
-            hourly_df.loc[(hourly_df['unit_id'] == unit['unit_id']),'mwh_produced_base'] -= mwh_reduced
-            if (mwh_reduced == unit_production):
-                hourly_df.loc[(hourly_df['unit_id'] == unit['unit_id']),'activated'] = 0
-            excess -= mwh_reduced
-            print("Reduced unit {} (base: {}, down: {}) production by {} MWh to {} MWh. Remaining excess: {}"
-                    .format(unit['unit_id'], unit['bid_base'], unit['bid_down'], mwh_reduced, (unit_production - mwh_reduced), excess))
-
-        # ACTIVATE south plants
-        # filter for not-fully-activated plants in the south
-        inactive_south_df = hourly_df.loc[(hourly_df['unit_location'] == "South") & (hourly_df['mwh_produced_initially'] < hourly_df['unit_capacity'])]
-        # sort by up adjustment bid (descending), initial bid (ascending), then unit id (ascending)
-        inactive_south_df = inactive_south_df.sort_values(by=['bid_up', 'bid_base', 'unit_id'], ascending=[False, True, True])
-
         deficit = south_demand - south_production - n_to_s_capacity # n_to_s_capacity MWh from north
-        
-        for _, unit in inactive_south_df.iterrows(): # HACK : antipattern
-            unit_capacity = unit['unit_capacity']
-            mwh_produced_initially = unit['mwh_produced_initially']
-            # Ramp up until deficit is resolved or unit is at max capacity
-            mwh_increased = min(abs(unit_capacity - mwh_produced_initially), deficit)
-            # Log increased production
-            hourly_df.loc[(hourly_df['unit_id'] == unit['unit_id']),'mwh_adjusted_up'] = mwh_increased
-            if (mwh_increased > 0):
-                hourly_df.loc[(hourly_df['unit_id'] == unit['unit_id']),'activated'] = 1
-            deficit -= mwh_increased
-            print("Increased unit {} (base: {}, up: {}) production by {} MWh to {} MWh at price ${}. Remaining deficit: {}"
-                    .format(unit['unit_id'], unit['bid_base'], unit['bid_up'], mwh_increased,
-                    (mwh_produced_initially + mwh_increased),(unit['bid_base'] - unit['bid_up']), deficit))
+        print("North excess: {}".format(excess))
+        hourly_df = redispatch(hourly_df, "North", "South", excess, deficit)
     elif (south_production - south_demand >= s_to_n_capacity):
         print("South overproducing.")
         # north has a deficit, south has a surplus
-        # DEACTIVATE south plants
-        # filter for activated plants in the south
-        active_south_df = hourly_df.loc[(hourly_df['unit_location'] == "South") & (hourly_df['activated'] == 1)]
-        # sort by down adjustment bid (ascending), then initial bid (descending), then unit id (descending)
-        active_south_df = active_south_df.sort_values(by=['bid_down', 'bid_base', 'unit_id'], ascending=[True, False, False])
-
         excess = south_production - south_demand - s_to_n_capacity # s_to_n_capacity MWh can go to the north
+        deficit = north_demand - north_production - s_to_n_capacity # s_to_n_capacity MWh from south
         print("South excess: {}".format(excess))
+        hourly_df = redispatch(hourly_df, "South", "North", excess, deficit)
 
-        for _, unit in active_south_df.iterrows(): # HACK : antipattern
-            unit_production = unit['mwh_produced_initially']
-            # Ramp down until excess is resolved or the unit isn't producing any more
-            mwh_reduced = min(abs(unit_production), excess)
-            # Edit hourly_df to reflect update
-            hourly_df.loc[(hourly_df['unit_id'] == unit['unit_id']),'mwh_adjusted_down'] = mwh_reduced
-            hourly_df.loc[(hourly_df['unit_id'] == unit['unit_id']),'mwh_produced_base'] -= mwh_reduced
-            if (mwh_reduced == unit_production):
-                hourly_df.loc[(hourly_df['unit_id'] == unit['unit_id']),'activated'] = 0
-            excess -= mwh_reduced
-            print("Reduced unit {} (base: {}, down: {}) production by {} MWh to {} MWh. Remaining excess: {}"
-                    .format(unit['unit_id'], unit['bid_base'], unit['bid_down'], mwh_reduced, (unit_production - mwh_reduced), excess))
-
-        # ACTIVATE north plants
-        # filter for not-fully-active plants in the north
-        inactive_north_df = hourly_df.loc[(hourly_df['unit_location'] == "North") & (hourly_df['mwh_produced_initially'] < hourly_df['unit_capacity'])]
-        # sort by up adjustment bid (descending), initial bid (ascending), then unit id (ascending)
-        inactive_north_df = inactive_north_df.sort_values(by=['bid_up', 'bid_base', 'unit_id'], ascending=[False, True, True])
+    return hourly_df
 
-        deficit = north_demand - north_production - s_to_n_capacity # s_to_n_capacity MWh from south
-        
-        for _, unit in inactive_north_df.iterrows(): # HACK : antipattern
-            unit_capacity = unit['unit_capacity']
-            mwh_produced_initially = unit['mwh_produced_initially']
-            # Ramp up until deficit is resolved or unit is at max capacity
-            mwh_increased = min(abs(unit_capacity - mwh_produced_initially), deficit)
-            # Log increased production
-            hourly_df.loc[(hourly_df['unit_id'] == unit['unit_id']),'mwh_adjusted_up'] = mwh_increased
-            if (mwh_increased > 0):
-                hourly_df.loc[(hourly_df['unit_id'] == unit['unit_id']),'activated'] = 1
-            deficit -= mwh_increased
-            print("Increased unit {} (base: {}, up: {}) production by {} MWh to {} MWh at price ${}. Remaining deficit: {}"
-                    .format(unit['unit_id'], unit['bid_base'], unit['bid_up'], mwh_increased,
-                    (mwh_produced_initially + mwh_increased),(unit['bid_base'] - unit['bid_up']), deficit))
 
-    return hourly_df
+def ramp_allocation(amounts, total):
+    """Allocates total MWh down a sorted stack of units, where each unit can take at most its entry in 
+    amounts. Each unit takes as much as it can until the total is exhausted, so the allocation is the 
+    remaining total after all previous units (total minus the cumulative sum before the unit), clipped 
+    to [0, amount]."""
+    amounts = np.asarray(amounts, dtype=float)
+    cumulative_before = np.concatenate(([0.0], np.cumsum(amounts)[:-1]))
+    return np.clip(total - cumulative_before, 0, amounts)
+
+def redispatch(hourly_df, surplus_zone, deficit_zone, excess, deficit):
+    """Resolves transmission congestion between the two zones. Activated units in surplus_zone are 
+    ramped down until excess is resolved, and not-fully-activated units in deficit_zone are ramped 
+    up until deficit is resolved. Updates mwh_adjusted_down, mwh_adjusted_up, mwh_produced_base and 
+    activated in hourly_df."""
+    # DEACTIVATE surplus zone plants
+    # filter for activated plants in the surplus zone
+    down_df = hourly_df.loc[(hourly_df['unit_location'] == surplus_zone) & (hourly_df['activated'] == 1)]
+    # sort by down adjustment bid (ascending), then initial bid (descending), then unit id (descending)
+    down_df = down_df.sort_values(by=['bid_down', 'bid_base', 'unit_id'], ascending=[True, False, False])
+
+    # ACTIVATE deficit zone plants
+    # filter for not-fully-activated plants in the deficit zone
+    up_df = hourly_df.loc[(hourly_df['unit_location'] == deficit_zone) & 
+                          (hourly_df['mwh_produced_initially'] < hourly_df['unit_capacity'])]
+    # sort by up adjustment bid (descending), initial bid (ascending), then unit id (ascending)
+    up_df = up_df.sort_values(by=['bid_up', 'bid_base', 'unit_id'], ascending=[False, True, True])
+
+    # Ramp down until excess is resolved or the unit isn't producing any more
+    unit_production = down_df['mwh_produced_initially'].to_numpy(dtype=float)
+    mwh_reduced = ramp_allocation(np.abs(unit_production), excess)
+    # Ramp up until deficit is resolved or unit is at max capacity
+    headroom = np.abs(up_df['unit_capacity'].to_numpy(dtype=float) - up_df['mwh_produced_initially'].to_numpy(dtype=float))
+    mwh_increased = ramp_allocation(headroom, deficit)
+
+    print("Reduced {} {} units by {} MWh. Remaining excess: {}"
+            .format(np.count_nonzero(mwh_reduced), surplus_zone, mwh_reduced.sum(), excess - mwh_reduced.sum()))
+    print("Increased {} {} units by {} MWh. Remaining deficit: {}"
+            .format(np.count_nonzero(mwh_increased), deficit_zone, mwh_increased.sum(), deficit - mwh_increased.sum()))
+
+    # Edit hourly_df to reflect update
+    down_positions = hourly_df.index.get_indexer(down_df.index)
+    up_positions = hourly_df.index.get_indexer(up_df.index)
+
+    mwh_adjusted_down = hourly_df['mwh_adjusted_down'].to_numpy(dtype=float, copy=True)
+    mwh_adjusted_up = hourly_df['mwh_adjusted_up'].to_numpy(dtype=float, copy=True)
+    mwh_produced_base = hourly_df['mwh_produced_base'].to_numpy(dtype=float, copy=True)
+    activated = hourly_df['activated'].to_numpy(dtype=int, copy=True)
+
+    mwh_adjusted_down[down_positions] = mwh_reduced
+    mwh_produced_base[down_positions] -= mwh_reduced
+    activated[down_positions[mwh_reduced == unit_production]] = 0
+    mwh_adjusted_up[up_positions] = mwh_increased
+    activated[up_positions[mwh_increased > 0]] = 1
+
+    hourly_df['mwh_adjusted_down'] = mwh_adjusted_down
+    hourly_df['mwh_adjusted_up'] = mwh_adjusted_up
+    hourly_df['mwh_produced_base'] = mwh_produced_base
+    hourly_df['activated'] = activated
 
+    return hourly_df
 
-def run_initial_activation(r, h, schedule_df, hourly_df):
+def demand_price(quantity, demand_base, demand_slope):
+    """Returns the price the market will pay at the given quantity (scalar or array).
+    Demand is in Q = mP + b form, where m is delta MWh over delta $ and b is the base demand, so
+    the price function is simply the inverse: P = (1/m)(Q - b). A slope of 0 is interpreted as 
+    perfect inelasticity: any price while quantity is below base demand, nothing once it is met."""
+    quantity = np.asarray(quantity, dtype=float)
+    if (demand_slope == 0): # NOTE: 0 slope is interpreted as perfect inelasticity, not perfect elasticity
+        return np.where(quantity < demand_base, np.inf, -np.inf)
+    return ((1 / demand_slope) * (quantity - demand_base))
+
+def demand_quantity(price, demand_base, demand_slope):
+    """Returns the quantity demanded at the given price (scalar or array): Q = mP + b, or b if 
+    demand is perfectly inelastic."""
+    if (demand_slope == 0):
+        return np.full_like(np.asarray(price, dtype=float), demand_base, dtype=float)
+    return (np.asarray(price, dtype=float) * demand_slope) + demand_base
+
+def clear_merit_order(bids, capacities, demand_base, demand_slope):
+    """Clears a merit-order (step function) supply curve against the demand curve.
+
+    bids and capacities must already be sorted by ascending bid (ties broken by unit_id). Returns 
+    (activated, production, clearing_price), where activated is an int array of 0/1 flags, production 
+    is the MWh produced by each unit and clearing_price is the highest activated bid (0 if none).
+
+    Every unit before the marginal unit produces at full capacity, so the marginal unit is the first 
+    step whose right edge (cumulative capacity) is no longer strictly below the demand curve. Because 
+    bids are sorted and demand is downward-sloping, (bid - demand price at the right edge) is 
+    nondecreasing, so the marginal unit can be found with a single searchsorted."""
+    bids = np.asarray(bids, dtype=float)
+    capacities = np.asarray(capacities, dtype=float)
+    n = len(bids)
+
+    activated = np.zeros(n, dtype=int)
+    production = np.zeros(n, dtype=float)
+    if n == 0:
+        return activated, production, 0
+
+    cumulative_capacity = np.cumsum(capacities)
+    shortfall = bids - demand_price(cumulative_capacity, demand_base, demand_slope)
+    marginal = int(np.searchsorted(shortfall, 0, side='left'))
+
+    # units below the marginal unit fit entirely below the demand curve
+    activated[:marginal] = 1
+    production[:marginal] = capacities[:marginal]
+    if marginal == n:
+        # demand exceeds total supply
+        return activated, production, bids[-1]
+
+    # The marginal unit produces only if the market is still willing to pay its bid; if so, the demand
+    # curve intersects its step and it produces up to the intersection
+    running_production = cumulative_capacity[marginal - 1] if marginal > 0 else 0.0
+    if demand_price(running_production, demand_base, demand_slope) >= bids[marginal]:
+        activated[marginal] = 1
+        production[marginal] = demand_quantity(bids[marginal], demand_base, demand_slope) - running_production
+        running_production += production[marginal]
+
+        # Any remaining units with the same bid as the marginal unit are activated at the intersection
+        # (i.e. they produce nothing extra)
+        tail_activated = demand_price(running_production, demand_base, demand_slope) >= bids[marginal + 1:]
+        activated[marginal + 1:] = tail_activated
+        production[marginal + 1:] = np.where(tail_activated, 
+            demand_quantity(bids[marginal + 1:], demand_base, demand_slope) - running_production, 0)
+
+    activated_bids = bids[activated == 1]
+    clearing_price = activated_bids[-1] if len(activated_bids) > 0 else 0
+    return activated, production, clearing_price
+
+def run_initial_activation(r, h, schedule, hourly_df):
 
     # Assume supply curve is a step function and demand curve is downward-sloping and linear. 
-    # The supply curve is provided by hourly_df; the demand curve is constructed from schedule_df.
-
-    # First sort the hourly_df (includes plants and bids info) by base bid.
-    # Then iterate through the list:
-        # Check current production. Use demand curve to find price. If price is less than bid_base, then this unit
-        # will not produce (as its electricity is too expensive for the market). If price is less than bid_base, then
-        # the unit will produce partially. In this case, we hypothesize that the unit produces at full capacity, and
-        # then use the demand curve to find the price at the current production + full capacity of this unit. If the
-        # price is still above the unit's bid_base, then the unit is entirely below the demand curve, and thus produces.
-        # If not, we know (by the intermediate value theorem) that there must be an intersection of the supply and demand
-        # curves within this unit's segment of the step function. This is a simple system of linear equations.
-        # We determine how much the unit produces and increase current production accordingly.
-    # This process repeats until we have gone through the entire list.
-
-    # Get auction type:
-    auction_type = schedule_df.loc[(schedule_df['round'] == r) & (schedule_df['hour'] == h)]['auction_type'].values.item()
-    
-    demand_base = schedule_df.loc[(schedule_df['round'] == r) & (schedule_df['hour'] == h)]['net_base_demand'].values.item()
-    demand_slope = schedule_df.loc[(schedule_df['round'] == r) & (schedule_df['hour'] == h)]['slope'].values.item()
+    # The supply curve is provided by hourly_df; the demand curve is constructed from the schedule.
 
-    if (demand_slope == 0): # NOTE: 0 slope is interpreted as perfect inelasticity, not perfect elasticity
-        def demand_fn(quantity):
-            if (quantity < demand_base): 
-                # quantity is insufficient, will pay any price (remember inelasticity!)
-                return np.inf # CONCERNING
-            else: 
-                # quantity is sufficient, will pay nothing
-                return -np.inf # WORRYING
-    else:
-        def demand_fn(quantity):
-            # Demand function is in Q = mP + b form, where m is delta MWh over delta $ and b 
-            # is the base demand. Price function is simply the inverse of this function:
-            # P = (1/m)(Q - b)
-            return ((1 / demand_slope) * (quantity - demand_base) )
+    # First sort the hourly_df (includes plants and bids info) by base bid, then clear the sorted
+    # supply curve against the demand curve in one pass (see clear_merit_order). Units entirely below
+    # the demand curve produce at full capacity; the unit whose step intersects the demand curve 
+    # produces up to the intersection; units above the demand curve do not produce.
+
+    # Get auction type and demand curve:
+    hour = schedule[r, h]
+    auction_type = hour.auction_type
+    demand_base = hour.net_base_demand
+    demand_slope = hour.slope
 
     print("Calculating net curve")
-    # print("Net demand: {}".format(net_demand))
 
     hourly_df = hourly_df.sort_values(by=['bid_base', 'unit_id'])
 
-    running_production = 0
-    activation_record = []
-    production_record = []
-    base_price_record = []
-    uniform_price = 0
-
-    for _, unit in hourly_df.iterrows(): # HACK this is an antipattern
-        unit_capacity = unit['unit_capacity']
-        bid = unit['bid_base'] 
-        unit_production = 0
-
-        if (demand_fn(running_production) < bid):
-            # unit's bid price is too high, market is not interested
-            unit_production = 0
-            activation_record.append(0)
-            production_record.append(0)
-            base_price_record.append(bid)
-        else:
-            # unit is getting activated to some extent
-            activation_record.append(1)
-            base_price_record.append(bid)
-            # update uniform price (recall that list of bids is sorted)
-            uniform_price = bid
-            # check if unit produces entire capacity or if demand curve intersects production step
-            if (demand_fn(running_production + unit_capacity) > bid):
-                # step fits entirely below curve
-                unit_production = unit_capacity
-                production_record.append(unit_production)
-                running_production += unit_production
-            else:
-                # step intersects
-                # with nonzero slope:
-                intersect_quantity = 0
-                if (demand_slope != 0):
-                    # algebra gives quantity produced = bid * demand_slope + demand_base
-                    intersect_quantity = (bid * demand_slope) + demand_base
-                else:
-                    # vertical line
-                    intersect_quantity = demand_base
-                unit_production = intersect_quantity - running_production 
-                running_production += unit_production
-                production_record.append(unit_production)
-
-        print("Unit {} (bid {}) produced {} MWh. Running production: {}."
-                .format(unit['unit_id'], unit['bid_base'], unit_production, running_production))
-        
-    # To avoid mutating something while iterating over it, we store the production of each plant in an array.
-    # Only after we're done iterating do we write to the hourly dataframe.
-    # This seems scuffed
+    bids = hourly_df['bid_base'].to_numpy(dtype=float)
+    activated, production, uniform_price = clear_merit_order(
+        bids, hourly_df['unit_capacity'].to_numpy(dtype=float), demand_base, demand_slope)
+
+    print("Activated {} of {} units. Total production: {} MWh at ${}/MWh."
+            .format(activated.sum(), len(activated), production.sum(), uniform_price))
+
     if (auction_type == "discrete"):
-        hourly_df['base_price'] = pd.Series(base_price_record, index=hourly_df.index[:len(base_price_record)])
+        hourly_df['base_price'] = bids
     else:
         # default to uniform
         hourly_df['base_price'] = uniform_price
-    hourly_df['activated'] = pd.Series(activation_record, index=hourly_df.index[:len(activation_record)])
-    hourly_df['mwh_produced_initially'] = round(pd.Series(production_record, index=hourly_df.index[:len(production_record)]), 2)
-    hourly_df['mwh_produced_base'] = round(pd.Series(production_record, index=hourly_df.index[:len(production_record)]), 2)
+    hourly_df['activated'] = activated
+    hourly_df['mwh_produced_initially'] = np.round(production, 2)
+    hourly_df['mwh_produced_base'] = np.round(production, 2)
 
     return hourly_df
 
-def complete_hourly_sheet(hourly_df, last_hour):
-    # mwh_produced
-    mwh_record = []
-    # carbon_produced
-    carbon_record = []
-    # base_revenue
-    base_revenue_record = []
-    # adjust_down_revenue
-    adjust_down_rev_record = []
-    # adjust_up_revenue
-    adjust_up_rev_record = []
-    # revenue
-    revenue_record = []
-    # cost_var
-    cost_var_record = []
-    # cost_om
-    cost_om_record = []
-    # cost_carbon
-    cost_carbon_record = []
-    # profit
-    profit_record = []
-
-    for _, unit in hourly_df.iterrows(): # HACK : you need to learn how to avoid this
-        (cost_per_mwh,cost_daily_om,carbon_per_mwh,base_price,
-        bid_base,bid_up,bid_down,mwh_produced_initially,
-        mwh_produced_base,mwh_adjusted_down,mwh_adjusted_up) = unit[['cost_per_mwh','cost_daily_om','carbon_per_mwh',
-                                                                    'base_price','bid_base','bid_up','bid_down',
-                                                                    'mwh_produced_initially','mwh_produced_base',
-                                                                    'mwh_adjusted_down','mwh_adjusted_up']]
-        
-        mwh_produced = mwh_produced_initially - mwh_adjusted_down + mwh_adjusted_up
-        # Assuming uniform auction
-        revenue = mwh_produced_base * base_price + mwh_adjusted_down * bid_down + mwh_adjusted_up * (bid_base - bid_up)
-        cost_var = mwh_produced * cost_per_mwh
-        if last_hour:
-            cost_om = cost_daily_om
-        else:
-            cost_om = 0
-        cost_carbon = cost_carbon_function(mwh_produced * carbon_per_mwh)
-        cost = cost_var + cost_om + cost_carbon
-        profit = revenue - cost
-
-        mwh_record.append(mwh_produced)
-        carbon_record.append(mwh_produced * carbon_per_mwh)
-        base_revenue_record.append(mwh_produced_base * base_price) # Assuming uniform auction
-        adjust_down_rev_record.append(mwh_adjusted_down * bid_down)
-        adjust_up_rev_record.append(mwh_adjusted_up * (bid_base - bid_up))
-        revenue_record.append(revenue)
-        cost_var_record.append(cost_var)
-        cost_om_record.append(cost_om)
-        cost_carbon_record.append(cost_carbon)
-        profit_record.append(profit)
+def complete_hourly_sheet(hourly_df, last_hour, carbon_tax_rate=0.00):
+    """Settles every unit in hourly_df at once: each of mwh_produced,carbon_produced,base_revenue,
+    adjust_down_revenue,adjust_up_revenue,revenue,cost_var,cost_om,cost_carbon,profit is computed as 
+    a whole-column expression. carbon_tax_rate is resolved once by the caller (see 
+    GameSettings.effective_carbon_tax_rate)."""
+    (cost_per_mwh,cost_daily_om,carbon_per_mwh,base_price,
+    bid_base,bid_up,bid_down,mwh_produced_initially,
+    mwh_produced_base,mwh_adjusted_down,mwh_adjusted_up) = (hourly_df[header].to_numpy(dtype=float) for header in 
+                                                            ['cost_per_mwh','cost_daily_om','carbon_per_mwh',
+                                                             'base_price','bid_base','bid_up','bid_down',
+                                                             'mwh_produced_initially','mwh_produced_base',
+                                                             'mwh_adjusted_down','mwh_adjusted_up'])
+
+    mwh_produced = mwh_produced_initially - mwh_adjusted_down + mwh_adjusted_up
+    carbon_produced = mwh_produced * carbon_per_mwh
+    base_revenue = mwh_produced_base * base_price # Assuming uniform auction
+    adjust_down_revenue = mwh_adjusted_down * bid_down
+    adjust_up_revenue = mwh_adjusted_up * (bid_base - bid_up)
+    revenue = base_revenue + adjust_down_revenue + adjust_up_revenue
+    cost_var = mwh_produced * cost_per_mwh
+    if last_hour:
+        cost_om = cost_daily_om
+    else:
+        cost_om = np.zeros(len(hourly_df.index))
+    cost_carbon = cost_carbon_function(carbon_produced, carbon_tax_rate)
+    cost = cost_var + cost_om + cost_carbon
+    profit = revenue - cost
 
     # mwh_produced,carbon_produced,base_revenue,adjust_down_revenue,adjust_up_revenue,revenue,cost_var,cost_om,profit
-    hourly_df['mwh_produced']        = pd.Series(mwh_record, index=hourly_df.index[:len(mwh_record)])
-    hourly_df['carbon_produced']     = pd.Series(carbon_record, index=hourly_df.index[:len(carbon_record)])
-    hourly_df['base_revenue']        = pd.Series(base_revenue_record, index=hourly_df.index[:len(base_revenue_record)])
-    hourly_df['adjust_down_revenue'] = pd.Series(adjust_down_rev_record, index=hourly_df.index[:len(adjust_down_rev_record)])
-    hourly_df['adjust_up_revenue']   = pd.Series(adjust_up_rev_record, index=hourly_df.index[:len(adjust_up_rev_record)])
-    hourly_df['revenue']             = pd.Series(revenue_record, index=hourly_df.index[:len(revenue_record)])
-    hourly_df['cost_var']            = pd.Series(cost_var_record, index=hourly_df.index[:len(cost_var_record)])
-    hourly_df['cost_om']             = pd.Series(cost_om_record, index=hourly_df.index[:len(cost_om_record)])
-    hourly_df['cost_carbon']         = pd.Series(cost_carbon_record, index=hourly_df.index[:len(cost_om_record)])
-    hourly_df['profit']              = pd.Series(profit_record, index=hourly_df.index[:len(profit_record)])
+    hourly_df['mwh_produced']        = mwh_produced
+    hourly_df['carbon_produced']     = carbon_produced
+    hourly_df['base_revenue']        = base_revenue
+    hourly_df['adjust_down_revenue'] = adjust_down_revenue
+    hourly_df['adjust_up_revenue']   = adjust_up_revenue
+    hourly_df['revenue']             = revenue
+    hourly_df['cost_var']            = cost_var
+    hourly_df['cost_om']             = cost_om
+    hourly_df['cost_carbon']         = cost_carbon
+    hourly_df['profit']              = profit
 
     return hourly_df
 
-def cost_carbon_function(carbon_produced):
-    """An arbitrary function that determines the cost of carbon.
+def cost_carbon_function(carbon_produced, carbon_tax_rate):
+    """An arbitrary function that determines the cost of carbon (scalar or array).
     This particular definition is a simple linear function."""
-    if get_game_setting('carbon') == 'enabled':
-        carbon_tax_rate = get_game_setting('carbon tax rate')
-        return carbon_produced * carbon_tax_rate
-    else:
-        return 0.00
+    return carbon_produced * carbon_tax_rate
 
 def last_hour(r, h): # TODO: update this to handle variable numbers of hours
     if (h == 4):
@@ -425,21 +589,40 @@ def last_hour(r, h): # TODO: update this to handle variable numbers of hours
     else:
         return False
 
-def run_hour(r, h, bids_df, schedule_df, portfolios_df, adjustment):
+def settle_hour(r, h, schedule, hourly_df, settings):
+    """Determines the active units for round r hour h from the bids in hourly_df and settles every unit. 
+    Depends only on its arguments, so hours can be settled independently (e.g. across processes)."""
     print("Running round {} hour {}".format(r, h))
-    # read hourly csv
-    hourly_df = pd.read_csv(os.path.join(current_app.instance_path, 'csv', 'hourly', 'round_' + str(r) + '_hour_' + str(h) + '.csv'))
 
     # determine active units
-    hourly_df = determine_active_units(r, h, bids_df, schedule_df, hourly_df, portfolios_df, adjustment)
+    hourly_df = determine_active_units(r, h, schedule, hourly_df, settings.adjustment_enabled)
 
     # check if it's the last hour of the round
     last = last_hour(r, h)
 
     # complete hourly sheet columns carbon_produced,revenue,adjust_down_revenue,cost_var,cost_om,profit
-    hourly_df = complete_hourly_sheet(hourly_df, last)
+    hourly_df = complete_hourly_sheet(hourly_df, last, settings.effective_carbon_tax_rate)
+    return hourly_df
 
-    hourly_df.to_csv(os.path.join(current_app.instance_path, 'csv', 'hourly', 'round_' + str(r) + '_hour_' + str(h) + '.csv'),index=False) 
+def clear_hour(state, r, h):
+    """Clears the market for round r hour h from the committed bids in state, settles every unit, and stores 
+    the completed hourly sheet in state.hourly. Returns the hourly sheet."""
+    hourly_df = settle_hour(r, h, state.schedule, state.new_hourly_sheet(r, h), state.settings)
+    state.hourly[(r, h)] = hourly_df
+    return hourly_df
+
+def clear_hours(state, round_hours, processes=None):
+    """Clears every hour in round_hours (see clear_hour). Hours are independent of one another until their 
+    balances are chained, so they are cleared across a pool of processes (processes=1 clears in-process)."""
+    round_hours = list(round_hours)
+    jobs = [(r, h, state.schedule, state.new_hourly_sheet(r, h), state.settings) for (r, h) in round_hours]
+    if processes == 1 or len(jobs) <= 1:
+        results = [settle_hour(*job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            results = list(executor.map(settle_hour, *zip(*jobs)))
+    for (r_h, hourly_df) in zip(round_hours, results):
+        state.hourly[r_h] = hourly_df
 
 
 # SUMMARY SPREADSHEET:
@@ -448,55 +631,112 @@ def run_hour(r, h, bids_df, schedule_df, portfolios_df, adjustment):
 #     [player_{player_id}_revenue,player_{player_id}_cost,player_{player_id}_profit],
 #     [player_{player_id}_balance] 
 
-def update_summary(r, h, summary_df, players_df):
-    hourly_df = pd.read_csv(os.path.join(current_app.instance_path, 'csv', 'hourly', 'round_' + str(r) + '_hour_' + str(h) + '.csv'))
-
-    portfolio_ids = players_df['portfolio_id'].tolist()
+def portfolio_totals(hourly_df, portfolio_ids):
+    """Returns the (revenue, cost, profit) arrays of each portfolio in portfolio_ids for a settled hourly sheet"""
+    totals = hourly_df.groupby('portfolio_id')[['revenue', 'cost_var', 'cost_om', 'profit']].sum()
+    totals = totals.reindex(portfolio_ids).fillna(0)
+    revenues = totals['revenue'].to_numpy()
+    costs = totals['cost_var'].to_numpy() + totals['cost_om'].to_numpy()
+    profits = totals['profit'].to_numpy()
+    return revenues, costs, profits
+
+def interest_factors(state):
+    """Returns the factor each hour multiplies the previous balance by: (1 + interest rate) at the start of 
+    each day (and on the first row, which starts from the starting money), otherwise 1"""
+    hours = state.schedule_df['hour'].to_numpy()
+    factors = np.where(hours == 1, 1 + state.settings.interest_rate, 1.0)
+    if len(factors) > 0:
+        factors[0] = 1 + state.settings.interest_rate
+    return factors
+
+def balance_step(previous_balance, factor_profit):
+    """One step of the balance chain: the previous balance (with interest) plus this hour's profit"""
+    (factor, profit) = factor_profit
+    return np.round(factor * previous_balance + profit, 2)
+
+def update_balances(state, r, h):
+    """Records the revenue, cost, profit and balance of every player for round r hour h, which must already 
+    have been cleared with clear_hour."""
+    hourly_df = state.hourly[(r, h)]
+    i = state.hour_index[(r, h)]
+
+    revenues, costs, profits = portfolio_totals(hourly_df, state.portfolio_ids)
+    state.summary['revenue'][i] = np.round(revenues, 2)
+    state.summary['cost'][i] = np.round(costs, 2)
+    state.summary['profit'][i] = np.round(profits, 2)
+
+    # update balance: 
+    # If it's the first round first hour, then be sure to factor in initial balance, 
+    # otherwise use previous balance and new profit. The balance chain always uses the recorded (rounded) 
+    # profit, so that balances propagated from the ledger (see propagate_balances) match a fresh run.
+    if i == 0:
+        previous_balances = state.starting_money
+    else:
+        previous_balances = state.summary['balance'][i - 1]
+    balances = balance_step(previous_balances, (interest_factors(state)[i], state.summary['profit'][i]))
+    state.summary['balance'][i] = balances
 
     print("Hour summary:")
-
-    for portfolio_id in portfolio_ids:
-        portfolio_df = hourly_df.loc[hourly_df['portfolio_id'] == portfolio_id]
-
-        revenues = portfolio_df['revenue'].sum()
-        costs = portfolio_df['cost_var'].sum() + portfolio_df['cost_om'].sum()
-        profits = portfolio_df['profit'].sum()
-
-
-        prefix = "player_" + str(portfolio_id) + "_"
-        revenue_header = prefix + "revenue"
-        cost_header    = prefix + "cost"
-        profit_header  = prefix + "profit"
-        balance_header = prefix + "balance"
-
-        summary_df.loc[(summary_df['round'] == r) & (summary_df['hour'] == h),revenue_header] = round(revenues, 2)
-        summary_df.loc[(summary_df['round'] == r) & (summary_df['hour'] == h),cost_header]    = round(costs, 2)
-        summary_df.loc[(summary_df['round'] == r) & (summary_df['hour'] == h),profit_header]  = round(profits, 2)
-
-        # update balance: 
-        # If it's the first round first hour, then be sure to factor in initial balance, 
-        # otherwise use previous balance and new profit
-
-        balance = 0
-
-        if (summary_df.loc[(summary_df['round'] == r) & (summary_df['hour'] == h)].index.values.astype(int)[0] == 0):
-            # if round/hour row is at the top of the table, factor in starting money from players_df (multiplied by interest rate)
-            balance = ((1 + float(get_game_setting('interest rate'))) * 
-                       players_df.loc[(players_df['portfolio_id'] == portfolio_id),'starting_money'].values.astype(float)[0]) + profits
-        else:
-            # otherwise, look at the value above and add profits (multiplied by interest rate)
-            current_row_index = summary_df.loc[(summary_df['round'] == r) & (summary_df['hour'] == h)].index.values.astype(int)[0]
-            if (h == 1):
-                balance = (1 + float(get_game_setting('interest rate'))) * summary_df.iloc[current_row_index - 1][balance_header] + profits 
-            else:
-                balance = summary_df.iloc[current_row_index - 1][balance_header] + profits 
-
-        name = portfolio_df['portfolio_name'].iloc[0] 
-        # TODO : the portfolio_id,portfolio_name repitition in portfolios.csv is a SPoT violation; rethink structure 
+    names = hourly_df.groupby('portfolio_id')['portfolio_name'].first()
+    for (j, portfolio_id) in enumerate(state.portfolio_ids):
         print("{} Current balance: ${:0.2f} Revenue: ${:0.2f} Cost: ${:0.2f} Profit: ${:0.2f}"
-                .format(name, balance, revenues, costs, profits))
-
-        summary_df.loc[(summary_df['round'] == r) & (summary_df['hour'] == h),balance_header] = round(balance, 2)
-
-    summary_df.to_csv(os.path.join(current_app.instance_path, 'csv', 'summary.csv'), index=False)
-
+                .format(names.get(portfolio_id), balances[j], revenues[j], costs[j], profits[j]))
+
+def propagate_balances(state, r, h):
+    """Recomputes the balances of the hours after round r hour h that depend on its balances through the 
+    balance/interest chain, using their recorded profits (their markets are not re-cleared). Propagation stops 
+    at the first hour that hasn't been run or whose balances come out unchanged, since no later balance can 
+    change either. Returns the (round, hour) pairs whose balances were updated."""
+    factors = interest_factors(state)
+    updated = []
+    for i in range(state.hour_index[(r, h)] + 1, len(state.round_hours)):
+        profits = state.summary['profit'][i]
+        if np.isnan(profits).any():
+            break
+        balances = balance_step(state.summary['balance'][i - 1], (factors[i], profits))
+        if np.array_equal(balances, state.summary['balance'][i], equal_nan=True):
+            break
+        state.summary['balance'][i] = balances
+        updated.append(state.round_hours[i])
+    return updated
+
+def update_all_balances(state):
+    """Records revenue, cost and profit for every hour cleared in memory, then recomputes the whole balance 
+    chain in a single cumulative scan over the hours. Hours that haven't been run (no recorded profit) leave 
+    every later balance empty, just as running hours one at a time would."""
+    for ((r, h), hourly_df) in state.hourly.items():
+        i = state.hour_index[(r, h)]
+        revenues, costs, profits = portfolio_totals(hourly_df, state.portfolio_ids)
+        state.summary['revenue'][i] = np.round(revenues, 2)
+        state.summary['cost'][i] = np.round(costs, 2)
+        state.summary['profit'][i] = np.round(profits, 2)
+
+    # chained on the recorded profits, like update_balances and propagate_balances
+    balances = list(accumulate(zip(interest_factors(state), state.summary['profit']), balance_step, 
+                               initial=state.starting_money))
+    if len(balances) > 1:
+        state.summary['balance'][:] = np.stack(balances[1:])
+
+def game_progress(state):
+    """Returns the game's progress cursor: the (round, hour) of the last fully-completed summary row (default 
+    (1, 1)) and of the first not-fully-completed row (defaults to the last row), found with one masked 
+    reduction over the summary arrays. Revenue, cost and profit are recorded together, so a row is complete
+    once it has a profit and a balance."""
+    values = np.stack([state.summary[field] for field in PROGRESS_FIELDS])
+    complete = ~np.isnan(values).any(axis=(0, 2))
+    completed_rows = np.flatnonzero(complete)
+    pending_rows = np.flatnonzero(~complete)
+    last_completed = state.round_hours[completed_rows[-1]] if len(completed_rows) > 0 else (1, 1)
+    if len(pending_rows) > 0:
+        next_pending = state.round_hours[pending_rows[0]]
+    elif len(state.round_hours) > 0:
+        next_pending = state.round_hours[-1]
+    else:
+        next_pending = (1, 1)
+    return {'last_completed': tuple(int(x) for x in last_completed), 
+            'next_pending': tuple(int(x) for x in next_pending)}
+
+def completed_hours(state):
+    """Returns the (round, hour) pairs that have been run, i.e. have recorded profits"""
+    completed = ~np.isnan(state.summary['profit']).any(axis=1)
+    return [r_h for (r_h, done) in zip(state.round_hours, completed) if done]
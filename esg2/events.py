@@ -0,0 +1,41 @@
+# EVENTS:
+# Fan-out of "hour completed" events to the scoreboard's Server-Sent Events streams (/scoreboard/stream). When
+# the admin runs an hour, one small event (the hour, the summary rows it changed and the new data version) is
+# published; each open stream is blocked on a condition variable until then, so idle spectators cost a parked
+# thread and nothing else. Events are kept in a short buffer so a stream that is busy writing doesn't miss any.
+
+import threading
+from collections import deque
+
+class HourEvents:
+    """The hour-completed events published in this process, numbered in order. Streams wait for events newer
+    than the last one they sent; a stream that falls more than max_events behind gets None and should tell its
+    client to refresh everything."""
+
+    def __init__(self, max_events=64):
+        self._events = deque(maxlen=max_events)
+        self._sequence = 0
+        self._condition = threading.Condition()
+
+    def publish(self, event):
+        with self._condition:
+            self._sequence += 1
+            self._events.append((self._sequence, event))
+            self._condition.notify_all()
+
+    def sequence(self):
+        with self._condition:
+            return self._sequence
+
+    def wait(self, sequence, timeout):
+        """Blocks until there are events after sequence (or until timeout seconds pass). Returns the new sequence
+        and the list of new events (empty on timeout, None if some were dropped from the buffer)."""
+        with self._condition:
+            self._condition.wait_for(lambda: self._sequence > sequence, timeout)
+            if self._sequence == sequence:
+                return sequence, []
+            if self._events[0][0] > sequence + 1:
+                return self._sequence, None
+            return self._sequence, [event for (i, event) in self._events if i > sequence]
+
+hour_events = HourEvents()
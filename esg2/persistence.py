@@ -0,0 +1,358 @@
+# PERSISTENCE:
+# The only layer that reads and writes the engine's files and results. The engine itself (esg2.engine) works on
+# an in-memory MarketState; these functions load that state from the instance folder and write it back at
+# checkpoints. Everything takes the instance path (and, for results, the database connection) explicitly, so
+# games can be loaded, run and saved outside of a request context.
+
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+import pandas as pd
+
+from esg2.cache import file_cache
+from esg2.registry import load_portfolio_registry, load_player_registry
+from esg2.engine import (
+    GameSettings, MarketState, Schedule, HOURLY_ADDITIONAL_HEADERS, PROGRESS_FIELDS, SUMMARY_FIELDS, 
+    create_hourly_sheet, create_bids_sheet, game_progress
+)
+
+# HOURLY RESULTS:
+# The settled hourly sheets of every hour that has been run, in one typed SQLite table keyed by 
+# (round, hour, unit_id) and indexed by portfolio and unit, so an hour is a single indexed read and cross-hour 
+# queries (a portfolio's history, a unit's totals) don't have to open one file per hour.
+# -   hourly_results : round,hour, followed by the hourly sheet columns (see engine.create_hourly_sheet)
+
+HOURLY_UNIT_COLUMNS = [('portfolio_id', 'INTEGER NOT NULL'), ('portfolio_name', 'TEXT'), ('unit_id', 'INTEGER NOT NULL'),
+                       ('unit_name', 'TEXT'), ('unit_location', 'TEXT'), ('unit_capacity', 'NUMERIC'),
+                       ('cost_per_mwh', 'NUMERIC'), ('cost_daily_om', 'NUMERIC'), ('carbon_per_mwh', 'NUMERIC')]
+HOURLY_RESULT_COLUMNS = [(header, 'INTEGER' if header == 'activated' else 'REAL') for header in HOURLY_ADDITIONAL_HEADERS]
+HOURLY_COLUMNS = [name for (name, _) in HOURLY_UNIT_COLUMNS + HOURLY_RESULT_COLUMNS]
+
+HOURLY_RESULTS_SCHEMA = (
+    'DROP TABLE IF EXISTS hourly_results;\n'
+    'CREATE TABLE hourly_results (\n  round INTEGER NOT NULL,\n  hour INTEGER NOT NULL,\n' +
+    ''.join('  ' + name + ' ' + sql_type + ',\n' for (name, sql_type) in HOURLY_UNIT_COLUMNS + HOURLY_RESULT_COLUMNS) +
+    '  PRIMARY KEY (round, hour, unit_id)\n);\n'
+    'CREATE INDEX hourly_results_portfolio ON hourly_results (portfolio_id, round, hour);\n'
+    'CREATE INDEX hourly_results_unit ON hourly_results (unit_id, round, hour);\n'
+)
+
+# COMMITTED BIDS:
+# The bids each hour was (or will be) cleared with, copied from the pending bids when the hour is run. Stored
+# one row per unit, hour and kind, so committing an hour writes only that hour's rows. Hours that have never 
+# been committed clear at max bid.
+# -   committed_bids : unit_id,round,hour,kind,value
+
+COMMITTED_BIDS_SCHEMA = '''
+DROP TABLE IF EXISTS committed_bids;
+
+CREATE TABLE committed_bids (
+  unit_id INTEGER NOT NULL,
+  round INTEGER NOT NULL,
+  hour INTEGER NOT NULL,
+  kind TEXT NOT NULL,
+  value REAL NOT NULL,
+  PRIMARY KEY (round, hour, unit_id, kind)
+);
+'''
+
+# LEDGER:
+# Each hour's revenue, cost, profit and balance per portfolio, as an append-only ledger: recording an hour
+# appends one entry per portfolio, and when an hour's values change (e.g. it is re-run, or an earlier hour's
+# re-run changes its balance) new entries are appended rather than old ones updated. The ledger_current view
+# holds the latest entry of each (round, hour, portfolio_id); the wide summary sheet is built from it on demand.
+# -   ledger : entry_id,round,hour,portfolio_id,revenue,cost,profit,balance,recorded_at
+
+LEDGER_SCHEMA = '''
+DROP VIEW IF EXISTS ledger_current;
+DROP TABLE IF EXISTS ledger;
+
+CREATE TABLE ledger (
+  entry_id INTEGER PRIMARY KEY AUTOINCREMENT,
+  round INTEGER NOT NULL,
+  hour INTEGER NOT NULL,
+  portfolio_id INTEGER NOT NULL,
+  revenue REAL,
+  cost REAL,
+  profit REAL,
+  balance REAL,
+  recorded_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX ledger_round_hour ON ledger (round, hour, portfolio_id, entry_id);
+
+CREATE VIEW ledger_current AS
+  SELECT round, hour, portfolio_id, revenue, cost, profit, balance FROM ledger l
+  WHERE entry_id = (SELECT MAX(entry_id) FROM ledger
+                    WHERE round = l.round AND hour = l.hour AND portfolio_id = l.portfolio_id);
+'''
+
+# CHART ARTIFACTS:
+# Chart JSON rendered when an hour is run (see scoreboard.render_chart_artifacts), stored with the sha256 of its
+# content so the chart routes can serve it as-is with a strong ETag. Charts without an artifact (e.g. of hours 
+# that haven't been run) are rendered on request instead.
+# -   chart_artifacts : chart,theme,content_hash,body
+
+CHART_ARTIFACTS_SCHEMA = '''
+DROP TABLE IF EXISTS chart_artifacts;
+
+CREATE TABLE chart_artifacts (
+  chart TEXT NOT NULL,
+  theme TEXT NOT NULL,
+  content_hash TEXT NOT NULL,
+  body TEXT NOT NULL,
+  PRIMARY KEY (chart, theme)
+);
+'''
+
+def csv_path(instance_path, *parts):
+    """Returns the path of a file in the instance's csv folder"""
+    return os.path.join(instance_path, 'csv', *parts)
+
+def hourly_filename(r, h):
+    return 'round_' + str(r) + '_hour_' + str(h) + '.csv'
+
+def load_game_settings(path):
+    return GameSettings.from_df(pd.read_csv(path))
+
+def read_game_settings(instance_path):
+    return file_cache.get(csv_path(instance_path, 'config', 'game_settings.csv'), load_game_settings)
+
+def read_schedule_index(instance_path):
+    """Returns the game's Schedule, indexed by (round, hour)"""
+    return file_cache.get(csv_path(instance_path, 'config', 'schedule.csv'), Schedule.from_csv)
+
+def read_schedule(instance_path):
+    return read_schedule_index(instance_path).schedule_df.copy()
+
+def read_portfolios(instance_path):
+    return load_portfolio_registry(csv_path(instance_path, 'config', 'portfolios.csv')).portfolios_df
+
+def read_players(instance_path):
+    return load_player_registry(csv_path(instance_path, 'players.csv')).players_df
+
+def create_game_tables(db):
+    """(Re)creates the empty committed bids, hourly results, ledger and chart artifact tables"""
+    db.executescript(COMMITTED_BIDS_SCHEMA)
+    db.executescript(HOURLY_RESULTS_SCHEMA)
+    db.executescript(LEDGER_SCHEMA)
+    db.executescript(CHART_ARTIFACTS_SCHEMA)
+
+def create_game_sheets(instance_path, db, schedule_df, portfolios_df, players_df):
+    """Creates empty game tables for a new game between the players in players_df. Returns its bids sheet, with
+    every bid at max bid."""
+    settings = read_game_settings(instance_path)
+
+    # get the portfolios that are active during this game
+    portfolios_df = portfolios_df[portfolios_df['portfolio_id'].isin(players_df['portfolio_id'])]
+
+    # committed bids, hourly results and ledger entries are saved in the database as hours are run
+    create_game_tables(db)
+
+    bids_df = create_bids_sheet(schedule_df, portfolios_df, settings.max_bid)
+
+    save_progress(MarketState(schedule_df, portfolios_df, players_df, settings), instance_path)
+    return bids_df
+
+def new_market_state(instance_path, db):
+    """Returns a MarketState of the game in the instance folder with its ledger values but no committed bids
+    (set them with MarketState.set_bid_entries)"""
+    state = MarketState(read_schedule_index(instance_path), read_portfolios(instance_path),
+                        read_players(instance_path), read_game_settings(instance_path))
+    state.set_summary_entries(read_ledger(db))
+    state.mark_summary_saved()
+    return state
+
+def new_hour_state(instance_path, db, r, h):
+    """Returns a MarketState for running round r hour h, with no committed bids (set that hour's with 
+    MarketState.set_bid_entries). It holds bids for that hour only, the ledger's profit and balance of every hour
+    (for the balance chain and the progress cursor), and the rest of the ledger from that hour on, where running
+    it may change balances; so the work of running an hour doesn't grow with the number of hours times units."""
+    state = MarketState(read_schedule_index(instance_path), read_portfolios(instance_path),
+                        read_players(instance_path), read_game_settings(instance_path), bid_hours=[(r, h)])
+    state.set_summary_entries(read_ledger(db, fields=PROGRESS_FIELDS))
+    state.set_summary_entries(read_ledger(db, from_hour=(r, h)))
+    state.mark_summary_saved()
+    return state
+
+def load_market_state(instance_path, db):
+    """Loads the game in the instance folder (config, players, committed bids and ledger) into a MarketState"""
+    state = new_market_state(instance_path, db)
+    state.set_bid_entries(read_committed_bids(db))
+    return state
+
+def save_committed_bids(db, bids_df):
+    """Stores bids_df (unit_id,round,hour,kind,value) as committed bids, replacing any already committed for the
+    same cells"""
+    with db:
+        db.executemany(
+            'INSERT OR REPLACE INTO committed_bids (unit_id, round, hour, kind, value) VALUES (?, ?, ?, ?, ?)',
+            bids_df[['unit_id', 'round', 'hour', 'kind', 'value']].itertuples(index=False, name=None)
+        )
+
+def read_committed_bids(db, r=None, h=None):
+    """Returns the committed bids (unit_id,round,hour,kind,value), optionally only those of round r hour h"""
+    query = 'SELECT unit_id, round, hour, kind, value FROM committed_bids'
+    params = []
+    if r is not None and h is not None:
+        query += ' WHERE round = ? AND hour = ?'
+        params.extend([int(r), int(h)])
+    return pd.read_sql_query(query, db, params=params)
+
+def hourly_result_rows(hourly_df, r, h):
+    """Yields the hourly_results rows of a settled hourly sheet"""
+    columns = [hourly_df[name].tolist() if name in hourly_df.columns else [None] * len(hourly_df.index)
+               for name in HOURLY_COLUMNS]
+    for values in zip(*columns):
+        yield (int(r), int(h)) + tuple(None if pd.isnull(value) else value for value in values)
+
+def save_hourly_sheets(state, db, round_hours):
+    """Replaces the stored results of each hour in round_hours with its hourly sheet in state.hourly (the caller
+    commits)"""
+    insert = ('INSERT INTO hourly_results (round, hour, ' + ', '.join(HOURLY_COLUMNS) + ') VALUES (' +
+              ', '.join('?' * (len(HOURLY_COLUMNS) + 2)) + ')')
+    for (r, h) in round_hours:
+        db.execute('DELETE FROM hourly_results WHERE round = ? AND hour = ?', (int(r), int(h)))
+        db.executemany(insert, hourly_result_rows(state.hourly[(r, h)], r, h))
+
+def read_hourly_results(db, r=None, h=None, portfolio_id=None, unit_id=None):
+    """Returns the stored hourly results (columns round,hour followed by the hourly sheet columns), optionally 
+    only those of round r hour h, one portfolio and/or one unit. Rows are in round/hour order, and within an 
+    hour in merit order (by base bid, then unit id)."""
+    conditions = []
+    params = []
+    if r is not None and h is not None:
+        conditions.append('round = ? AND hour = ?')
+        params.extend([int(r), int(h)])
+    if portfolio_id is not None:
+        conditions.append('portfolio_id = ?')
+        params.append(int(portfolio_id))
+    if unit_id is not None:
+        conditions.append('unit_id = ?')
+        params.append(int(unit_id))
+    query = 'SELECT * FROM hourly_results'
+    if conditions:
+        query += ' WHERE ' + ' AND '.join(conditions)
+    return pd.read_sql_query(query + ' ORDER BY round, hour, bid_base, unit_id', db, params=params)
+
+def read_hourly_sheet(instance_path, db, r, h):
+    """Returns the hourly sheet of round r hour h: its stored results if the hour has been run, otherwise an
+    unsettled sheet of the game's units. Raises FileNotFoundError (like a missing hourly csv did) for hours that
+    aren't in the schedule."""
+    hourly_df = read_hourly_results(db, r, h).drop(columns=['round', 'hour'])
+    if len(hourly_df.index) == 0:
+        if (r, h) not in read_schedule_index(instance_path):
+            raise FileNotFoundError(f'Round {r} hour {h} is not in the schedule')
+        players_df = read_players(instance_path)
+        portfolios_df = read_portfolios(instance_path)
+        hourly_df = create_hourly_sheet(portfolios_df[portfolios_df['portfolio_id'].isin(players_df['portfolio_id'])])
+    return hourly_df
+
+def read_ledger(db, r=None, h=None, portfolio_id=None, fields=None, from_hour=None):
+    """Returns the current ledger entries (round,hour,portfolio_id and the summary fields, default all of them),
+    optionally only those of round r hour h, of the hours from the (round, hour) from_hour on and/or of one 
+    portfolio"""
+    conditions = []
+    params = []
+    if r is not None and h is not None:
+        conditions.append('round = ? AND hour = ?')
+        params.extend([int(r), int(h)])
+    if from_hour is not None:
+        conditions.append('(round > ? OR (round = ? AND hour >= ?))')
+        params.extend([int(from_hour[0]), int(from_hour[0]), int(from_hour[1])])
+    if portfolio_id is not None:
+        conditions.append('portfolio_id = ?')
+        params.append(int(portfolio_id))
+    fields = [field for field in SUMMARY_FIELDS if fields is None or field in fields]
+    query = 'SELECT round, hour, portfolio_id, ' + ', '.join(fields) + ' FROM ledger_current'
+    if conditions:
+        query += ' WHERE ' + ' AND '.join(conditions)
+    return pd.read_sql_query(query + ' ORDER BY round, hour, portfolio_id', db, params=params)
+
+def save_ledger(state, db):
+    """Appends ledger entries for every hour whose summary values changed since they were loaded or last saved
+    (the caller commits). Returns the (round, hour) of those hours."""
+    round_hours = state.unsaved_summary_hours()
+    entries_df = state.summary_entries(round_hours)
+    db.executemany(
+        'INSERT INTO ledger (round, hour, portfolio_id, ' + ', '.join(SUMMARY_FIELDS) + ') VALUES (?, ?, ?, ?, ?, ?, ?)',
+        [tuple(None if pd.isnull(value) else value for value in entry)
+         for entry in entries_df[['round', 'hour', 'portfolio_id'] + SUMMARY_FIELDS].itertuples(index=False, name=None)]
+    )
+    return round_hours
+
+def read_summary(instance_path, db):
+    """Returns the wide summary sheet (schedule columns followed by the player_{id}_{field} columns), built from 
+    the current ledger entries"""
+    return new_market_state(instance_path, db).summary_df()
+
+def save_chart_artifacts(db, artifacts):
+    """Stores artifacts, an iterable of (chart, theme, body), replacing the previous artifacts of the same charts"""
+    rows = [(chart, theme, hashlib.sha256(body.encode('utf-8')).hexdigest(), body) 
+            for (chart, theme, body) in artifacts]
+    with db:
+        db.executemany(
+            'INSERT OR REPLACE INTO chart_artifacts (chart, theme, content_hash, body) VALUES (?, ?, ?, ?)', rows
+        )
+
+def read_chart_artifact(db, chart, theme):
+    """Returns the (content_hash, body) of a chart artifact, or None if it hasn't been rendered"""
+    return db.execute(
+        'SELECT content_hash, body FROM chart_artifacts WHERE chart = ? AND theme = ?', (chart, theme)
+    ).fetchone()
+
+def clear_chart_artifacts(db):
+    with db:
+        db.execute('DELETE FROM chart_artifacts')
+
+def save_progress(state, instance_path):
+    """Writes the game's progress cursor (see engine.game_progress) to progress.json, with a new data version"""
+    path = csv_path(instance_path, 'progress.json')
+    progress = game_progress(state)
+    # changes whenever results are saved, so values cached from older results (in any process) aren't reused
+    progress['data_version'] = time.time_ns()
+    # written to a temporary file and swapped in, so that other workers never read a partly written cursor
+    (fd, temp_path) = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(progress, f)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    # the cursor may be replaced within one mtime tick and at the same size
+    file_cache.invalidate(path)
+
+def load_progress(path):
+    with open(path) as f:
+        progress = json.load(f)
+    return {key: tuple(value) if isinstance(value, list) else value for (key, value) in progress.items()}
+
+def read_progress(instance_path):
+    """Returns the progress cursor saved by save_progress, or None if there isn't a readable one"""
+    try:
+        return file_cache.get(csv_path(instance_path, 'progress.json'), load_progress)
+    except (FileNotFoundError, ValueError):
+        return None
+
+def read_data_version(instance_path):
+    """Returns the data version saved with the progress cursor, or None if there isn't one"""
+    progress = read_progress(instance_path)
+    if progress is None:
+        return None
+    return progress.get('data_version')
+
+def save_market_state(state, instance_path, db, round_hours=None):
+    """Checkpoints state: writes the hourly sheets in round_hours (default: every hour cleared in memory) to
+    the results table and the changed summary values to the ledger, in one transaction, then saves the progress 
+    cursor"""
+    if round_hours is None:
+        round_hours = list(state.hourly)
+    with db:
+        save_hourly_sheets(state, db, round_hours)
+        save_ledger(state, db)
+    state.mark_summary_saved()
+    save_progress(state, instance_path)
@@ -6,9 +6,10 @@ from flask import (
     Blueprint, flash, g, redirect, render_template, request, send_from_directory, url_for, current_app
 )
 
+from esg2 import bid_store
 from esg2.db import get_db
 from esg2.auth import login_required
-from esg2.utilities import make_pretty_header, get_game_setting, form_entry_to_tuple
+from esg2.utilities import make_pretty_header, get_game_setting, get_schedule, form_entry_to_tuple
 
 bp = Blueprint('player', __name__, url_prefix='')
 
@@ -24,45 +25,29 @@ def player_dashboard():
 
     # POST
     if request.method == 'POST':
-        bids_df = get_portfolio_bids(portfolio_id)
+        schedule = get_schedule()
+        bids = []
 
         for (key, bid) in request.form.items():
             try:
                 unit_id, column_header, bid = form_entry_to_tuple(key, bid)
+                kind, r, h = bid_store.parse_bid_header(column_header)
                 # Check if bid is a valid decimal; any invalid/empty values will become None
                 try:
                     bid = round(decimal.Decimal(bid), 2)
-                    bid = min(bid, decimal.Decimal(decimal.Decimal(get_game_setting('max bid'))))
-                    bid = max(bid, decimal.Decimal(decimal.Decimal(get_game_setting('min bid'))))
-                    # Cast to String because sqlite doesn't like Decimals
-                    bid = "{:.2f}".format(bid)
+                    bid = min(bid, decimal.Decimal(str(get_game_setting('max bid'))))
+                    bid = max(bid, decimal.Decimal(str(get_game_setting('min bid'))))
                 except:
                     bid = None
-                if bid is not None:
+                if bid is not None and (r, h) in schedule:
                     # Overwrite bid only if form cell is not None 
-                    unit = bids_df.loc[bids_df['unit_id'] == int(unit_id)]
-                    # Overwrite bid only if unit is owned by player
-                    if len(unit.index) == 1 and unit['portfolio_id'].item() == portfolio_id:
-                        bids_df.loc[bids_df['unit_id'] == int(unit_id), column_header] = bid
+                    bids.append((int(unit_id), r, h, kind, bid))
             except:
                 print("Bad bid POST: ", key, bid)
 
-        # replace instances of nan with None
-        bids_df = bids_df.where(bids_df.notnull(), None)
-        # Update database: drop rows from `bids` in bids_df, append bids_df
-        # Note: this leaves the `bids` table out of order — this gets fixed in the to_csv
-        # stage of admin hour-running
-        db = get_db()
-        # Create temporary table for comparison purposes
-        bids_df.to_sql('temporary_bids', db, if_exists='replace', index=False)
-        # Drop any rows in `bids` that match a unit_id in `temporary_bids`
-        db.execute(
-            'DELETE FROM bids WHERE unit_id IN (SELECT unit_id FROM temporary_bids)'
-        )
-        db.commit()
-        # Append bids_df
-        bids_df.to_sql('bids', db, if_exists='append', index=False)
-            
+        # Update database: write the bids that changed, for units owned by the player only
+        changed = bid_store.upsert_bids(get_db(), bids, portfolio_id=portfolio_id)
+        flash(f"Updated {changed} bid(s).")
         return redirect(url_for('player.player_dashboard'))
 
     # GET
@@ -73,11 +58,14 @@ def player_dashboard():
     ).fetchone() is None:
         return render_template('/player/dashboard.html', initialized=False)
     else: 
-        bids_df = get_portfolio_bids(portfolio_id)
+        adjustment = get_game_setting('adjustment')
+        if adjustment == 'disabled':
+            bids_df = get_portfolio_bids(portfolio_id, kinds=['base'])
+        else:
+            bids_df = get_portfolio_bids(portfolio_id)
         # replace instances of nan with None
         bids_df = bids_df.where(bids_df.notnull(), None)
         unit_names_df = bids_df[['unit_name', 'unit_id']]
-        adjustment = get_game_setting('adjustment')
         if adjustment == 'disabled':
             base_bids_df = bids_df.filter(regex=("bid_base_.*"))
             name_bids_df = pd.concat([unit_names_df, base_bids_df], axis=1, sort=False)
@@ -96,9 +84,7 @@ def player_dashboard():
     }
     return render_template('/player/dashboard.html', **kwargs)
 
-def get_portfolio_bids(portfolio_id):
-    """Returns a Pandas DataFrame that represents a subset of the bids table corresponding to the provided portfolio_id"""
-    db = get_db()
-    bids_df = pd.read_sql_query('SELECT * FROM bids WHERE portfolio_id=' + str(portfolio_id), db)
-    return bids_df
+def get_portfolio_bids(portfolio_id, kinds=None):
+    """Returns a Pandas DataFrame that represents the bids grid of the provided portfolio_id (see bid_store.bid_grid)"""
+    return bid_store.bid_grid(get_db(), portfolio_id=portfolio_id, kinds=kinds)
 
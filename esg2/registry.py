@@ -0,0 +1,74 @@
+# REGISTRY:
+# Lookup tables for the portfolios/units in portfolios.csv and the players in players.csv, indexed by id.
+# Registries are loaded through the file cache, so they are parsed once and rebuilt only when their file
+# changes; lookups are then dictionary reads instead of csv parses and boolean-mask scans.
+
+import pandas as pd
+
+from esg2.cache import file_cache
+
+class PortfolioRegistry:
+    """The portfolios and units of a portfolios.csv file"""
+
+    def __init__(self, portfolios_df):
+        self._portfolios_df = portfolios_df
+        portfolio_pairs = portfolios_df[['portfolio_id', 'portfolio_name']].drop_duplicates('portfolio_id')
+        self.portfolio_names = dict(zip(portfolio_pairs['portfolio_id'].astype(int).tolist(), portfolio_pairs['portfolio_name']))
+        self.portfolio_ids = {name: i for (i, name) in self.portfolio_names.items()}
+        self.units = {int(unit['unit_id']): unit for unit in portfolios_df.to_dict('records')}
+        self.unit_ids_by_portfolio = {int(i): group['unit_id'].astype(int).tolist()
+                                      for (i, group) in portfolios_df.groupby('portfolio_id', sort=False)}
+
+    @classmethod
+    def from_csv(cls, path):
+        return cls(pd.read_csv(path))
+
+    @property
+    def portfolios_df(self):
+        """A copy of the full portfolios.csv table"""
+        return self._portfolios_df.copy()
+
+    def names(self):
+        """Returns the list of unique portfolio names, in file order"""
+        return list(self.portfolio_ids)
+
+    def name(self, portfolio_id):
+        return self.portfolio_names[int(portfolio_id)]
+
+    def id(self, portfolio_name):
+        return self.portfolio_ids[portfolio_name]
+
+    def unit(self, unit_id):
+        """Returns the portfolios.csv row of a unit as a dict"""
+        return self.units[int(unit_id)]
+
+class PlayerRegistry:
+    """The players of an initialized game (players.csv), indexed by portfolio id"""
+
+    def __init__(self, players_df):
+        players_df = players_df.sort_values(by=['portfolio_id'], ascending=[True])
+        self._players_df = players_df
+        ids = players_df['portfolio_id'].astype(int).tolist()
+        self.ids = ids
+        self.portfolio_names = dict(zip(ids, players_df['portfolio']))
+        self.usernames = dict(zip(ids, players_df['username']))
+        self.starting_money = dict(zip(ids, players_df['starting_money'].astype(float).tolist()))
+
+    @classmethod
+    def from_csv(cls, path):
+        return cls(pd.read_csv(path))
+
+    @property
+    def players_df(self):
+        """A copy of the full players.csv table"""
+        return self._players_df.copy()
+
+    def names(self):
+        """Returns the list of portfolio names with an initialized player"""
+        return [self.portfolio_names[i] for i in self.ids]
+
+def load_portfolio_registry(path):
+    return file_cache.get(path, PortfolioRegistry.from_csv)
+
+def load_player_registry(path):
+    return file_cache.get(path, PlayerRegistry.from_csv)
@@ -0,0 +1,116 @@
+# RESPONSES:
+# HTTP caching for the scoreboard's downloads and charts. Responses built from the game's results get an ETag
+# derived from the data version (see persistence.save_progress) and the config files' signatures, which is
+# checked before anything is read or rendered, so a refresh storm is mostly answered with bodyless 304s.
+# Large JSON, CSV and text responses are compressed (brotli if it's installed, otherwise gzip), and static
+# assets are linked with a fingerprint of their contents so browsers can keep them until they change.
+
+import gzip
+import hashlib
+import os
+
+from flask import Response, current_app, request
+
+from esg2 import persistence
+from esg2.cache import file_cache
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = {'application/json', 'text/csv', 'text/html', 'text/css', 'text/javascript',
+                          'application/javascript'}
+
+# The files results responses are built from besides the database (unsettled hourly sheets, chart settings,
+# demand curves)
+RESULTS_CONFIG_FILES = [('players.csv',), ('config', 'portfolios.csv'), ('config', 'game_settings.csv'),
+                        ('config', 'schedule.csv')]
+
+STATIC_MAX_AGE = 365 * 24 * 60 * 60
+
+def results_etag(instance_path, *parts):
+    """Returns the ETag of the response identified by parts (e.g. a chart's name and theme) built from the game's
+    results: it changes with the data version and whenever a config file is rewritten"""
+    signature = [persistence.read_data_version(instance_path)]
+    for path_parts in RESULTS_CONFIG_FILES:
+        try:
+            stat = os.stat(persistence.csv_path(instance_path, *path_parts))
+            signature.append((stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            signature.append(None)
+    return hashlib.sha1(repr((signature, parts)).encode('utf-8')).hexdigest()
+
+def cached_response(etag, build, mimetype, headers=None):
+    """Returns a 304 response if the request's If-None-Match matches etag; otherwise a response with body
+    build() and ETag etag. Clients may store either but must revalidate it before every use."""
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+        # the 200 the client holds may have been compressed, which made its ETag weak (see compress_response);
+        # a 304 carries the validator in the same form, and varies like the 200 did
+        response.set_etag(etag, weak=request.if_none_match.is_weak(etag))
+        if mimetype in COMPRESSIBLE_MIMETYPES:
+            response.vary.add('Accept-Encoding')
+    else:
+        response = Response(build(), mimetype=mimetype, headers=headers)
+        response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.no_cache = True
+    return response
+
+def accepted_encoding():
+    """Returns the best response encoding the client accepts ('br' or 'gzip'), or None"""
+    if brotli is not None and request.accept_encodings['br'] > 0:
+        return 'br'
+    if request.accept_encodings['gzip'] > 0:
+        return 'gzip'
+    return None
+
+def compress_response(response):
+    """Compresses a full (not streamed) text response of at least COMPRESS_MIN_SIZE bytes, if the client accepts
+    it. Its ETag, if any, becomes weak: the compressed body is the same resource in another encoding."""
+    if (response.status_code != 200 or response.mimetype not in COMPRESSIBLE_MIMETYPES
+            or 'Content-Encoding' in response.headers):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = accepted_encoding()
+    if (encoding is None or response.content_length is None
+            or response.content_length < current_app.config['COMPRESS_MIN_SIZE']):
+        return response
+    # files are sent straight from disk; read them in so they can be compressed
+    response.direct_passthrough = False
+    data = response.get_data()
+    if encoding == 'br':
+        response.set_data(brotli.compress(data, quality=current_app.config['COMPRESS_LEVEL']))
+    else:
+        response.set_data(gzip.compress(data, compresslevel=current_app.config['COMPRESS_LEVEL']))
+    response.headers['Content-Encoding'] = encoding
+    (etag, weak) = response.get_etag()
+    if etag is not None and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+def file_fingerprint(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()[:12]
+
+def init_app(app):
+    @app.url_defaults
+    def fingerprint_static_url(endpoint, values):
+        """Adds the fingerprint of a static file's contents to its URL (?v=...)"""
+        if endpoint == 'static' and 'filename' in values and 'v' not in values:
+            try:
+                values['v'] = file_cache.get(os.path.join(app.static_folder, values['filename']), file_fingerprint)
+            except (FileNotFoundError, IsADirectoryError):
+                pass
+
+    @app.after_request
+    def cache_and_compress(response):
+        # fingerprinted static URLs change with their file, so their responses never go stale
+        if request.endpoint == 'static' and request.args.get('v') and response.status_code in (200, 304):
+            response.cache_control.no_cache = None
+            response.cache_control.public = True
+            response.cache_control.max_age = STATIC_MAX_AGE
+            response.cache_control.immutable = True
+            response.headers.pop('Expires', None)
+        return compress_response(response)
@@ -1,6 +1,8 @@
 DROP TABLE IF EXISTS user;
 DROP TABLE IF EXISTS player;
 DROP TABLE IF EXISTS bids;
+DROP TABLE IF EXISTS bid_units;
+DROP TABLE IF EXISTS temporary_bids;
 
 CREATE TABLE user (
   id INTEGER PRIMARY KEY AUTOINCREMENT,
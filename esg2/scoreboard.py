@@ -1,5 +1,5 @@
 # SCOREBOARD
-# Communicates common data: summary.csv info, hourly recaps
+# Communicates common data: game summary info, hourly recaps
 # Everything should be publicly sharable
 
 import decimal
@@ -13,7 +13,7 @@ import numpy as np
 import pandas as pd
 
 from flask import (
-    Blueprint, render_template, request, url_for, send_from_directory, current_app
+    Blueprint, Response, abort, render_template, request, url_for, send_from_directory, current_app
 )
 
 from bokeh.embed import json_item
@@ -23,9 +23,13 @@ from bokeh.plotting import figure
 from bokeh.resources import CDN
 from bokeh.themes import Theme, built_in_themes
 
+from esg2 import engine, persistence
+from esg2.cache import chart_cache
+from esg2.events import hour_events
 from esg2.db import get_db
+from esg2.responses import cached_response, results_etag
 from esg2.utilities import (
-    get_game_setting, last_filled_summary_row, round_hour_names, get_portfolio_name_by_id, 
+    get_game_setting, get_game_progress, get_schedule, round_hour_names, get_portfolio_name_by_id, 
     get_starting_money_by_portfolio_id
 )
 
@@ -60,6 +64,12 @@ DARK_THEME_JSON = {
     }
 }
 
+# Summary table views and the summary field each one shows
+SUMMARY_VIEWS = {"Balance": "balance", "Revenue": "revenue", "Losses": "cost", "Profit": "profit"}
+
+# Most rows shown on one page of the summary table
+MAX_SUMMARY_PAGE_SIZE = 1000
+
 @bp.route('/scoreboard', methods=['GET', 'POST'])
 def scoreboard():
 
@@ -69,25 +79,61 @@ def scoreboard():
     ).fetchone() is None:
         return render_template('scoreboard.html', initialized=False)
 
-    summary_df = pd.read_csv(os.path.join(current_app.instance_path, 'csv', 'summary.csv'))
-    schedule_df = pd.read_csv(os.path.join(current_app.instance_path, 'csv', 'config', 'schedule.csv'))
+    summary_df = persistence.read_summary(current_app.instance_path, db)
+    schedule_df = get_schedule().schedule_df
 
     # Default value if request args are not provided
-    r, h = last_filled_summary_row(summary_df)
+    r, h = get_game_progress()['last_completed']
     chart_r_h = f'{r}/{h}'
-    (headings, table) = create_summary_subtable(summary_df, "balance")
     current_view_name = 'Balance'
+    suffix = 'balance'
     scroll_to_id = None
 
     if request.args.get('summary-view', ''):
         current_view_name = request.args.get('summary-view', '')
-        suffix_lookup = {"Balance": "balance", "Revenue": "revenue", "Losses": "cost", "Profit": "profit"}
-        suffix = suffix_lookup.get(current_view_name, 'balance')
-        (headings, table) = create_summary_subtable(summary_df, suffix)
+        suffix = SUMMARY_VIEWS.get(current_view_name, 'balance')
 
     if request.args.get('hour-r-h', ''):
         chart_r_h = request.args.get('hour-r-h', '')
 
+    # The summary table shows one window of page_size hours, by default the one ending at the last completed hour
+    hour_names = round_hour_names(summary_df)
+    page_size = min(max(request.args.get('page-size', current_app.config['SUMMARY_PAGE_SIZE'], type=int), 1), 
+                    MAX_SUMMARY_PAGE_SIZE)
+    if request.args.get('summary-from', '') in hour_names:
+        start = hour_names.index(request.args.get('summary-from'))
+    elif f'{r}/{h}' in hour_names:
+        start = max(hour_names.index(f'{r}/{h}') - page_size + 1, 0)
+    else:
+        start = 0
+    window_df = summary_df.iloc[start:start + page_size]
+    (headings, table) = create_summary_subtable(window_df, suffix)
+
+    summary_chart_resolution = 'full' if request.args.get('summary-chart') == 'full' else 'default'
+    # hourly charts of large fleets are aggregated (see render_hourly_chart) unless full detail is asked for
+    hourly_chart_detail = 'full' if request.args.get('hourly-chart') == 'full' else 'default'
+    hourly_chart_aggregated = (db.execute('SELECT COUNT(*) FROM bid_units').fetchone()[0] > 
+                               current_app.config['HOURLY_CHART_LOD_UNITS'])
+
+    def scoreboard_url(**args):
+        """Returns the URL of this scoreboard view with some arguments changed"""
+        view_args = {'hour-r-h': chart_r_h, 'summary-view': current_view_name, 'page-size': page_size,
+                     'summary-from': hour_names[start] if start < len(hour_names) else None, 
+                     'summary-chart': summary_chart_resolution, 'hourly-chart': hourly_chart_detail}
+        view_args.update({key.replace('_', '-'): value for (key, value) in args.items()})
+        return url_for('scoreboard.scoreboard', **view_args)
+
+    def window_url(window_start):
+        return scoreboard_url(summary_from=hour_names[window_start])
+    summary_window = {
+        'from': hour_names[start] if len(window_df.index) > 0 else None,
+        'to': hour_names[start + len(window_df.index) - 1] if len(window_df.index) > 0 else None,
+        'count': len(hour_names),
+        'page_size': page_size,
+        'prev_url': window_url(max(start - page_size, 0)) if start > 0 else None,
+        'next_url': window_url(start + page_size) if start + page_size < len(hour_names) else None
+    }
+
     # if request.args.get('scroll-to', ''):
     #     scroll_to_id = request.args.get('scroll-to', '')
 
@@ -98,80 +144,234 @@ def scoreboard():
         'resources':CDN.render(),
         'summary_table_headers':headings,
         'summary_table':table, 
+        'summary_table_hours':round_hour_names(window_df),
+        'summary_window':summary_window,
+        'summary_chart_resolution':summary_chart_resolution,
+        'summary_chart_toggle_url':scoreboard_url(summary_chart='default' if summary_chart_resolution == 'full' else 'full'),
+        'hourly_chart_detail':hourly_chart_detail,
+        'hourly_chart_toggle_url':(scoreboard_url(hourly_chart='default' if hourly_chart_detail == 'full' else 'full')
+                                   if hourly_chart_aggregated else None),
         'current_summary_view':current_view_name,
         'scroll_to_id':scroll_to_id
     }
     return render_template('scoreboard.html', **kwargs)
 
+@bp.route('/scoreboard/summary-rows')
+def summary_rows():
+    """Returns summary table rows as JSON ({"r/h": [value per player column]}, null for empty values), for the 
+    hours listed in the hours argument (comma separated r/h, default all of them)"""
+    suffix = SUMMARY_VIEWS.get(request.args.get('summary-view'), 'balance')
+    def build():
+        summary_df = persistence.read_summary(current_app.instance_path, get_db())
+        selected_columns = summary_df.filter(regex=(".*_" + suffix))
+        selected_columns = selected_columns.astype(object).where(selected_columns.notnull(), None)
+        rows = dict(zip(round_hour_names(summary_df), selected_columns.values.tolist()))
+        if request.args.get('hours'):
+            hours = request.args.get('hours').split(',')
+            rows = {r_h: rows[r_h] for r_h in hours if r_h in rows}
+        return json.dumps(rows)
+    etag = results_etag(current_app.instance_path, 'summary-rows', suffix, request.args.get('hours'))
+    return cached_response(etag, build, 'application/json')
+
+def hour_completed_event(r, h, updated_hours):
+    """Returns the scoreboard event of round r hour h having been run: its hourly chart and the summary rows of 
+    r/h and updated_hours have changed"""
+    return {
+        'round': r, 
+        'hour': h, 
+        'hours': [f'{r}/{h}'] + [f'{later_r}/{later_h}' for (later_r, later_h) in updated_hours],
+        'data_version': persistence.read_data_version(current_app.instance_path)
+    }
+
+def refresh_event(instance_path):
+    """Returns an event telling clients to refresh every chart and summary row (for results saved by another 
+    process, or events a stream fell behind on)"""
+    progress = persistence.read_progress(instance_path) or {}
+    (r, h) = progress.get('last_completed', (None, None))
+    return {'round': r, 'hour': h, 'hours': None, 'data_version': progress.get('data_version')}
+
+def format_event(event):
+    return f"id: {event['data_version']}\nevent: hour-completed\ndata: {json.dumps(event)}\n\n"
+
+def hour_event_stream(instance_path, last_event_id, keepalive):
+    """Yields the Server-Sent Events of a scoreboard stream: an event whenever an hour is run, and a keepalive 
+    comment every keepalive seconds without one"""
+    sequence = hour_events.sequence()
+    data_version = persistence.read_data_version(instance_path)
+    # a reconnecting client that missed results gets a refresh straight away
+    if last_event_id is not None and last_event_id != str(data_version):
+        yield format_event(refresh_event(instance_path))
+    while True:
+        (sequence, events) = hour_events.wait(sequence, keepalive)
+        if events is None:
+            event = refresh_event(instance_path)
+            data_version = event['data_version']
+            yield format_event(event)
+        elif events:
+            for event in events:
+                data_version = event['data_version']
+                yield format_event(event)
+        elif persistence.read_data_version(instance_path) != data_version:
+            # results saved by another worker process, which publishes to its own streams
+            event = refresh_event(instance_path)
+            data_version = event['data_version']
+            yield format_event(event)
+        else:
+            yield ': keepalive\n\n'
+
+@bp.route('/scoreboard/stream')
+def scoreboard_stream():
+    stream = hour_event_stream(current_app.instance_path, request.headers.get('Last-Event-ID'), 
+                               current_app.config['SCOREBOARD_STREAM_KEEPALIVE'])
+    return Response(stream, mimetype='text/event-stream', 
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 def create_summary_subtable(summary_df, header_suffix):
     # Information to display: round, hour, [header_suffix (balance/profit/cost/revenue)] for each player
-    r_h = summary_df[['round', 'hour']]
     selected_columns = summary_df.filter(regex=(".*_" + header_suffix))
-    r_h_selected = pd.concat([r_h, selected_columns], axis=1, sort=False)
 
-    # Headers: Day, Hour, player name\nPortfolio
-    selected_headers = list(selected_columns.columns)
+    # Headers: Day/Hour, player name\nPortfolio
     extract_id = lambda header: int(re.search('player_(.*)_' + header_suffix, header).group(1))
-    ids = list(map(extract_id, selected_headers))    
-
-    table_headers = ["Day", "Hour"] + [id_to_header(i) for i in ids]
-    r_h_selected.columns = table_headers
+    ids = [extract_id(header) for header in selected_columns.columns]
+    headers = portfolio_headers(ids)
+    table_headers = ["Day/Hour"] + [headers[i] for i in ids]
 
-    r_h_selected.insert(0, "Day/Hour", r_h_selected.apply(lambda row: r_h_column_to_linked_html(row), axis=1))
-    r_h_selected = r_h_selected.drop(columns=["Day", "Hour"])
+    links = r_h_linked_html(summary_df['round'], summary_df['hour'])
+    table = [[link] + values for (link, values) in zip(links, selected_columns.values.tolist())]
 
-    return (list(r_h_selected.columns), r_h_selected.values.tolist())
+    return (table_headers, table)
 
-def id_to_header(portfolio_id):
+def portfolio_headers(portfolio_ids):
+    """Returns a dict of the summary table header of each portfolio id: the username and portfolio name of its
+    player (one query for all of them), or just the portfolio name if it has no player"""
     db = get_db()
-    try:
-        (username, portfolio) = db.execute(
-            'SELECT username, portfolio'
-            ' FROM player p JOIN user u ON p.player_id = u.id'
-            ' WHERE p.portfolio_id = ?', (portfolio_id,)
-        ).fetchone()
-        return username + '<br><span style="font-weight: normal;">' + portfolio + '</span>'
-    except:
-        return '<br><span style="font-weight: normal;">' + get_portfolio_name_by_id(portfolio_id)
-
-def r_h_column_to_linked_html(row):
-    r = str(int(row["Day"]))
-    h = str(int(row["Hour"]))
-    # HACK: This isn't a dynamic link. Ideally there should be a way to do this with url_for
-    a_element = '<a href="' + url_for('scoreboard.hourly_file', r=r, h=h) + '">'
-    html = a_element + r + '/' + h + '</a>'
-    return html
+    players = {int(portfolio_id): (username, portfolio) for (portfolio_id, username, portfolio) in db.execute(
+        'SELECT p.portfolio_id, username, portfolio'
+        ' FROM player p JOIN user u ON p.player_id = u.id'
+    ).fetchall()}
+    headers = {}
+    for i in portfolio_ids:
+        if i in players:
+            (username, portfolio) = players[i]
+            headers[i] = username + '<br><span style="font-weight: normal;">' + portfolio + '</span>'
+        else:
+            headers[i] = '<br><span style="font-weight: normal;">' + get_portfolio_name_by_id(i)
+    return headers
+
+def r_h_linked_html(rounds, hours):
+    """Returns the Day/Hour column: an r/h link to the hourly export of each round and hour, built as whole
+    string columns"""
+    r = rounds.astype(int).astype(str)
+    h = hours.astype(int).astype(str)
+    # HACK: url_for is resolved once for a placeholder hour, whose r/h part is then swapped per row
+    url_prefix = url_for('scoreboard.hourly_file', r=0, h=0).rsplit('r0h0.csv', 1)[0]
+    html = '<a href="' + url_prefix + 'r' + r + 'h' + h + '.csv">' + r + '/' + h + '</a>'
+    return html.tolist()
             
+@bp.route('/csv/summary.csv')
+def summary_file():
+    # Exported from the ledger
+    def build():
+        try:
+            summary_df = persistence.read_summary(current_app.instance_path, get_db())
+        except(FileNotFoundError):
+            abort(404)
+        return summary_df.to_csv(index=False)
+    return cached_response(results_etag(current_app.instance_path, 'summary.csv'), build, 'text/csv', 
+                           headers={'Content-Disposition': 'inline; filename=summary.csv'})
+
 @bp.route('/csv/<filename>')
 def engine_file(filename):
     return send_from_directory(os.path.join(current_app.instance_path, 'csv'), filename)
 
-@bp.route('/csv/hourly/r<r>h<h>.csv')
+@bp.route('/csv/hourly/r<int:r>h<int:h>.csv')
 def hourly_file(r, h):
-    return send_from_directory(os.path.join(current_app.instance_path, 'csv', 'hourly'), "round_" + r + "_hour_" + h + ".csv")
-
-@bp.route('/chart/hourly/r<r>h<h>')
+    # Exported from the hourly_results table
+    def build():
+        try:
+            hourly_df = persistence.read_hourly_sheet(current_app.instance_path, get_db(), r, h)
+        except(FileNotFoundError):
+            abort(404)
+        return hourly_df.to_csv(index=False)
+    filename = persistence.hourly_filename(r, h)
+    return cached_response(results_etag(current_app.instance_path, filename), build, 'text/csv', 
+                           headers={'Content-Disposition': 'inline; filename=' + filename})
+
+CHART_THEMES = ['light', 'dark']
+
+def chart_theme():
+    """Returns the theme requested for a chart: 'dark' or 'light'"""
+    return 'dark' if request.args.get('theme') == 'dark' else 'light'
+
+def chart_json(chart, target, theme):
+    if theme == 'dark':
+        return json.dumps(json_item(chart, target, theme=Theme(json=DARK_THEME_JSON)))
+    else:
+        return json.dumps(json_item(chart, target))
+
+def hourly_chart_name(r, h):
+    return f'hourly-r{r}h{h}'
+
+def chart_artifact_response(artifact):
+    """Returns a response serving a stored chart artifact, with its content hash as its ETag"""
+    (content_hash, body) = artifact
+    return cached_response(content_hash, lambda: body, 'application/json')
+
+def rendered_chart_response(kind, theme, render, *parts):
+    """Returns a response serving a chart rendered on request (by render(), cached in chart_cache), with an ETag
+    of the results and config it's built from (see results_etag), so that an unchanged chart isn't even looked 
+    up. The cache is keyed on the same ETag, so a config upload in another worker doesn't leave stale charts."""
+    etag = results_etag(current_app.instance_path, kind, theme, *parts)
+    return cached_response(etag, lambda: chart_cache.get((kind, *parts, theme, etag), render), 'application/json')
+
+def render_chart_artifacts(r, h):
+    """Renders the charts that change when round r hour h is run (its hourly chart and the summary chart) in 
+    every theme and stores them as chart artifacts"""
+    artifacts = []
+    for theme in CHART_THEMES:
+        artifacts.append((hourly_chart_name(r, h), theme, render_hourly_chart(r, h, theme)))
+        artifacts.append(('summary', theme, render_summary_chart(theme)))
+    persistence.save_chart_artifacts(get_db(), artifacts)
+
+@bp.route('/chart/hourly/r<int:r>h<int:h>')
 def hourly_chart(r, h):
     try:
-        hourly_df = pd.read_csv(os.path.join(current_app.instance_path, 'csv', 'hourly', "round_" + str(r) + "_hour_" + str(h) + ".csv"))
-        schedule_df = pd.read_csv(os.path.join(current_app.instance_path, 'csv', 'config', 'schedule.csv'))
-        if request.args.get('theme') == 'dark': 
-            alpha_boost = 0.2
-        else: 
-            alpha_boost = 0.0
-        if get_game_setting('adjustment') == 'per unit' or get_game_setting('adjustment') == 'per portfolio': 
-            p = create_hour_chart(schedule_df, hourly_df, int(r), int(h), True, alpha_boost=alpha_boost)
-        else: 
-            p = create_hour_chart(schedule_df, hourly_df, int(r), int(h), False, alpha_boost=alpha_boost)
-        if request.args.get('theme') == 'dark':
-            return json.dumps(json_item(p, "hourly-chart", theme=Theme(json=DARK_THEME_JSON)))
-        else:
-            return json.dumps(json_item(p, "hourly-chart"))
+        if (r, h) not in get_schedule():
+            abort(404)
+        theme = chart_theme()
+        # the pre-rendered chart may be aggregated (see render_hourly_chart); full detail is rendered on request
+        full_detail = request.args.get('detail') == 'full'
+        if not full_detail:
+            artifact = persistence.read_chart_artifact(get_db(), hourly_chart_name(r, h), theme)
+            if artifact is not None:
+                return chart_artifact_response(artifact)
+        kind = 'hourly-full' if full_detail else 'hourly'
+        return rendered_chart_response(kind, theme, lambda: render_hourly_chart(r, h, theme, full_detail), r, h)
     except(FileNotFoundError):
         return "Bad request. Has the game been initialized?"
 
-def create_hour_chart(schedule_df, hourly_df, r, h, adjustment=False, alpha_boost=0):
-    """Creates a Bokeh chart of the supply and demand curves given a round and hour"""
+def render_hourly_chart(r, h, theme, full_detail=False):
+    """Returns the JSON of the hourly chart of round r hour h. Unless full_detail, the supply curves of hours with
+    more than HOURLY_CHART_LOD_UNITS units are aggregated to about HOURLY_CHART_PIXELS steps wide (see 
+    lod_groups)."""
+    hourly_df = persistence.read_hourly_sheet(current_app.instance_path, get_db(), r, h)
+    schedule = get_schedule()
+    if theme == 'dark': 
+        alpha_boost = 0.2
+    else: 
+        alpha_boost = 0.0
+    lod_width = None
+    if not full_detail and len(hourly_df.index) > current_app.config['HOURLY_CHART_LOD_UNITS']:
+        lod_width = hourly_df['unit_capacity'].sum() / current_app.config['HOURLY_CHART_PIXELS']
+    if get_game_setting('adjustment') == 'per unit' or get_game_setting('adjustment') == 'per portfolio': 
+        p = create_hour_chart(schedule, hourly_df, r, h, True, alpha_boost=alpha_boost, lod_width=lod_width)
+    else: 
+        p = create_hour_chart(schedule, hourly_df, r, h, False, alpha_boost=alpha_boost, lod_width=lod_width)
+    return chart_json(p, "hourly-chart", theme)
+
+def create_hour_chart(schedule, hourly_df, r, h, adjustment=False, alpha_boost=0, lod_width=None):
+    """Creates a Bokeh chart of the supply and demand curves given a round and hour. If lod_width (in MWh) is 
+    given, the curves are drawn at that level of detail (see lod_groups) instead of one segment per unit."""
 
     colors = ['#57BCCD', '#3976AF', '#F08636', '#529D3F', '#C63A33', '#8D6AB8', '#85594E', 
               '#D57EBF', '#81E5D9', '#ECA5C8', '#BD9DDA', '#D6C849', '#F2A175']
@@ -193,9 +393,9 @@ def create_hour_chart(schedule_df, hourly_df, r, h, adjustment=False, alpha_boos
     chart.toolbar.active_drag = None
 
     # Create demand curve
-    current_row = schedule_df[schedule_df['round'] == r][schedule_df['hour'] == h]
-    net = current_row.iloc[0]['net_base_demand']
-    slope = current_row.iloc[0]['slope']
+    current_hour = schedule[r, h]
+    net = current_hour.net_base_demand
+    slope = current_hour.slope
 
     if slope == 0:
         def demand_y_to_x(y):
@@ -212,7 +412,15 @@ def create_hour_chart(schedule_df, hourly_df, r, h, adjustment=False, alpha_boos
 
     chart.line(x=demand_xs, y=demand_ys, line_width=4, color='gray')
 
-    (intercept_x, intercept_y) = get_supply_demand_intercept(hourly_df, schedule_df, r, h)
+    # Every curve below is drawn from the same step coordinates
+    (hourly_df, x_lefts, x_rights) = supply_steps(hourly_df)
+    capacities = hourly_df['unit_capacity'].to_numpy(dtype=float)
+    bids = hourly_df['bid_base'].to_numpy(dtype=float)
+    portfolio_names = hourly_df['portfolio_name'].to_numpy()
+    unit_names = hourly_df['unit_name'].to_numpy()
+    unit_colors = np.array(colors)[hourly_df['portfolio_id'].to_numpy(dtype=int) - 1 % len(colors)]
+
+    (intercept_x, intercept_y) = get_supply_demand_intercept(bids, capacities, schedule, r, h)
 
     intercept = {'x': [float("{:0.2f}".format(intercept_x))], 'y': [float("{:0.2f}".format(intercept_y))]}
 
@@ -221,32 +429,35 @@ def create_hour_chart(schedule_df, hourly_df, r, h, adjustment=False, alpha_boos
     chart.add_tools(HoverTool(renderers=[intercept_circle], point_policy='snap_to_data', attachment='below',
                             tooltips=[("", "(@x{0.00} MWh, @y{0.00} $/MWh)"),]))
 
-
-    # Read corresponding hourly csv (assume it exists)
-    # Sort by base_bid, secondary sort by unit_id
-    hourly_df = hourly_df.sort_values(by=['bid_base', 'unit_id'], ascending=[True, True])
-
     # Attempt to create supply curves
-    supply_curve_data = defaultdict(list)
-
-    mwh_running_total = 0
-    for _, row in hourly_df.iterrows():
-        x_left = mwh_running_total
-        x_right = x_left + float(row['unit_capacity'])
-        y = float(row['bid_base'])
-        supply_curve_data['xs'].append([x_left, x_right])
-        supply_curve_data['ys'].append([y, y])
-        supply_curve_data['portfolio_name'].append(row['portfolio_name'])
-        supply_curve_data['unit_name'].append(row['unit_name'])
-        supply_curve_data['bid'].append("{:0.2f}".format(y))
-        supply_curve_data['mwh_produced'].append(row['mwh_produced'])
-        supply_curve_data['color'].append(colors[int(row['portfolio_id']) - 1 % len(colors)])
-        mwh_running_total += float(row['unit_capacity'])
-
-    base_cds = ColumnDataSource(supply_curve_data)
-
-    non_nan_y_pairs = [y for y in supply_curve_data['ys'] if (not np.isnan(y[0]) and not np.isnan(y[1]))]
-    if (len(non_nan_y_pairs) > 0):
+    if lod_width is None:
+        base_cds = ColumnDataSource({
+            'xs': list(np.column_stack([x_lefts, x_rights])),
+            'ys': list(np.column_stack([bids, bids])),
+            'portfolio_name': portfolio_names,
+            'unit_name': unit_names,
+            'bid': np.char.mod('%0.2f', bids),
+            'mwh_produced': hourly_df['mwh_produced'].to_numpy(),
+            'color': unit_colors
+        })
+    else:
+        segments_df = lod_segments(pd.DataFrame({
+            'x_left': x_lefts, 'x_right': x_rights, 'y': bids, 'portfolio_id': hourly_df['portfolio_id'].to_numpy(),
+            'portfolio_name': portfolio_names, 'unit_name': unit_names, 'color': unit_colors,
+            'mwh': hourly_df['mwh_produced'].to_numpy(dtype=float)
+        }), ['portfolio_id', 'y'], lod_width)
+        (step_xs, step_ys) = lod_step_lines(segments_df)
+        base_cds = ColumnDataSource({
+            'xs': step_xs,
+            'ys': step_ys,
+            'portfolio_name': segments_df['portfolio_name'].to_numpy(),
+            'unit_name': segments_df['unit_name'].to_numpy(),
+            'bid': segments_df['y_label'].to_numpy(),
+            'mwh_produced': segments_df['mwh'].to_numpy(),
+            'color': segments_df['color'].to_numpy()
+        })
+
+    if (~np.isnan(bids)).any():
         supply_curve = chart.multi_line(xs='xs', ys='ys', line_width=4, line_color='color', line_alpha=0.6,
                                         hover_line_color='color', hover_line_alpha=1.0, source=base_cds)
 
@@ -260,52 +471,54 @@ def create_hour_chart(schedule_df, hourly_df, r, h, adjustment=False, alpha_boos
 
         # Add adjustment lines
         if adjustment:
-            def fill_multiline_data(curve_dict, x_left, x_right, y, row, adj_dir, alpha, hover_alpha):
-                """Adds another line to curve_dict at height y from x_left to x_right with display information
-                drawn from row and adj_dir ('up' or 'down').
+            unit_locations = hourly_df['unit_location'].to_numpy()
+
+            def adjustment_curve_data(adj_dir):
+                """Returns the data of the adj_dir ('up' or 'down') adjustment lines (see adjustment_segments),
+                with the parts that could still be adjusted drawn fainter.
                 """
-                curve_dict['xs'].append([x_left, x_right])
-                curve_dict['ys'].append([y, y])
-                curve_dict['portfolio_name'].append(row['portfolio_name'])
-                curve_dict['unit_name'].append(row['unit_name'])
-                curve_dict['unit_location'].append(row['unit_location'])
-                curve_dict['adj_bid'].append("{:0.2f}".format(y))
-                curve_dict['mwh_adjusted'].append(row['mwh_adjusted_' + adj_dir])
-                curve_dict['color'].append(colors[int(row['portfolio_id']) - 1 % len(colors)])
-                curve_dict['alpha'].append(alpha)
-                curve_dict['hover_alpha'].append(hover_alpha)
-                return curve_dict
-
-            up_adjust_curve_data = defaultdict(list)
-            mwh_running_total = 0
-            for _, row in hourly_df.iterrows():
-                x_left = mwh_running_total
-                x_right = x_left + float(row['unit_capacity'])
-                adj_left = x_right - float(row['mwh_adjusted_up'])
-                y = float(row['bid_up'])
-                if float(row['mwh_adjusted_up']) > 0:
-                    fill_multiline_data(
-                        up_adjust_curve_data, adj_left, x_right, y, row, 'up', 0.8, 1.0)
-                if float(row['mwh_produced_initially']) < float(row['unit_capacity']):
-                    fill_multiline_data(
-                        up_adjust_curve_data, x_left, adj_left, y, row, 'up', 0.2 + alpha_boost, 0.4 + alpha_boost)
-                mwh_running_total += float(row['unit_capacity'])
+                (rows, lefts, rights, is_adjusted) = adjustment_segments(hourly_df, x_lefts, x_rights, adj_dir)
+                ys = hourly_df['bid_' + adj_dir].to_numpy(dtype=float)[rows]
+                if lod_width is not None:
+                    # runs of narrow segments are drawn at their capacity-weighted mean bid, as adjusted if any
+                    # part of them was
+                    segments_df = lod_segments(pd.DataFrame({
+                        'x_left': lefts, 'x_right': rights, 'y': ys, 'is_adjusted': is_adjusted,
+                        'portfolio_id': hourly_df['portfolio_id'].to_numpy()[rows], 
+                        'portfolio_name': portfolio_names[rows], 'unit_name': unit_names[rows], 
+                        'unit_location': unit_locations[rows], 'color': unit_colors[rows],
+                        'mwh': hourly_df['mwh_adjusted_' + adj_dir].to_numpy(dtype=float)[rows]
+                    }), ['portfolio_id', 'y', 'is_adjusted'], lod_width)
+                    segment_is_adjusted = segments_df['is_adjusted'].to_numpy(dtype=bool)
+                    return {
+                        'xs': list(segments_df[['x_left', 'x_right']].to_numpy()),
+                        'ys': list(segments_df[['y_mean', 'y_mean']].to_numpy()),
+                        'portfolio_name': segments_df['portfolio_name'].to_numpy(),
+                        'unit_name': segments_df['unit_name'].to_numpy(),
+                        'unit_location': segments_df['unit_location'].to_numpy(),
+                        'adj_bid': segments_df['y_label'].to_numpy(),
+                        'mwh_adjusted': segments_df['mwh'].to_numpy(),
+                        'color': segments_df['color'].to_numpy(),
+                        'alpha': np.where(segment_is_adjusted, 0.8, 0.2 + alpha_boost),
+                        'hover_alpha': np.where(segment_is_adjusted, 1.0, 0.4 + alpha_boost)
+                    }
+                return {
+                    'xs': list(np.column_stack([lefts, rights])),
+                    'ys': list(np.column_stack([ys, ys])),
+                    'portfolio_name': portfolio_names[rows],
+                    'unit_name': unit_names[rows],
+                    'unit_location': unit_locations[rows],
+                    'adj_bid': np.char.mod('%0.2f', ys),
+                    'mwh_adjusted': hourly_df['mwh_adjusted_' + adj_dir].to_numpy(dtype=float)[rows],
+                    'color': unit_colors[rows],
+                    'alpha': np.where(is_adjusted, 0.8, 0.2 + alpha_boost),
+                    'hover_alpha': np.where(is_adjusted, 1.0, 0.4 + alpha_boost)
+                }
+
+            up_adjust_curve_data = adjustment_curve_data('up')
             up_adj_cds = ColumnDataSource(up_adjust_curve_data)
 
-            down_adjust_curve_data = defaultdict(list)
-            mwh_running_total = 0
-            for _, row in hourly_df.iterrows():
-                x_left = mwh_running_total
-                x_right = x_left + float(row['unit_capacity'])
-                adj_left = x_right - float(row['mwh_adjusted_down'])
-                y = float(row['bid_down'])
-                if float(row['mwh_adjusted_down']) > 0:
-                    fill_multiline_data(
-                        down_adjust_curve_data, adj_left, x_right, y, row, 'down', 0.8, 1.0)
-                if float(row['mwh_produced_initially']) > 0:
-                    fill_multiline_data(
-                        down_adjust_curve_data, x_left, adj_left, y, row, 'down', 0.2 + alpha_boost, 0.4 + alpha_boost)
-                mwh_running_total += float(row['unit_capacity'])
+            down_adjust_curve_data = adjustment_curve_data('down')
             down_adj_cds = ColumnDataSource(down_adjust_curve_data)
 
 
@@ -356,71 +569,179 @@ def create_hour_chart(schedule_df, hourly_df, r, h, adjustment=False, alpha_boos
     return chart
 
     
-def get_supply_demand_intercept(hourly_df, schedule_df, r, h):
-    """Returns the intersection of the supply and demand curves in the form (quantity, price)."""
-    
-    current_row = schedule_df[schedule_df['round'] == r][schedule_df['hour'] == h]
-    net = current_row.iloc[0]['net_base_demand']
-    slope = current_row.iloc[0]['slope']
-
-    if (slope == 0): # NOTE: 0 slope is interpreted as perfect inelasticity, not perfect elasticity
-        def demand_fn(quantity):
-            if (quantity < net): 
-                # quantity is insufficient, will pay any price (remember inelasticity!)
-                return np.inf # CONCERNING
-            else: 
-                # quantity is sufficient, will pay nothing
-                return -np.inf # WORRYING
+def supply_steps(hourly_df):
+    """Returns hourly_df sorted into supply curve order (by base bid, secondary sort by unit_id) and the left and
+    right MWh edges of each unit's step, from one cumulative sum of the capacities"""
+    hourly_df = hourly_df.sort_values(by=['bid_base', 'unit_id'], ascending=[True, True])
+    x_rights = np.cumsum(hourly_df['unit_capacity'].to_numpy(dtype=float))
+    x_lefts = np.concatenate(([0.0], x_rights[:-1]))
+    return hourly_df, x_lefts, x_rights
+
+def adjustment_segments(steps_df, x_lefts, x_rights, adj_dir):
+    """Returns the adj_dir ('up' or 'down') adjustment segments of a supply curve (see supply_steps): for each 
+    unit in curve order, the adjusted part of its step (if it was adjusted), followed by the part it could still
+    be adjusted by (if any). Returns (rows, lefts, rights, is_adjusted): the steps_df position of each segment's 
+    unit, its MWh edges and whether it is an adjusted part."""
+    capacities = steps_df['unit_capacity'].to_numpy(dtype=float)
+    produced_initially = steps_df['mwh_produced_initially'].to_numpy(dtype=float)
+    if adj_dir == 'up':
+        unused_capacity = produced_initially < capacities
     else:
-        def demand_fn(quantity):
-            return ((1 / slope) * (quantity - net)) # price-giving function: inverse of Q = mP + b
-
-    running_production = 0
-    intercept_price = 0
-
-    for _, unit in hourly_df.iterrows(): # HACK this is an antipattern
-        unit_capacity = unit['unit_capacity']
-        bid = unit['bid_base'] 
-
-        if (demand_fn(running_production) < bid):
-            # unit's bid price is too high, market is not interested
-            return (running_production, intercept_price)
-        else:
-            # update uniform price (recall that list of bids is sorted)
-            intercept_price = bid
-            # check if unit produces entire capacity or if demand curve intersects production step
-            if (demand_fn(running_production + unit_capacity) > bid):
-                # step fits entirely below curve
-                running_production += unit_capacity
-            else:
-                # step intersects
-                # with nonzero slope:
-                intersect_quantity = 0
-                if (slope != 0):
-                    # algebra gives quantity produced = demand_slope * bid + demand_base
-                    intersect_quantity = (bid * slope) + net
-                else:
-                    # vertical line
-                    intersect_quantity = net
-                unit_production = intersect_quantity - running_production
-                running_production += unit_production
-
-    return (running_production, intercept_price)
+        unused_capacity = produced_initially > 0
+    adjusted = steps_df['mwh_adjusted_' + adj_dir].to_numpy(dtype=float)
+    adj_lefts = x_rights - adjusted
+    # candidate segments, interleaved per unit as (adjusted, unused), then masked
+    lefts = np.column_stack([adj_lefts, x_lefts]).ravel()
+    rights = np.column_stack([x_rights, adj_lefts]).ravel()
+    keep = np.column_stack([adjusted > 0, unused_capacity]).ravel()
+    n = len(steps_df.index)
+    rows = np.repeat(np.arange(n), 2)[keep]
+    is_adjusted = np.tile([True, False], n)[keep]
+    return rows, lefts[keep], rights[keep], is_adjusted
+
+def lod_groups(x_lefts, x_rights, segments_df, exact_keys, min_width):
+    """Returns the group number of each segment (in curve order) for drawing a curve at a level of detail: 
+    consecutive segments are merged if they touch and have the same exact_keys (e.g. the same portfolio and 
+    price), or if both are narrower than min_width MWh (so less than about a pixel wide) and start in the same
+    min_width column. Wide segments with distinct keys stay separate, so the number of groups is bounded by the
+    chart's width in min_widths rather than the number of units."""
+    touches = np.isclose(x_lefts[1:], x_rights[:-1])
+    same_exact = np.ones(len(touches), dtype=bool)
+    for key in exact_keys:
+        values = segments_df[key].to_numpy()
+        same_exact &= values[1:] == values[:-1]
+    narrow = (x_rights - x_lefts) < min_width
+    columns = np.floor(x_lefts / min_width)
+    same_column = narrow[1:] & narrow[:-1] & (columns[1:] == columns[:-1])
+    merged = (touches & same_exact) | same_column
+    return np.cumsum(np.concatenate(([True], ~merged))) - 1
+
+def lod_segments(segments_df, exact_keys, min_width):
+    """Aggregates the segments in segments_df (x_left, x_right, y, portfolio_id, portfolio_name, unit_name, 
+    color, mwh and any other columns, in curve order) into the groups of lod_groups. Each group keeps its edges,
+    its first, last and width-weighted mean y, a y_label (the price or price range), the summed mwh, whether 
+    any of its segments has each flag (boolean column) and the first value of the other columns; groups of 
+    several units or portfolios are labelled with their counts and drawn in gray."""
+    x_lefts = segments_df['x_left'].to_numpy(dtype=float)
+    x_rights = segments_df['x_right'].to_numpy(dtype=float)
+    groups = lod_groups(x_lefts, x_rights, segments_df, exact_keys, min_width)
+    segments_df = segments_df.assign(width=x_rights - x_lefts, 
+                                     weighted_y=(x_rights - x_lefts) * segments_df['y'].to_numpy(dtype=float))
+    grouped = segments_df.groupby(groups, sort=True)
+    aggregated_df = grouped.agg(
+        x_left=('x_left', 'min'), x_right=('x_right', 'max'),
+        y_min=('y', 'min'), y_max=('y', 'max'), width=('width', 'sum'), weighted_y=('weighted_y', 'sum'),
+        portfolios=('portfolio_id', 'nunique'), units=('unit_name', 'size'), mwh=('mwh', 'sum'),
+        **{key: (key, 'max' if segments_df[key].dtype == bool else 'first') for key in segments_df.columns 
+           if key not in ('x_left', 'x_right', 'y', 'width', 'weighted_y', 'portfolio_id', 'mwh')}
+    )
+    # first/last y by position (groupby's 'first' would skip empty bids)
+    y = segments_df['y'].to_numpy(dtype=float)
+    group_starts = np.flatnonzero(np.diff(groups, prepend=-1))
+    aggregated_df['y_first'] = y[group_starts]
+    aggregated_df['y_last'] = y[np.append(group_starts[1:] - 1, len(groups) - 1)]
+    aggregated_df['y_mean'] = np.where(aggregated_df['width'] > 0, 
+                                       aggregated_df['weighted_y'] / aggregated_df['width'].where(aggregated_df['width'] > 0, 1), 
+                                       aggregated_df['y_first'])
+
+    y_min_label = np.char.mod('%0.2f', aggregated_df['y_min'].to_numpy(dtype=float))
+    y_max_label = np.char.mod('%0.2f', aggregated_df['y_max'].to_numpy(dtype=float))
+    aggregated_df['y_label'] = np.where(y_min_label == y_max_label, y_min_label, 
+                                        np.char.add(np.char.add(y_min_label, ' to '), y_max_label))
+    several_portfolios = aggregated_df['portfolios'] > 1
+    aggregated_df['portfolio_name'] = aggregated_df['portfolio_name'].where(
+        ~several_portfolios, aggregated_df['portfolios'].astype(str) + ' portfolios')
+    aggregated_df['unit_name'] = aggregated_df['unit_name'].where(
+        aggregated_df['units'] == 1, aggregated_df['units'].astype(str) + ' units')
+    aggregated_df['color'] = aggregated_df['color'].where(~several_portfolios, 'gray')
+    return aggregated_df.reset_index(drop=True)
+
+def lod_step_lines(segments_df):
+    """Returns the multi_line (xs, ys) of the groups of lod_segments drawn as merit order steps: flat at the 
+    group's first bid, then up to its last bid at its right edge (a group of one bid is a plain flat step)"""
+    x_rights = segments_df['x_right'].to_numpy(dtype=float)
+    y_firsts = segments_df['y_first'].to_numpy(dtype=float)
+    xs = np.column_stack([segments_df['x_left'].to_numpy(dtype=float), x_rights, x_rights])
+    ys = np.column_stack([y_firsts, y_firsts, segments_df['y_last'].to_numpy(dtype=float)])
+    return list(xs), list(ys)
+
+def get_supply_demand_intercept(bids, capacities, schedule, r, h):
+    """Returns the intersection of the supply and demand curves in the form (quantity, price), given the 
+    supply curve's bids and capacities sorted by ascending bid (ties broken by unit_id). Units without a bid
+    aren't on the supply curve; if no unit has a bid, there is no intersection (nan, nan)."""
+    current_hour = schedule[r, h]
+    has_bid = ~np.isnan(bids)
+    if not has_bid.any():
+        return (np.nan, np.nan)
+    (_, production, clearing_price) = engine.clear_merit_order(
+        bids[has_bid], capacities[has_bid], current_hour.net_base_demand, current_hour.slope)
+    return (production.sum(), clearing_price)
 
 @bp.route('/chart/summary')
 def summary_chart():
     try:
-        summary_df = pd.read_csv(os.path.join(current_app.instance_path, 'csv', 'summary.csv'))
-        p = create_summary_chart(summary_df)
-        if request.args.get('theme') == 'dark':
-            return json.dumps(json_item(p, "summary-chart", theme=Theme(json=DARK_THEME_JSON)))
-        else:
-            return json.dumps(json_item(p, "summary-chart"))
+        theme = chart_theme()
+        # the pre-rendered chart is downsampled; the full resolution chart is rendered on request
+        full_resolution = request.args.get('resolution') == 'full'
+        if not full_resolution:
+            artifact = persistence.read_chart_artifact(get_db(), 'summary', theme)
+            if artifact is not None:
+                return chart_artifact_response(artifact)
+        kind = 'summary-full' if full_resolution else 'summary'
+        return rendered_chart_response(kind, theme, lambda: render_summary_chart(theme, full_resolution), 
+                                       None, None)
     except(FileNotFoundError):
         return "Bad request. Has the game been initialized?"
 
-def create_summary_chart(summary_df):
-    """Creates a Bokeh chart of the current standings in summary.csv"""
+def render_summary_chart(theme, full_resolution=False):
+    """Returns the JSON of the summary chart, downsampled to SUMMARY_CHART_POINTS points per portfolio unless
+    full_resolution"""
+    summary_df = persistence.read_summary(current_app.instance_path, get_db())
+    max_points = None if full_resolution else current_app.config['SUMMARY_CHART_POINTS']
+    p = create_summary_chart(summary_df, max_points)
+    return chart_json(p, "summary-chart", theme)
+
+def lttb_indices(ys, n_out):
+    """Largest-triangle-three-buckets downsampling of the series ys (at x = 0, 1, ...): returns the indices of 
+    n_out points that best keep its shape. The first and last points are always kept; the points between are 
+    split into n_out - 2 buckets, and from each bucket the point forming the largest triangle with the point 
+    kept from the previous bucket and the average of the next bucket is kept."""
+    ys = np.asarray(ys, dtype=float)
+    n = len(ys)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    every = (n - 2) / (n_out - 2)
+    edges = np.append((np.floor(np.arange(n_out - 1) * every) + 1).astype(int), n)
+    indices = [0]
+    for i in range(n_out - 2):
+        (start, end) = (edges[i], edges[i + 1])
+        (next_start, next_end) = (edges[i + 1], edges[i + 2])
+        next_x = (next_start + next_end - 1) / 2
+        next_y = ys[next_start:next_end].mean()
+        a = indices[-1]
+        xs = np.arange(start, end)
+        areas = np.abs((a - next_x) * (ys[start:end] - ys[a]) - (a - xs) * (next_y - ys[a]))
+        indices.append(start + int(np.argmax(areas)))
+    indices.append(n - 1)
+    return np.array(indices)
+
+def downsample_series(ys, max_points):
+    """Returns the (xs, ys) of the series ys (at x = 0, 1, ...) downsampled to at most max_points points with 
+    lttb_indices; empty values are left out of downsampled series. Returns the series as-is if it has no more 
+    than max_points points (or max_points is None)."""
+    ys = np.asarray(ys, dtype=float)
+    if max_points is None or len(ys) <= max_points:
+        return list(range(len(ys))), ys.tolist()
+    xs = np.flatnonzero(~np.isnan(ys))
+    kept = xs[lttb_indices(ys[xs], max_points)]
+    return kept.tolist(), ys[kept].tolist()
+
+# Most x axis ticks (one per hour) shown on the summary chart; longer games get evenly spaced ticks
+SUMMARY_CHART_MAX_TICKS = 30
+
+def create_summary_chart(summary_df, max_points=None):
+    """Creates a Bokeh chart of the current standings in summary_df, with each portfolio's line downsampled to
+    max_points points (if given)"""
 
     summary_df = summary_df.sort_values(by=['round', 'hour'], ascending=[True, True])
     header_suffix = 'balance' # I suppose this could change if we wanted summary charts of other things?
@@ -443,8 +764,7 @@ def create_summary_chart(summary_df):
         starting_money = get_starting_money_by_portfolio_id(portfolio_id)
 
         # Add initial balance datapoint to lines (post-auction pre-spot markets)
-        ys = [starting_money] + selected_columns[column].tolist()
-        xs = list(range(len(ys)))
+        (xs, ys) = downsample_series([starting_money] + selected_columns[column].tolist(), max_points)
         name = get_portfolio_name_by_id(portfolio_id)
         summary_lines_data['xs'].append(xs)
         summary_lines_data['ys'].append(ys)
@@ -493,7 +813,8 @@ def create_summary_chart(summary_df):
     # https://docs.bokeh.org/en/latest/docs/reference/models/formatters.html#bokeh.models.formatters.NumeralTickFormatter
     
     # Add 1 for initial balance datapoint (post-auction pre-spot markets)
-    chart.xaxis.ticker = list(range(len(r_h) + 1)) 
+    tick_step = int(np.ceil((len(r_h) + 1) / SUMMARY_CHART_MAX_TICKS))
+    chart.xaxis.ticker = list(range(0, len(r_h) + 1, tick_step)) 
     r_h_names = ['0'] + round_hour_names(r_h)
     formatter_code = '''
         var tick_labels = {labels};
@@ -1,10 +1,68 @@
-function fetchCharts(r, h, t) {
-    fetch("/chart/hourly/r" + r +  "h" + h + "?theme=" + t)
+function fetchHourlyChart(r, h, t) {
+    var url = "/chart/hourly/r" + r +  "h" + h + "?theme=" + t;
+    if (typeof hourlyChartDetail !== 'undefined' && hourlyChartDetail == 'full') {
+        url += '&detail=full';
+    }
+    fetch(url)
         .then(function(response) { return response.json(); })
-        .then(function(item) { return Bokeh.embed.embed_item(item); })
-    fetch('/chart/summary?theme=' + t)
+        .then(function(item) { 
+            document.getElementById('hourly-chart').innerHTML = "";
+            return Bokeh.embed.embed_item(item); 
+        })
+}
+
+function fetchSummaryChart(t) {
+    var url = '/chart/summary?theme=' + t;
+    if (typeof summaryChartResolution !== 'undefined' && summaryChartResolution == 'full') {
+        url += '&resolution=full';
+    }
+    fetch(url)
         .then(function(response) { return response.json(); })
-        .then(function(item) { return Bokeh.embed.embed_item(item); })
+        .then(function(item) { 
+            document.getElementById('summary-chart').innerHTML = "";
+            return Bokeh.embed.embed_item(item); 
+        })
+}
+
+function fetchCharts(r, h, t) {
+    fetchHourlyChart(r, h, t);
+    fetchSummaryChart(t);
+}
+
+// Refreshes the values of the summary table rows of the given hours ("r/h"; all rows if hours is null)
+function fetchSummaryRows(hours) {
+    var view = document.querySelector('#select-summary-sort-form select[name="summary-view"]').value;
+    var url = '/scoreboard/summary-rows?summary-view=' + encodeURIComponent(view);
+    if (hours !== null) {
+        url += '&hours=' + encodeURIComponent(hours.join(','));
+    }
+    fetch(url)
+        .then(function(response) { return response.json(); })
+        .then(function(rows) {
+            Object.keys(rows).forEach(function(r_h) {
+                var row = document.querySelector('#summary-table-div tr[data-r-h="' + r_h + '"]');
+                if (row === null) { return; }
+                var cells = row.getElementsByTagName('td');
+                rows[r_h].forEach(function(value, i) {
+                    cells[i + 1].textContent = (value === null) ? '' : value.toFixed(2);
+                });
+            });
+        })
+}
+
+// Listens for hours being run (see /scoreboard/stream) and refetches only what they changed
+function listenForHours() {
+    if (!window.EventSource) { return; }
+    var source = new EventSource('/scoreboard/stream');
+    source.addEventListener('hour-completed', function(e) {
+        var event = JSON.parse(e.data);
+        var t = localStorage.getItem('theme');
+        if (event.hours === null || (event.round == r && event.hour == h)) {
+            fetchHourlyChart(r, h, t);
+        }
+        fetchSummaryChart(t);
+        fetchSummaryRows(event.hours);
+    });
 }
 
-var scoreboardPage = true;
\ No newline at end of file
+var scoreboardPage = true;
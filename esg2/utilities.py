@@ -1,8 +1,13 @@
 import os
+import numpy as np
 import pandas as pd
 
 from flask import current_app
 
+from esg2 import persistence
+from esg2.db import get_db
+from esg2.registry import load_portfolio_registry, load_player_registry
+
 def form_entry_to_tuple(key, value):
     """Takes in a key of the form "id-{id}-header-{header}" and a value; 
     returns a tuple ({id}, {header}, value) """
@@ -32,66 +37,84 @@ def make_pretty_header(bid_base_r_h):
         return "bad input string!"
 
 def get_game_setting(setting):
-    """Gets the setting value from the game_settings.csv file"""
-    game_settings_df = pd.read_csv(os.path.join(current_app.instance_path, 'csv', 'config', 'game_settings.csv'))
-    return game_settings_df.loc[game_settings_df['setting'] == setting]['value'].item()
+    """Gets the setting value (e.g. 'max bid') from the game's GameSettings, which are only re-parsed when 
+    game_settings.csv changes. Numeric settings are floats."""
+    return getattr(persistence.read_game_settings(current_app.instance_path), setting.replace(' ', '_'))
+
+def get_portfolio_registry():
+    """Returns the PortfolioRegistry of the portfolios.csv file (re-parsed only when the file changes)"""
+    return load_portfolio_registry(os.path.join(current_app.instance_path, 'csv', 'config', 'portfolios.csv'))
+
+def get_player_registry():
+    """Returns the PlayerRegistry of the players.csv file (re-parsed only when the file changes)"""
+    return load_player_registry(os.path.join(current_app.instance_path, 'csv', 'players.csv'))
+
+def get_schedule():
+    """Returns the game's Schedule, indexed by (round, hour) (re-parsed only when schedule.csv changes)"""
+    return persistence.read_schedule_index(current_app.instance_path)
 
 def get_portfolio_names_list():
-    """Reads portfolios.csv and returns a list of unique portfolio names"""
-    portfolios_df = pd.read_csv(os.path.join(current_app.instance_path, 'csv', 'config', 'portfolios.csv'))
-    portfolios = portfolios_df['portfolio_name'].unique()
-    return portfolios
+    """Returns a list of unique portfolio names in portfolios.csv"""
+    return get_portfolio_registry().names()
 
 def get_portfolio_name_by_id(i):
-    """Reads portfolios.csv and returns the portfolio_name with portfolio_id == id"""
-    portfolios_df = pd.read_csv(os.path.join(current_app.instance_path, 'csv', 'config', 'portfolios.csv'))
-    portfolio_name = portfolios_df.loc[portfolios_df['portfolio_id'] == i]['portfolio_name'].unique().item()
-    return portfolio_name
+    """Returns the portfolio_name in portfolios.csv with portfolio_id == id"""
+    return get_portfolio_registry().name(i)
+
+def get_portfolio_id_by_name(portfolio_name):
+    """Returns the portfolio_id in portfolios.csv with portfolio_name == portfolio_name"""
+    return get_portfolio_registry().id(portfolio_name)
 
 def get_starting_money_by_portfolio_id(i):
-    """Reads players.csv and returns the starting_money value where portfolio_id == i"""
-    players_df = pd.read_csv(os.path.join(current_app.instance_path, 'csv', 'players.csv'))
-    return players_df.loc[(players_df['portfolio_id'] == i),'starting_money'].values.astype(float)[0]
+    """Returns the starting_money value in players.csv where portfolio_id == i"""
+    return get_player_registry().starting_money[int(i)]
 
 
 def get_initialized_portfolio_names_list():
-    """Reads players and returns the list of portfolio names with an initialized player
+    """Returns the list of portfolio names with an initialized player
     (i.e. the list of portfolios that are involved in the initialized game)"""
-    players_df = pd.read_csv(os.path.join(current_app.instance_path, 'csv', 'players.csv'))
-    names = players_df['portfolio'].unique()
-    return names
+    return get_player_registry().names()
 
 def get_initialized_portfolio_ids_list():
-    """Reads players and returns the list of portfolio ids with an initialized player
+    """Returns the list of portfolio ids with an initialized player
     (i.e. the list of portfolios that are involved in the initialized game)"""
-    players_df = pd.read_csv(os.path.join(current_app.instance_path, 'csv', 'players.csv'))
-    names = players_df['portfolio_id'].unique()
-    return names
+    return get_player_registry().ids
+
+def _completed_summary_rows(summary_df):
+    """Returns summary_df sorted by round and hour, and a boolean array marking its fully-completed rows"""
+    summary_df = summary_df.sort_values(by=['round', 'hour'], ascending=[True, True])
+    return summary_df, summary_df.notnull().all(axis=1).to_numpy()
 
 def last_filled_summary_row(summary_df):
     """Returns the round and hour of the last fully-completed row in summary_df.
     If a round is not found, default to r=1, h=1"""
-    r = 1
-    h = 1
-    summary_df = summary_df.sort_values(by=['round', 'hour'], ascending=[True, True])
-    for _, row in summary_df.iterrows():
-        if not row.isnull().values.any():
-            r = row['round']
-            h = row['hour']
-    return r, h
+    summary_df, complete = _completed_summary_rows(summary_df)
+    rows = np.flatnonzero(complete)
+    if len(rows) == 0:
+        return 1, 1
+    row = summary_df.iloc[rows[-1]]
+    return int(row['round']), int(row['hour'])
 
 def first_incomplete_summary_row(summary_df):
     """Returns the round and hour of the first not-fully-completed row in summary_df.
     If a round is not found, defaults to the last row and hour"""
-    r = 1
-    h = 1
-    summary_df = summary_df.sort_values(by=['round', 'hour'], ascending=[True, True])
-    for _, row in summary_df.iterrows():
-        r = row['round']
-        h = row['hour']
-        if row.isnull().values.any():
-            return r, h
-    return r, h
+    summary_df, complete = _completed_summary_rows(summary_df)
+    if len(summary_df) == 0:
+        return 1, 1
+    rows = np.flatnonzero(~complete)
+    row = summary_df.iloc[rows[0] if len(rows) > 0 else -1]
+    return int(row['round']), int(row['hour'])
+
+def get_game_progress():
+    """Returns the game's progress cursor, a dict with the (round, hour) of the last completed hour 
+    ('last_completed') and of the next hour to run ('next_pending'). The cursor is saved whenever an hour is run;
+    games started before it existed fall back to scanning the summary."""
+    progress = persistence.read_progress(current_app.instance_path)
+    if progress is None:
+        summary_df = persistence.read_summary(current_app.instance_path, get_db())
+        progress = {'last_completed': last_filled_summary_row(summary_df), 
+                    'next_pending': first_incomplete_summary_row(summary_df)}
+    return progress
 
 def round_hour_names(schedule_df):
     """Returns a list of strings in the form r/h for each r, h in schedule_df"""
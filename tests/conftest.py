@@ -0,0 +1,33 @@
+import os
+
+import pytest
+from flask import Flask
+
+from esg2 import create_app
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    # create_app keeps the game's files in the instance folder; point it at a temporary one
+    instance_path = str(tmp_path / 'instance')
+    monkeypatch.setattr(Flask, 'auto_find_instance_path', lambda self: instance_path)
+    app = create_app({'TESTING': True, 'DATABASE': os.path.join(instance_path, 'esg2.sqlite')})
+    runner = app.test_cli_runner()
+    runner.invoke(args=['init-db'])
+    runner.invoke(args=['add-admin', 'admin', 'admin'])
+    return app
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+@pytest.fixture
+def game(app, client):
+    """A started game with two players and its first hour run; yields the app's test client, logged in as the
+    administrator"""
+    client.post('/login', data={'username': 'admin', 'password': 'admin'})
+    for (i, portfolio) in enumerate(['Big Coal', 'Big Gas']):
+        client.post('/register', data={'username': f'player{i}', 'password': 'pw', 'confirm': 'pw',
+                                       'portfolio': portfolio, 'starting_money': '-1000'})
+    client.post('/admin/start-game')
+    client.post('/admin/dashboard', data={'hour-select': '1/1'})
+    return client
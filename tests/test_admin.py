@@ -0,0 +1,49 @@
+import re
+
+from esg2 import bid_store, engine, persistence
+from esg2.db import get_db
+
+def test_dashboard_lists_scheduled_hours(app, game):
+    schedule_df = persistence.read_schedule(app.instance_path)
+    page = game.get('/admin/dashboard').get_data(as_text=True)
+    hours = re.findall(r'<option value="(\d+/\d+)"', page)
+    assert hours[:3] == ['1/1', '1/2', '1/3']
+    assert len(hours) == len(schedule_df.index)
+    # the first hour has been run, so the next one is selected
+    assert '<option value="1/2" selected>' in page
+
+def test_running_an_hour_holds_only_its_bids(app, game, monkeypatch):
+    states = []
+    clear_hour = engine.clear_hour
+    def recording_clear_hour(state, r, h):
+        states.append(state)
+        return clear_hour(state, r, h)
+    monkeypatch.setattr(engine, 'clear_hour', recording_clear_hour)
+
+    game.post('/admin/dashboard', data={'hour-select': '1/2'})
+    (state,) = states
+    assert state.bid_hours == [(1, 2)]
+    assert state.bids['base'].shape == (1, len(state.unit_ids))
+    with app.app_context():
+        committed_df = persistence.read_committed_bids(get_db())
+    assert set(zip(committed_df['round'], committed_df['hour'])) == {(1, 1), (1, 2)}
+
+def test_rerun_records_later_balances_like_a_replay(app, game):
+    game.post('/admin/dashboard', data={'hour-select': '1/2'})
+    with app.app_context():
+        db = get_db()
+        before_df = persistence.read_ledger(db, r=1, h=2)
+        bids_df = bid_store.read_bids(db, r=1, h=1, kinds=['base'])
+        bid_store.upsert_bids(db, [(unit_id, 1, 1, 'base', 0) for unit_id in bids_df['unit_id'].tolist()])
+
+    # re-running 1/1 changes the balance of 1/2, which is recorded again with all of its values
+    game.post('/admin/dashboard', data={'hour-select': '1/1'})
+    with app.app_context():
+        after_df = persistence.read_ledger(get_db(), r=1, h=2)
+    assert not after_df.isnull().any().any()
+    assert (after_df['balance'] != before_df['balance']).any()
+    assert after_df[['revenue', 'cost', 'profit']].equals(before_df[['revenue', 'cost', 'profit']])
+
+    summary = game.get('/csv/summary.csv').data
+    app.test_cli_runner().invoke(args=['replay-game', '--processes', '1'])
+    assert game.get('/csv/summary.csv').data == summary
@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+from esg2 import persistence
+
+def test_hour_supply(app, game):
+    data = game.get('/api/v1/hours/1/1/supply').get_json()
+    assert (data['api_version'], data['round'], data['hour']) == (1, 1, 1)
+    assert data['data_version'] == persistence.read_data_version(app.instance_path)
+
+    # one step per unit, tiling the curve in bid order
+    steps = data['steps']
+    assert len(set(len(column) for column in steps.values())) == 1
+    assert steps['x_left'][0] == 0
+    assert steps['x_left'][1:] == steps['x_right'][:-1]
+    assert steps['bid'] == sorted(steps['bid'])
+    assert None not in steps['mwh_produced']
+    # the default demand is inelastic, so every unit with a bid supplies up to the base demand
+    assert data['intercept']['mwh'] == pytest.approx(min(data['demand']['net_base_demand'], steps['x_right'][-1]))
+    # the default game has per unit adjustment
+    for adj_dir in ('up', 'down'):
+        adjustment = data['adjustment'][adj_dir]
+        assert len(set(len(column) for column in adjustment.values())) == 1
+        assert set(adjustment['unit_id']) <= set(steps['unit_id'])
+
+def test_hour_supply_of_an_hour_not_run(game):
+    data = game.get('/api/v1/hours/1/2/supply').get_json()
+    assert set(data['steps']['mwh_produced']) == {None}
+
+def test_hour_supply_of_unscheduled_hour_is_not_found(game):
+    assert game.get('/api/v1/hours/99/99/supply').status_code == 404
+
+def test_summary(app, game):
+    data = game.get('/api/v1/summary/profit').get_json()
+    schedule_df = persistence.read_schedule(app.instance_path)
+    assert data['metric'] == 'profit'
+    assert data['round'] == schedule_df['round'].tolist()
+    assert data['hour'] == schedule_df['hour'].tolist()
+    assert data['portfolio_id'] == [1, 2]
+    assert len(data['values']) == len(schedule_df.index)
+    # only the first hour has been run
+    assert None not in data['values'][0]
+    assert data['values'][1] == [None, None]
+
+def test_summary_of_unknown_metric_is_not_found(game):
+    assert game.get('/api/v1/summary/carbon').status_code == 404
+
+def test_balances(game):
+    data = game.get('/api/v1/balances').get_json()
+    summary = game.get('/api/v1/summary/balance').get_json()
+    assert data['hours'][:3] == ['0', '1/1', '1/2']
+    assert data['portfolio_name'] == ['Big Coal', 'Big Gas']
+    for (j, series) in enumerate(data['balance']):
+        assert series[0] == -1000
+        assert series[1] == summary['values'][0][j]
+        assert series[2] is None
+    profit = game.get('/api/v1/summary/profit').get_json()['values'][0][0]
+    assert np.isclose(data['balance'][0][1], -1000 * 1.05 + profit)
+
+def test_api_before_the_game_starts(client):
+    response = client.get('/api/v1/balances')
+    assert response.status_code == 404
+    assert response.get_json() == {'error': 'The game has not been initialized.'}
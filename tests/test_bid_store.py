@@ -0,0 +1,88 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from esg2 import bid_store
+from esg2.db import get_db
+
+@pytest.fixture
+def db(app):
+    with app.app_context():
+        db = get_db()
+        bids_df = pd.DataFrame({
+            'portfolio_id': [1, 1, 2],
+            'portfolio_name': ['Big Coal', 'Big Coal', 'Big Gas'],
+            'unit_id': [1000, 1001, 2000],
+            'unit_name': ['A', 'B', 'C'],
+            'bid_base_1_1': [10.0, np.nan, 30.0],
+            'bid_up_1_1': [1.0, 2.0, 3.0],
+            'bid_down_1_1': [1.0, 2.0, 3.0]
+        })
+        bid_store.create_bid_tables(db, bids_df, pd.DataFrame({'round': [1], 'hour': [1]}))
+        yield db
+
+def stored_bid(db, unit_id, kind):
+    bids_df = bid_store.read_bids(db, r=1, h=1, kinds=[kind])
+    return bids_df.loc[bids_df['unit_id'] == unit_id, 'value'].item()
+
+def test_upsert_bids_counts_changed_bids(db):
+    # an empty bid being filled in and a changed bid count; an unchanged bid doesn't
+    changed = bid_store.upsert_bids(db, [(1000, 1, 1, 'base', 15), (1001, 1, 1, 'base', 20),
+                                         (2000, 1, 1, 'base', 30)])
+    assert changed == 2
+    assert stored_bid(db, 1000, 'base') == 15
+    assert stored_bid(db, 1001, 'base') == 20
+
+    assert bid_store.upsert_bids(db, [(1000, 1, 1, 'base', 15), (1001, 1, 1, 'base', 20)]) == 0
+
+def test_upsert_bids_inserts_new_hours(db):
+    assert bid_store.upsert_bids(db, [(1000, 2, 1, 'base', 12)]) == 1
+    bids_df = bid_store.read_bids(db, r=2, h=1)
+    assert bids_df[['unit_id', 'kind', 'value']].values.tolist() == [[1000, 'base', 12.0]]
+
+def test_upsert_bids_ignores_unknown_and_foreign_units(db):
+    assert bid_store.upsert_bids(db, [(9999, 1, 1, 'base', 1)]) == 0
+    assert len(bid_store.read_bids(db).query('unit_id == 9999').index) == 0
+
+    # with a portfolio filter, bids of other portfolios' units are ignored
+    changed = bid_store.upsert_bids(db, [(1000, 1, 1, 'up', 5), (2000, 1, 1, 'up', 5)], portfolio_id=1)
+    assert changed == 1
+    assert stored_bid(db, 1000, 'up') == 5
+    assert stored_bid(db, 2000, 'up') == 3
+
+def test_bid_grid_orders_columns_by_hour_and_kind(db):
+    bid_store.upsert_bids(db, [(1000, 10, 1, 'base', 5), (1000, 2, 1, 'down', 6), (1000, 2, 1, 'base', 7)])
+    grid_df = bid_store.bid_grid(db)
+    # hours in numeric round/hour order (10 after 2), each with every kind in base/up/down order
+    assert grid_df.columns.tolist() == [
+        'portfolio_id', 'portfolio_name', 'unit_id', 'unit_name',
+        'bid_base_1_1', 'bid_up_1_1', 'bid_down_1_1', 'bid_base_2_1', 'bid_up_2_1', 'bid_down_2_1',
+        'bid_base_10_1', 'bid_up_10_1', 'bid_down_10_1']
+    assert grid_df['unit_id'].tolist() == [1000, 1001, 2000]
+    assert grid_df['bid_base_10_1'].tolist()[0] == 5
+    assert grid_df['bid_down_2_1'].tolist()[0] == 6
+
+def test_bid_grid_keeps_empty_bids_empty(db):
+    bid_store.upsert_bids(db, [(1000, 2, 1, 'base', 7)])
+    grid_df = bid_store.bid_grid(db, kinds=['base'])
+    assert grid_df.columns.tolist()[4:] == ['bid_base_1_1', 'bid_base_2_1']
+    # an empty bid, and units without any bid for an hour, are NaN
+    assert np.isnan(grid_df.loc[grid_df['unit_id'] == 1001, 'bid_base_1_1'].item())
+    assert grid_df['bid_base_2_1'].isnull().tolist() == [False, True, True]
+
+def test_bid_grid_filters(db):
+    bid_store.upsert_bids(db, [(1000, 2, 1, 'base', 7)])
+    grid_df = bid_store.bid_grid(db, portfolio_id=1, r=1, h=1, kinds=['up', 'base'])
+    assert grid_df['unit_id'].tolist() == [1000, 1001]
+    assert grid_df.columns.tolist()[4:] == ['bid_up_1_1', 'bid_base_1_1']
+    assert grid_df['bid_up_1_1'].tolist() == [1.0, 2.0]
+
+def test_parse_bid_header():
+    assert bid_store.parse_bid_header('bid_base_1_2') == ('base', 1, 2)
+    assert bid_store.parse_bid_header('bid_down_10_4') == ('down', 10, 4)
+
+@pytest.mark.parametrize('header', ['bid_base_1', 'bid_base_1_2_3', 'bid_side_1_1', 'cost_base_1_1', 
+                                    'bid_base_x_1', 'bid_base__1', 'portfolio_id'])
+def test_parse_bid_header_rejects_malformed_headers(header):
+    with pytest.raises(ValueError):
+        bid_store.parse_bid_header(header)
@@ -0,0 +1,97 @@
+import os
+
+import pytest
+
+from esg2.cache import FileCache, LRUCache
+from esg2.utilities import get_game_setting
+
+class CountingLoader:
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, path):
+        self.calls += 1
+        with open(path) as f:
+            return f.read()
+
+def test_file_cache_reloads_when_the_file_changes(tmp_path):
+    path = str(tmp_path / 'settings.csv')
+    with open(path, 'w') as f:
+        f.write('a')
+    (cache, loader) = (FileCache(), CountingLoader())
+    assert cache.get(path, loader) == 'a'
+    assert cache.get(path, loader) == 'a'
+    assert loader.calls == 1
+
+    # a new size
+    with open(path, 'w') as f:
+        f.write('bb')
+    assert cache.get(path, loader) == 'bb'
+    assert loader.calls == 2
+
+    # the same size, but a new mtime
+    with open(path, 'w') as f:
+        f.write('cc')
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000))
+    assert cache.get(path, loader) == 'cc'
+    assert cache.stats() == {'hits': 1, 'misses': 3, 'entries': 1}
+
+def test_file_cache_invalidation(tmp_path):
+    path = str(tmp_path / 'players.csv')
+    with open(path, 'w') as f:
+        f.write('a')
+    stat = os.stat(path)
+    (cache, loader) = (FileCache(), CountingLoader())
+    assert cache.get(path, loader) == 'a'
+
+    # a rewrite within the same mtime tick at the same size isn't noticed until the path is invalidated
+    with open(path, 'w') as f:
+        f.write('b')
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert cache.get(path, loader) == 'a'
+    cache.invalidate(path)
+    assert cache.get(path, loader) == 'b'
+
+    # entries are kept per loader; invalidate() drops all of them
+    other_loader = CountingLoader()
+    cache.get(path, other_loader)
+    assert cache.stats()['entries'] == 2
+    cache.invalidate()
+    assert cache.stats()['entries'] == 0
+
+def test_file_cache_of_missing_file(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        FileCache().get(str(tmp_path / 'missing.csv'), CountingLoader())
+
+def test_lru_cache_evicts_the_least_recently_used():
+    cache = LRUCache(max_entries=2)
+    built = []
+    def builder(value):
+        def build():
+            built.append(value)
+            return value
+        return build
+
+    assert cache.get('a', builder(1)) == 1
+    assert cache.get('b', builder(2)) == 2
+    # a hit makes 'a' the most recently used, so 'b' is evicted next
+    assert cache.get('a', builder(None)) == 1
+    assert cache.get('c', builder(3)) == 3
+    assert cache.get('a', builder(None)) == 1
+    assert cache.get('b', builder(4)) == 4
+    assert built == [1, 2, 3, 4]
+    assert cache.stats() == {'hits': 2, 'misses': 4, 'entries': 2, 'max_entries': 2}
+
+    cache.invalidate()
+    assert cache.get('a', builder(5)) == 5
+
+def test_game_settings_follow_the_settings_file(app):
+    path = os.path.join(app.instance_path, 'csv', 'config', 'game_settings.csv')
+    with app.app_context():
+        assert get_game_setting('max bid') == 500
+        with open(path) as f:
+            settings = f.read()
+        with open(path, 'w') as f:
+            f.write(settings.replace('max bid,500.00', 'max bid,250.5'))
+        assert get_game_setting('max bid') == 250.5
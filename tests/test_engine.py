@@ -0,0 +1,207 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from esg2 import engine
+
+DEFAULT_CONFIG = os.path.join(os.path.dirname(engine.__file__), 'default_config')
+
+# The reference implementations below are the per-unit loops the engine's array code replaced; the engine must
+# keep producing the same results.
+
+def reference_merit_order(bids, capacities, demand_base, demand_slope):
+    """run_initial_activation's original loop over the units, sorted by bid"""
+    if demand_slope == 0:
+        def demand_fn(quantity):
+            return np.inf if quantity < demand_base else -np.inf
+    else:
+        def demand_fn(quantity):
+            return (1 / demand_slope) * (quantity - demand_base)
+
+    running_production = 0
+    activated = []
+    production = []
+    uniform_price = 0
+    for (bid, unit_capacity) in zip(bids, capacities):
+        if demand_fn(running_production) < bid:
+            activated.append(0)
+            production.append(0)
+        else:
+            activated.append(1)
+            uniform_price = bid
+            if demand_fn(running_production + unit_capacity) > bid:
+                unit_production = unit_capacity
+            elif demand_slope != 0:
+                unit_production = (bid * demand_slope) + demand_base - running_production
+            else:
+                unit_production = demand_base - running_production
+            production.append(unit_production)
+            running_production += unit_production
+    return activated, production, uniform_price
+
+def reference_ramp(amounts, total):
+    """The original ramp loop: each unit takes as much as it can until the total is exhausted"""
+    allocation = []
+    for amount in amounts:
+        taken = min(abs(amount), total)
+        allocation.append(taken)
+        total -= taken
+    return allocation
+
+def reference_redispatch(hourly_df, surplus_zone, deficit_zone, excess, deficit):
+    """determine_active_units' original ramp-down/ramp-up loops"""
+    hourly_df = hourly_df.copy()
+    down_df = hourly_df.loc[(hourly_df['unit_location'] == surplus_zone) & (hourly_df['activated'] == 1)]
+    down_df = down_df.sort_values(by=['bid_down', 'bid_base', 'unit_id'], ascending=[True, False, False])
+    for (_, unit) in down_df.iterrows():
+        unit_production = unit['mwh_produced_initially']
+        mwh_reduced = min(abs(unit_production), excess)
+        hourly_df.loc[(hourly_df['unit_id'] == unit['unit_id']), 'mwh_adjusted_down'] = mwh_reduced
+        hourly_df.loc[(hourly_df['unit_id'] == unit['unit_id']), 'mwh_produced_base'] -= mwh_reduced
+        if mwh_reduced == unit_production:
+            hourly_df.loc[(hourly_df['unit_id'] == unit['unit_id']), 'activated'] = 0
+        excess -= mwh_reduced
+
+    up_df = hourly_df.loc[(hourly_df['unit_location'] == deficit_zone) &
+                          (hourly_df['mwh_produced_initially'] < hourly_df['unit_capacity'])]
+    up_df = up_df.sort_values(by=['bid_up', 'bid_base', 'unit_id'], ascending=[False, True, True])
+    for (_, unit) in up_df.iterrows():
+        mwh_increased = min(abs(unit['unit_capacity'] - unit['mwh_produced_initially']), deficit)
+        hourly_df.loc[(hourly_df['unit_id'] == unit['unit_id']), 'mwh_adjusted_up'] = mwh_increased
+        if mwh_increased > 0:
+            hourly_df.loc[(hourly_df['unit_id'] == unit['unit_id']), 'activated'] = 1
+        deficit -= mwh_increased
+    return hourly_df
+
+def reference_summary(state, interest_rate):
+    """update_summary's original per-hour, per-portfolio accumulation of profits into balances, chained on the
+    recorded (rounded) profits"""
+    balances = np.full((len(state.round_hours), len(state.portfolio_ids)), np.nan)
+    for (i, (r, h)) in enumerate(state.round_hours):
+        hourly_df = state.hourly[(r, h)]
+        for (j, portfolio_id) in enumerate(state.portfolio_ids):
+            profits = round(hourly_df.loc[hourly_df['portfolio_id'] == portfolio_id]['profit'].sum(), 2)
+            if i == 0:
+                balance = (1 + interest_rate) * state.starting_money[j] + profits
+            elif h == 1:
+                balance = (1 + interest_rate) * balances[i - 1, j] + profits
+            else:
+                balance = balances[i - 1, j] + profits
+            balances[i, j] = round(balance, 2)
+    return balances
+
+@pytest.mark.parametrize('seed', range(20))
+def test_clear_merit_order_matches_reference(seed):
+    rng = np.random.default_rng(seed)
+    for _ in range(50):
+        n = int(rng.integers(0, 30))
+        bids = np.sort(rng.choice([0, 10, 20, 20, 35.5, 50, 100, 500], size=n))
+        capacities = rng.choice([100, 250, 300.5, 1000], size=n)
+        demand_base = float(rng.choice([0, 100, 2500, 20000, rng.uniform(0, 8000)]))
+        demand_slope = float(rng.choice([0, 0, -1, -20, -7.3]))
+
+        (activated, production, price) = engine.clear_merit_order(bids, capacities, demand_base, demand_slope)
+        (ref_activated, ref_production, ref_price) = reference_merit_order(bids, capacities, demand_base,
+                                                                           demand_slope)
+        assert activated.tolist() == ref_activated
+        np.testing.assert_allclose(production, ref_production, atol=1e-6)
+        assert price == ref_price
+
+def test_ramp_allocation_matches_reference():
+    rng = np.random.default_rng(0)
+    for _ in range(200):
+        amounts = rng.choice([0, 50, 100, 250.5, 1000], size=int(rng.integers(0, 20)))
+        total = float(rng.uniform(0, 3000))
+        np.testing.assert_allclose(engine.ramp_allocation(amounts, total), reference_ramp(amounts, total))
+
+@pytest.mark.parametrize('seed', range(10))
+def test_redispatch_matches_reference(seed):
+    rng = np.random.default_rng(seed)
+    n = int(rng.integers(1, 30))
+    capacities = rng.choice([100, 250, 300.5, 1000], size=n)
+    activated = rng.integers(0, 2, size=n)
+    produced = np.where(activated == 1, np.round(capacities * rng.choice([0.5, 1, 1], size=n), 2), 0)
+    hourly_df = pd.DataFrame({
+        'unit_id': np.arange(1000, 1000 + n),
+        'unit_location': rng.choice(['North', 'South'], size=n),
+        'unit_capacity': capacities,
+        'bid_base': rng.choice([0, 10, 20, 35.5], size=n),
+        'bid_up': rng.choice([1, 2, 5], size=n),
+        'bid_down': rng.choice([1, 3, 5], size=n),
+        'activated': activated,
+        'mwh_produced_initially': produced,
+        'mwh_produced_base': produced,
+        'mwh_adjusted_down': 0.0,
+        'mwh_adjusted_up': 0.0
+    })
+    excess = float(rng.uniform(0, 2000))
+    deficit = float(rng.uniform(0, 2000))
+
+    result = engine.redispatch(hourly_df.copy(), 'North', 'South', excess, deficit)
+    reference = reference_redispatch(hourly_df, 'North', 'South', excess, deficit)
+    for column in ['activated', 'mwh_produced_base', 'mwh_adjusted_down', 'mwh_adjusted_up']:
+        np.testing.assert_allclose(result[column].astype(float), reference[column].astype(float), atol=1e-6)
+
+def played_state(seed, interest_rate=0.05):
+    """A MarketState of the default config with three players, random bids and every hour cleared in memory"""
+    portfolios_df = pd.read_csv(os.path.join(DEFAULT_CONFIG, 'portfolios.csv'))
+    schedule_df = pd.read_csv(os.path.join(DEFAULT_CONFIG, 'schedule.csv'))
+    players_df = pd.DataFrame({'portfolio_id': [1, 2, 3], 'starting_money': [-1000.0, -2500.0, 0.0]})
+    settings = engine.GameSettings(interest_rate=interest_rate, adjustment='per unit')
+    state = engine.MarketState(schedule_df, portfolios_df, players_df, settings)
+    rng = np.random.default_rng(seed)
+    cost = state.portfolios_df['cost_per_mwh'].to_numpy(dtype=float)
+    shape = state.bids['base'].shape
+    state.bids['base'][:] = np.round(cost + rng.choice([0, 5, 10.5, 30], size=shape), 2)
+    state.bids['up'][:] = rng.choice([1, 2, 5, 10], size=shape)
+    state.bids['down'][:] = rng.choice([3, 4, 5, 8], size=shape)
+    engine.clear_hours(state, state.round_hours, processes=1)
+    return state
+
+def test_balances_match_reference():
+    state = played_state(0)
+    for (r, h) in state.round_hours:
+        engine.update_balances(state, r, h)
+    reference = reference_summary(state, 0.05)
+    np.testing.assert_allclose(state.summary['balance'], reference, atol=1e-6)
+
+    # the one-pass replay gives the same balances as running the hours one at a time
+    replayed = played_state(0)
+    engine.update_all_balances(replayed)
+    np.testing.assert_allclose(replayed.summary['balance'], reference, atol=1e-6)
+
+def test_propagate_balances_after_rerun():
+    state = played_state(1)
+    for (r, h) in state.round_hours:
+        engine.update_balances(state, r, h)
+
+    # re-run an early hour with different bids
+    (r, h) = state.round_hours[2]
+    state.bids['base'][2] += 50
+    engine.clear_hour(state, r, h)
+    engine.update_balances(state, r, h)
+    updated = engine.propagate_balances(state, r, h)
+
+    assert updated == state.round_hours[3:]
+    np.testing.assert_allclose(state.summary['balance'], reference_summary(state, 0.05), atol=1e-6)
+
+@pytest.mark.parametrize('seed', range(5))
+def test_propagated_balances_match_replay(seed):
+    # hours after a re-run are propagated from their recorded profits; replaying the same bids from scratch
+    # must give the same balances to the cent, even when profits have fractions of a cent
+    state = played_state(seed, interest_rate=0.037)
+    state.portfolios_df['unit_capacity'] += 0.37
+    engine.clear_hours(state, state.round_hours, processes=1)
+    for (r, h) in state.round_hours:
+        engine.update_balances(state, r, h)
+    (r, h) = state.round_hours[1]
+    state.bids['base'][1] -= 3.33
+    engine.clear_hour(state, r, h)
+    engine.update_balances(state, r, h)
+    engine.propagate_balances(state, r, h)
+    propagated = state.summary['balance'].copy()
+
+    engine.update_all_balances(state)
+    np.testing.assert_array_equal(propagated, state.summary['balance'])
@@ -0,0 +1,79 @@
+import json
+import threading
+
+from esg2 import persistence, scoreboard
+from esg2.events import HourEvents
+
+def test_events_fan_out_to_every_waiting_stream():
+    events = HourEvents()
+    received = []
+    def stream():
+        received.append(events.wait(0, timeout=5))
+    streams = [threading.Thread(target=stream) for _ in range(3)]
+    for thread in streams:
+        thread.start()
+    events.publish({'hour': 1})
+    for thread in streams:
+        thread.join(timeout=5)
+    assert received == [(1, [{'hour': 1}])] * 3
+
+def test_waiting_times_out_without_events():
+    events = HourEvents()
+    events.publish('a')
+    assert events.wait(1, timeout=0.01) == (1, [])
+
+def test_streams_that_fall_behind_the_buffer_get_none():
+    events = HourEvents(max_events=3)
+    for event in 'abcde':
+        events.publish(event)
+    assert events.wait(2, timeout=0) == (5, ['c', 'd', 'e'])
+    # events 2 and earlier are gone from the buffer
+    assert events.wait(1, timeout=0) == (5, None)
+
+def event_data(message):
+    """Returns the event of a Server-Sent Events message, or None for a keepalive comment"""
+    if message.startswith(':'):
+        return None
+    (_, event_line, data_line, _, _) = message.split('\n')
+    assert event_line == 'event: hour-completed'
+    return json.loads(data_line[len('data: '):])
+
+def test_stream_sends_published_events(app, game, monkeypatch):
+    monkeypatch.setattr(scoreboard, 'hour_events', HourEvents())
+    stream = scoreboard.hour_event_stream(app.instance_path, None, keepalive=0.01)
+    assert next(stream) == ': keepalive\n\n'
+
+    event = {'round': 1, 'hour': 2, 'hours': ['1/2'], 'data_version': 1234}
+    scoreboard.hour_events.publish(event)
+    message = next(stream)
+    assert message.startswith('id: 1234\n')
+    assert event_data(message) == event
+
+def test_stream_refreshes_after_falling_behind(app, game, monkeypatch):
+    monkeypatch.setattr(scoreboard, 'hour_events', HourEvents(max_events=2))
+    stream = scoreboard.hour_event_stream(app.instance_path, None, keepalive=0.01)
+    next(stream)
+    for hour in [2, 3, 4]:
+        scoreboard.hour_events.publish({'round': 1, 'hour': hour, 'hours': [f'1/{hour}'], 'data_version': hour})
+    event = event_data(next(stream))
+    assert event['hours'] is None
+    assert event['data_version'] == persistence.read_data_version(app.instance_path)
+
+def test_stream_resumes_from_last_event_id(app, game):
+    app.config['SCOREBOARD_STREAM_KEEPALIVE'] = 0.01
+    data_version = persistence.read_data_version(app.instance_path)
+
+    # a client reconnecting with the latest event id just waits for the next one
+    response = game.get('/scoreboard/stream', headers={'Last-Event-ID': str(data_version)}, buffered=False)
+    assert response.mimetype == 'text/event-stream'
+    assert next(response.response) == b': keepalive\n\n'
+    response.close()
+
+    # an hour run while the connection was down gets a refresh as soon as the client reconnects
+    game.post('/admin/dashboard', data={'hour-select': '1/2'})
+    response = game.get('/scoreboard/stream', headers={'Last-Event-ID': str(data_version)}, buffered=False)
+    event = event_data(next(response.response).decode('utf-8'))
+    response.close()
+    assert event['hours'] is None
+    assert event['round'] == 1 and event['hour'] == 2
+    assert event['data_version'] == persistence.read_data_version(app.instance_path) != data_version
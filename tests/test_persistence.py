@@ -0,0 +1,77 @@
+import os
+
+import pandas as pd
+import pytest
+
+from esg2 import engine, persistence
+from esg2.db import get_db
+
+DEFAULT_CONFIG = os.path.join(os.path.dirname(engine.__file__), 'default_config')
+
+def test_corrupt_progress_reads_as_missing(app):
+    path = persistence.csv_path(app.instance_path, 'progress.json')
+    with open(path, 'w') as f:
+        f.write('{"data_version": ')
+    assert persistence.read_progress(app.instance_path) is None
+
+def test_save_progress_replaces_the_file(game, app):
+    # the started game has saved its progress; no temporary files are left next to it
+    progress = persistence.read_progress(app.instance_path)
+    assert progress is not None
+    assert not [name for name in os.listdir(os.path.dirname(persistence.csv_path(app.instance_path, 'progress.json')))
+                if name.endswith('.tmp')]
+
+@pytest.fixture
+def ledger_db(app):
+    with app.app_context():
+        db = get_db()
+        persistence.create_game_tables(db)
+        yield db
+
+def market_state():
+    players_df = pd.DataFrame({'portfolio_id': [1, 2], 'starting_money': [0.0, 0.0]})
+    return engine.MarketState(pd.read_csv(os.path.join(DEFAULT_CONFIG, 'schedule.csv')),
+                              pd.read_csv(os.path.join(DEFAULT_CONFIG, 'portfolios.csv')), players_df,
+                              engine.GameSettings())
+
+def record(state, db, r, h, values):
+    """Sets every summary field of round r hour h to values (one per player) and saves the changed hours"""
+    i = state.hour_index[(r, h)]
+    for field in engine.SUMMARY_FIELDS:
+        state.summary[field][i] = values
+    with db:
+        saved = persistence.save_ledger(state, db)
+    state.mark_summary_saved()
+    return saved
+
+def test_ledger_reads_the_latest_entries(ledger_db):
+    state = market_state()
+    assert record(state, ledger_db, 1, 1, [10, 20]) == [(1, 1)]
+    assert record(state, ledger_db, 1, 2, [30, 40]) == [(1, 2)]
+    # re-recording an hour appends entries rather than updating them
+    assert record(state, ledger_db, 1, 1, [11, 21]) == [(1, 1)]
+    # unchanged hours aren't appended again
+    assert record(state, ledger_db, 1, 1, [11, 21]) == []
+
+    entries = ledger_db.execute('SELECT COUNT(*) FROM ledger WHERE round = 1 AND hour = 1').fetchone()[0]
+    assert entries == 4
+    ledger_df = persistence.read_ledger(ledger_db)
+    assert ledger_df[['round', 'hour', 'portfolio_id', 'profit']].values.tolist() == [
+        [1, 1, 1, 11], [1, 1, 2, 21], [1, 2, 1, 30], [1, 2, 2, 40]]
+    ledger_df = persistence.read_ledger(ledger_db, r=1, h=1, portfolio_id=2, fields=['balance'])
+    assert ledger_df.values.tolist() == [[1, 1, 2, 21]]
+    ledger_df = persistence.read_ledger(ledger_db, from_hour=(1, 2))
+    assert ledger_df[['round', 'hour', 'portfolio_id']].values.tolist() == [[1, 2, 1], [1, 2, 2]]
+
+def test_ledger_latest_entry_is_the_highest_entry_id(ledger_db):
+    # entries recorded within the same second are told apart by entry_id, and ids are never reused, so an entry
+    # appended after the latest one was removed is still the latest
+    insert = 'INSERT INTO ledger (round, hour, portfolio_id, profit, recorded_at) VALUES (1, 1, 1, ?, ?)'
+    with ledger_db:
+        for profit in [1, 2, 3]:
+            ledger_db.execute(insert, (profit, '2020-01-01 00:00:00'))
+        ledger_db.execute('DELETE FROM ledger WHERE profit = 3')
+        ledger_db.execute(insert, (4, '2019-01-01 00:00:00'))
+    entry_ids = [row[0] for row in ledger_db.execute('SELECT entry_id FROM ledger ORDER BY entry_id')]
+    assert entry_ids == [1, 2, 4]
+    assert persistence.read_ledger(ledger_db)['profit'].tolist() == [4]
@@ -0,0 +1,52 @@
+import gzip
+import re
+
+import pytest
+
+@pytest.mark.parametrize('url', ['/csv/summary.csv', '/csv/hourly/r1h1.csv', '/chart/summary',
+                                 '/chart/hourly/r1h1', '/scoreboard/summary-rows'])
+def test_results_revalidate_with_etag(game, url):
+    response = game.get(url)
+    assert response.status_code == 200
+    etag = response.headers['ETag']
+    assert 'no-cache' in response.headers['Cache-Control']
+
+    response = game.get(url, headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+    assert response.headers['ETag'] == etag
+
+def test_etag_changes_with_results(game):
+    etag = game.get('/csv/summary.csv').headers['ETag']
+    game.post('/admin/dashboard', data={'hour-select': '1/2'})
+    response = game.get('/csv/summary.csv', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+def test_compressed_response_revalidates(game):
+    response = game.get('/chart/hourly/r1h1', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert response.headers['ETag'].startswith('W/')
+    assert gzip.decompress(response.data) == game.get('/chart/hourly/r1h1').data
+
+    etag = response.headers['ETag']
+    response = game.get('/chart/hourly/r1h1', headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+    assert response.status_code == 304
+    # the 304 answers with the same (weak) validator the compressed 200 was sent with
+    assert response.headers['ETag'] == etag
+    assert 'Accept-Encoding' in response.headers['Vary']
+
+def test_fingerprinted_static_files_are_immutable(game):
+    page = game.get('/scoreboard').get_data(as_text=True)
+    url = re.search(r'/static/[^"\']+\.js\?v=[0-9a-f]+', page).group(0)
+    response = game.get(url)
+    assert response.status_code == 200
+    assert 'immutable' in response.headers['Cache-Control']
+    assert 'max-age=31536000' in response.headers['Cache-Control']
+    assert 'Expires' not in response.headers
+
+    # without a fingerprint, the file may change under the same URL
+    response = game.get(url.split('?')[0])
+    assert 'immutable' not in response.headers['Cache-Control']
+    assert 'no-cache' in response.headers['Cache-Control']
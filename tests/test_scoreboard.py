@@ -0,0 +1,135 @@
+import math
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from esg2 import persistence, scoreboard
+from esg2.db import get_db
+from esg2.utilities import get_schedule
+
+def reference_lttb(ys, n_out):
+    """Largest-triangle-three-buckets as originally described (Steinarsson), one bucket at a time"""
+    n = len(ys)
+    every = (n - 2) / (n_out - 2)
+    a = 0
+    indices = [0]
+    for i in range(n_out - 2):
+        avg_start = int(math.floor((i + 1) * every) + 1)
+        avg_end = min(int(math.floor((i + 2) * every) + 1), n)
+        avg_x = np.mean(range(avg_start, avg_end))
+        avg_y = np.mean(ys[avg_start:avg_end])
+        (best_area, best) = (-1, None)
+        for j in range(int(math.floor(i * every) + 1), int(math.floor((i + 1) * every) + 1)):
+            area = abs((a - avg_x) * (ys[j] - ys[a]) - (a - j) * (avg_y - ys[a]))
+            if area > best_area:
+                (best_area, best) = (area, j)
+        indices.append(best)
+        a = best
+    indices.append(n - 1)
+    return indices
+
+@pytest.mark.parametrize('seed', range(10))
+def test_lttb_indices_match_reference(seed):
+    rng = np.random.default_rng(seed)
+    for _ in range(20):
+        n = int(rng.integers(4, 1500))
+        n_out = int(rng.integers(3, n))
+        ys = np.cumsum(rng.normal(size=n))
+        assert list(scoreboard.lttb_indices(ys, n_out)) == reference_lttb(ys, n_out)
+
+def test_downsample_series():
+    ys = np.cumsum(np.random.default_rng(0).normal(size=1000))
+    (xs, downsampled) = scoreboard.downsample_series(ys, 250)
+    assert len(xs) == 250
+    assert (xs[0], xs[-1]) == (0, 999)
+    np.testing.assert_array_equal(downsampled, ys[xs])
+
+    # short series are drawn as they are
+    (xs, downsampled) = scoreboard.downsample_series([1.0, 2.0, 3.0], 250)
+    assert list(xs) == [0, 1, 2]
+    assert list(downsampled) == [1.0, 2.0, 3.0]
+
+def curve_df(widths, portfolios, prices):
+    """The segments of a supply curve of units with the given widths, portfolios and prices, in that order"""
+    x_rights = np.cumsum(np.asarray(widths, dtype=float))
+    return pd.DataFrame({
+        'x_left': x_rights - np.asarray(widths, dtype=float),
+        'x_right': x_rights,
+        'y': np.asarray(prices, dtype=float),
+        'portfolio_id': portfolios,
+        'portfolio_name': [f'Portfolio {p}' for p in portfolios],
+        'unit_name': [f'Unit {i}' for i in range(len(widths))],
+        'color': [f'color{p}' for p in portfolios],
+        'mwh': np.asarray(widths, dtype=float),
+        'adjusted': [False] * (len(widths) - 1) + [True]
+    })
+
+def test_lod_groups():
+    # wide units merge only with a touching unit of the same portfolio and price; narrow units in the same
+    # 10 MWh column merge whatever their portfolio
+    segments_df = curve_df(widths=[100, 100, 100, 100, 4, 3, 4, 4, 100],
+                           portfolios=[1, 1, 1, 2, 1, 2, 3, 1, 1],
+                           prices=[10, 10, 20, 20, 25, 26, 27, 28, 28])
+    groups = scoreboard.lod_groups(segments_df['x_left'].to_numpy(), segments_df['x_right'].to_numpy(),
+                                   segments_df, ['portfolio_id', 'y'], 10)
+    assert groups.tolist() == [0, 0, 1, 2, 3, 3, 3, 4, 4]
+
+def test_lod_groups_without_aggregation():
+    # when every unit is wider than min_width and distinct, each one is its own group (the full detail curve)
+    segments_df = curve_df(widths=[50, 60, 70], portfolios=[1, 2, 1], prices=[10, 10, 10])
+    groups = scoreboard.lod_groups(segments_df['x_left'].to_numpy(), segments_df['x_right'].to_numpy(),
+                                   segments_df, ['portfolio_id', 'y'], 1)
+    assert groups.tolist() == [0, 1, 2]
+
+@pytest.mark.parametrize('seed', range(5))
+def test_lod_segments_keep_the_curve(seed):
+    rng = np.random.default_rng(seed)
+    n = 3000
+    widths = rng.choice([0.5, 1, 2, 5, 150], size=n, p=[0.3, 0.3, 0.2, 0.15, 0.05])
+    prices = np.sort(rng.choice([0, 10, 20.5, 35, 50, 100], size=n))
+    segments_df = curve_df(widths, rng.integers(1, 6, size=n), prices)
+    min_width = widths.sum() / 800
+    lod_df = scoreboard.lod_segments(segments_df, ['portfolio_id', 'y'], min_width)
+
+    # the groups tile the curve in order, without gaps or overlaps, and keep its quantities and prices
+    np.testing.assert_allclose(lod_df['x_left'].iloc[1:], lod_df['x_right'].iloc[:-1])
+    assert (lod_df['x_left'].iloc[0], lod_df['x_right'].iloc[-1]) == (0, widths.sum())
+    assert lod_df['mwh'].sum() == pytest.approx(widths.sum())
+    assert lod_df['units'].sum() == n
+    assert (lod_df['y_min'] <= lod_df['y_mean'] + 1e-9).all() and (lod_df['y_mean'] <= lod_df['y_max'] + 1e-9).all()
+    assert lod_df['adjusted'].sum() == 1
+
+    # the number of groups is bounded by the chart's width in min_widths (plus the wide units), not the units
+    wide = int((widths >= min_width).sum())
+    assert len(lod_df.index) <= 2 * wide + np.ceil(widths.sum() / min_width) + 1
+    assert len(lod_df.index) < n / 2
+
+@pytest.mark.parametrize('url', ['/chart/hourly/r99h99', '/chart/hourly/rxhy'])
+def test_hourly_chart_of_unscheduled_hour_is_not_found(game, url):
+    assert game.get(url).status_code == 404
+
+def test_hourly_sheet_of_unscheduled_hour_is_not_found(game):
+    assert game.get('/csv/hourly/r99h99.csv').status_code == 404
+    # a scheduled hour that hasn't been run yet still gets its (empty) sheet
+    assert game.get('/csv/hourly/r1h2.csv').status_code == 200
+
+def test_lod_step_lines_are_steps():
+    segments_df = curve_df(widths=[100, 4, 3, 4, 100], portfolios=[1, 1, 2, 3, 1], prices=[10, 25, 26, 27, 28])
+    lod_df = scoreboard.lod_segments(segments_df, ['portfolio_id', 'y'], 20)
+    (xs, ys) = scoreboard.lod_step_lines(lod_df)
+    assert [x.tolist() for x in xs] == [[0, 100, 100], [100, 111, 111], [111, 211, 211]]
+    # the merged run is flat at its first bid and rises to its last bid at its right edge, never a diagonal
+    assert [y.tolist() for y in ys] == [[10, 10, 10], [25, 25, 27], [28, 28, 28]]
+
+def test_lod_hourly_chart_is_drawn_in_steps(app, game):
+    with app.app_context():
+        hourly_df = persistence.read_hourly_sheet(app.instance_path, get_db(), 1, 1)
+        chart = scoreboard.create_hour_chart(get_schedule(), hourly_df, 1, 1, lod_width=500)
+    (supply_source,) = [renderer.data_source for renderer in chart.renderers 
+                        if 'bid' in renderer.data_source.data]
+    assert len(supply_source.data['xs']) < len(hourly_df.index)
+    for (xs, ys) in zip(supply_source.data['xs'], supply_source.data['ys']):
+        assert len(xs) == len(ys) == 3
+        assert xs[0] <= xs[1] == xs[2]
+        assert ys[0] == ys[1] <= ys[2]